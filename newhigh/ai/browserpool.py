@@ -0,0 +1,219 @@
+"""
+Pool of warm headless browsers for the pages that need one.
+
+The drivers are built once (build() is chatgpt.setup_driver or any function
+returning a selenium WebDriver) and kept across pages. Each page is leased
+a driver, opened with the page load strategy "eager" (get returns at
+DOMContentLoaded, images and late scripts are not waited for) and is ready
+when READY_JS says so: the document is parsed and either the preloaded
+state, a ranking row or the ranking's pager is there. A page that finished
+loading without any of them (an error page, the browser doesn't raise on a
+503) is "none" and is retried after the usual backoff instead of waiting
+out the timeout. No fixed sleep after a page; the pace is a shared rate of
+navigations per second over all drivers.
+
+blockfirefox/blockchromium put the blocking into the options before the
+browser starts: images, fonts, stylesheets and known trackers are not
+loaded. Chromium also gets BLOCKURLS through CDP Network.setBlockedURLs
+(blockcdp), firefox has no url patterns, its tracking protection is turned
+on instead.
+
+Urls go through httpcache.rewrite, so HTTPSITES points the browsers at the
+local stand-in server of scrape/fakesite.py as it does the http scrapers.
+
+A driver that raises WebDriverException other than a timeout is quit and
+built again on its next lease.
+"""
+import time
+import queue
+import threading
+import contextlib
+import concurrent.futures
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+from scrapecache import httpcache
+
+WAIT_SEC = 15
+RETRY = 3
+POLL_SEC = 0.05
+
+READY_JS = """
+if (document.readyState === "loading") return false;
+if (window.__PRELOADED_STATE__ !== undefined) return "state";
+if (document.querySelector('div#item tr[class*="RankingTable__row"]')) return "rows";
+if (document.getElementById("item") !== null && document.body.textContent.indexOf("件中") >= 0) return "pager";
+return document.readyState === "complete" ? "none" : false;
+"""
+
+TRACKERS = [
+    "*googletagmanager.com/*", "*google-analytics.com/*", "*doubleclick.net/*",
+    "*googlesyndication.com/*", "*yjtag.yahoo.co.jp/*", "*b.yjtag.jp/*",
+    "*clb.yahoo.co.jp/*", "*amazon-adsystem.com/*", "*criteo.net/*",
+]
+BLOCKURLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.css",
+] + TRACKERS
+
+def blockfirefox(opts):
+    """FirefoxOptions without images, web fonts, stylesheets and trackers"""
+    opts.page_load_strategy = "eager"
+    opts.set_preference("permissions.default.image", 2)
+    opts.set_preference("gfx.downloadable_fonts.enabled", False)
+    opts.set_preference("browser.display.use_document_fonts", 0)
+    opts.set_preference("permissions.default.stylesheet", 2)
+    opts.set_preference("privacy.trackingprotection.enabled", True)
+    opts.set_preference("media.autoplay.default", 5)
+    opts.set_preference("network.prefetch-next", False)
+    opts.set_preference("network.dns.disablePrefetch", True)
+    return opts
+
+def blockchromium(opts):
+    """ChromeOptions without images and stylesheets, blockcdp drops the rest once it runs"""
+    opts.page_load_strategy = "eager"
+    opts.add_argument("--blink-settings=imagesEnabled=false")
+    opts.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.stylesheets": 2,
+        "profile.managed_default_content_settings.fonts": 2,
+    })
+    return opts
+
+def blockcdp(driver):
+    """BLOCKURLS through CDP, for chromium drivers"""
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKURLS})
+
+class browserpool:
+    def __init__(self, build, size=2, rate=1.0, wait=WAIT_SEC, retries=RETRY, verbose=0):
+        self.build = build
+        self.size = max(1, size)
+        self.rate = rate
+        self.wait = wait
+        self.retries = retries
+        self.verbose = verbose
+        self.idle = queue.Queue()
+        self.built = 0
+        self.lock = threading.Lock()
+        self.nextat = 0
+
+    def warm(self):
+        """
+        build the drivers not built yet, in parallel. The drivers that came
+        up are pooled even when another build failed, its error is raised
+        after that and the failed ones are built again on a later lease.
+        """
+        with self.lock:
+            n = self.size - self.built
+            self.built += n
+        if n <= 0:
+            return
+        with concurrent.futures.ThreadPoolExecutor(n) as ex:
+            futures = [ex.submit(self.build) for i in range(n)]
+        error = None
+        for f in futures:
+            try:
+                self.idle.put(f.result())
+            except Exception as e:
+                with self.lock:
+                    self.built -= 1
+                error = error or e
+        if error is not None:
+            raise error
+
+    def take(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            build = self.built < self.size
+            if build:
+                self.built += 1
+        if not build:
+            return self.idle.get()
+        try:
+            return self.build()
+        except Exception:
+            with self.lock:
+                self.built -= 1
+            raise
+
+    def discard(self, driver):
+        with self.lock:
+            self.built -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def lease(self):
+        """a driver for one page, back to the pool after it or quit when it broke"""
+        driver = self.take()
+        try:
+            yield driver
+        except TimeoutException:
+            self.idle.put(driver)
+            raise
+        except WebDriverException:
+            self.discard(driver)
+            raise
+        except BaseException:
+            self.idle.put(driver)
+            raise
+        else:
+            self.idle.put(driver)
+
+    def pace(self):
+        """wait for the next navigation slot of the pool"""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.nextat)
+            self.nextat = at + 1 / self.rate
+        if at > now:
+            time.sleep(at - now)
+
+    def render(self, url):
+        """page source of url once it is ready, None when every try failed"""
+        for attempt in range(1, self.retries + 1):
+            try:
+                with self.lease() as driver:
+                    self.pace()
+                    t = time.perf_counter()
+                    driver.get(httpcache.rewrite(url))
+                    ready = WebDriverWait(driver, self.wait, poll_frequency=POLL_SEC).until(
+                        lambda d: d.execute_script(READY_JS))
+                    html = driver.page_source
+                if ready == "none":
+                    raise ValueError("no ranking in the page")
+                if self.verbose > 0:
+                    print("[browserpool] %s %s %.2fs" % (url, ready, time.perf_counter() - t))
+                return html
+            except (TimeoutException, WebDriverException, ValueError) as e:
+                print("[browserpool] fail %d/%d %s: %s" % (attempt, self.retries, url, str(e).strip()))
+                time.sleep(min(2 ** attempt, 8))
+        print("[browserpool] giving up: %s" % url)
+        return None
+
+    def renderall(self, urls, render=None):
+        """sources of urls in their order, size pages at once. render defaults to self.render"""
+        render = render or self.render
+        with concurrent.futures.ThreadPoolExecutor(self.size) as ex:
+            return list(ex.map(render, urls))
+
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
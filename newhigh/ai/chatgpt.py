@@ -4,6 +4,12 @@
 Yahoo!ファイナンス「年初来高値ランキング」から
 名称・コード・取引値・年初来高値・日付・高値 を取得し、CSV保存します。
 Selenium（Firefox優先→Chromiumフォールバック）で動的描画に対応。
+ブラウザは browserpool.py のプールで起動済みのまま使い回し、画像・フォント・CSS・
+トラッカーを読み込まず、1ページ目の件数表示から残りのページを -j 台で並行に描画する。
+HTTPSITES でローカルの fakesite.py に向けて試験できる。
+
+usage:
+  python3 chatgpt.py [-j 2] [-r 1.0] [--browser chromium] [--noblock]
 
 【前提（Ubuntu 24.04 / venv不可環境向け）】
 - selenium は apt の python3-selenium を使用
@@ -13,27 +19,25 @@ Selenium（Firefox優先→Chromiumフォールバック）で動的描画に対
 """
 
 import csv
+import argparse
 import datetime
-import time
-import random
 import os
 import tempfile
 import atexit
 import shutil
+import sys
 from pathlib import Path
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-from bs4 import BeautifulSoup
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException, TimeoutException
-from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.service import Service as FirefoxService
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from scrapecache import httpcache
+import browserpool
+import rankingparse
 
 
 # =========================
@@ -46,7 +50,7 @@ DEFAULT_UA = (
 )
 WAIT_SEC = 15          # 初回レンダリング待ち
 RETRY = 3              # ページ取得リトライ回数
-SLEEP_MIN, SLEEP_MAX = 0.8, 1.6  # アクセス間ランダム待機
+MAX_PAGES = 200
 
 
 # =========================
@@ -71,7 +75,7 @@ class StockRow:
 # =========================
 # WebDriver 構築
 # =========================
-def _build_firefox(headless: bool = True) -> webdriver.Firefox:
+def _build_firefox(headless: bool = True, block: bool = False) -> webdriver.Firefox:
     os.environ.setdefault("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
 
     ff_bin = "/snap/firefox/current/usr/lib/firefox/firefox"  # snap 実体
@@ -88,6 +92,8 @@ def _build_firefox(headless: bool = True) -> webdriver.Firefox:
     opts.add_argument(prof)
     # UA を上書き（Bot検知の軽減に寄与）
     opts.set_preference("general.useragent.override", DEFAULT_UA)
+    if block:
+        browserpool.blockfirefox(opts)
 
     drv = webdriver.Firefox(
         service=FirefoxService("/snap/bin/geckodriver"),
@@ -97,7 +103,7 @@ def _build_firefox(headless: bool = True) -> webdriver.Firefox:
     return drv
 
 
-def _build_chromium(headless: bool = False) -> webdriver.Chrome:
+def _build_chromium(headless: bool = False, block: bool = False) -> webdriver.Chrome:
     # snap 実体パス（wrapper だと不安定なケースがある）
     ch_real = "/snap/chromium/current/usr/lib/chromium-browser/chromium"
     bin_path = ch_real if os.path.exists(ch_real) else "/snap/bin/chromium"
@@ -119,18 +125,23 @@ def _build_chromium(headless: bool = False) -> webdriver.Chrome:
     if headless:
         # Ubuntu 24.04 の Chromium は new ヘッドレス対応
         opts.add_argument("--headless=new")
+    if block:
+        browserpool.blockchromium(opts)
 
     drv = webdriver.Chrome(
         service=ChromeService("/usr/bin/chromedriver"),
         options=opts
     )
     drv.set_page_load_timeout(WAIT_SEC)
+    if block:
+        browserpool.blockcdp(drv)
     return drv
 
 
-def setup_driver(prefer: str = "firefox", headless: bool = True):
+def setup_driver(prefer: str = "firefox", headless: bool = True, block: bool = False):
     """
     Firefox（snap）を優先し、失敗時に Chromium（snap）へフォールバック。
+    block=True で画像・フォント・CSS・トラッカーを読み込まない。
     """
     builders = []
     if prefer.lower().startswith("f"):
@@ -141,7 +152,7 @@ def setup_driver(prefer: str = "firefox", headless: bool = True):
     last_err: Optional[Exception] = None
     for builder in builders:
         try:
-            drv = builder(headless=headless)
+            drv = builder(headless=headless, block=block)
             return drv
         except Exception as e:
             print(f"[setup_driver] {builder.__name__} failed: {e}")
@@ -149,67 +160,6 @@ def setup_driver(prefer: str = "firefox", headless: bool = True):
     raise RuntimeError(f"WebDriver setup failed: {last_err}")
 
 
-# =========================
-# 取得 & 解析
-# =========================
-def fetch_page(driver, url: str, retries: int = RETRY) -> Optional[str]:
-    """
-    指定URLを開き、主要要素が現れるまで待機して HTML を返す。
-    """
-    for attempt in range(1, retries + 1):
-        try:
-            driver.get(url)
-            WebDriverWait(driver, WAIT_SEC).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'div#item'))
-            )
-            time.sleep(random.uniform(SLEEP_MIN, SLEEP_MAX))
-            return driver.page_source
-        except (TimeoutException, WebDriverException) as e:
-            print(f"[fetch_page] fail {attempt}/{retries}: {e}")
-            time.sleep(min(2 ** attempt, 8))
-    print(f"[fetch_page] giving up: {url}")
-    return None
-
-
-def _sel_first_text(node, selector: str, default: str = "N/A") -> str:
-    el = node.select_one(selector)
-    return el.text.strip() if el else default
-
-
-def parse_stock_data(page_source: str) -> List[StockRow]:
-    """
-    HTML からランキング行を抽出。クラス名末尾の揺れに強い CSS を使用。
-    """
-    soup = BeautifulSoup(page_source, "html.parser")
-    rows = soup.select('div#item tr[class*="RankingTable__row"]')
-    out: List[StockRow] = []
-
-    for row in rows:
-        try:
-            name = _sel_first_text(row, 'td[class*="RankingTable__detail"] a')
-            code = _sel_first_text(row, 'ul[class*="RankingTable__supplements"] li')
-
-            nums = row.select('td[class*="RankingTable__detail"] span[class*="StyledNumber__value"]')
-            def num_at(i, default="N/A"):
-                return nums[i].text.strip().replace(",", "") if len(nums) > i else default
-
-            trading_price = num_at(0)
-            ytd_high_price = num_at(1)
-            ytd_high_date  = _sel_first_text(row, 'td[class*="RankingTable__detail"] span[class*="StyledNumber__date"]', "N/A") \
-                             if len(nums) <= 2 else num_at(2)  # 後方互換
-            high_price     = num_at(3)
-
-            out.append(StockRow(
-                name=name, code=code, trading_price=trading_price,
-                ytd_high_price=ytd_high_price, ytd_high_date=ytd_high_date,
-                high_price=high_price
-            ))
-        except Exception as e:
-            print(f"[parse] row skipped: {e}")
-            continue
-    return out
-
-
 # =========================
 # 保存
 # =========================
@@ -226,30 +176,75 @@ def save_to_csv(rows: List[StockRow], out_path: Path):
 # =========================
 # メイン
 # =========================
-def main():
-    driver = setup_driver(prefer="firefox", headless=True)
-    all_rows: List[StockRow] = []
-    page = 1
+def page_url(page: int) -> str:
+    return BASE_URL if page == 1 else f"{BASE_URL}&page={page}"
+
 
-    try:
-        while True:
-            url = BASE_URL if page == 1 else f"{BASE_URL}&page={page}"
-            print(f"[crawl] page={page} -> {url}")
-            html = fetch_page(driver, url)
+def crawl(pool: browserpool.browserpool) -> Tuple[List[StockRow], bool]:
+    """
+    1ページ目の件数表示から総ページ数を求めて残りを並行に描画する。
+    件数表示が無いときは空ページまで1ページずつ進む。
+    行は埋め込みの状態(無ければDOM)から rankingparse で読む。
+    (行, 取れなかったページがあったか) を返す。
+    """
+    def render(url):
+        return httpcache.remember(url, lambda: pool.render(url))
+
+    all_rows: List[StockRow] = []
+    print(f"[crawl] page=1 -> {page_url(1)}")
+    html = render(page_url(1))
+    if not html:
+        return all_rows, True
+    first = rankingparse.parse(html)
+    all_rows.extend(StockRow(*r) for r in first.rows)
+    count = first.pagecount()
+    if count is not None:
+        urls = [page_url(p) for p in range(2, min(count, MAX_PAGES) + 1)]
+        print(f"[crawl] pages={count} drivers={pool.size}")
+        for url, html in zip(urls, pool.renderall(urls, render)):
             if not html:
-                break
-            rows = parse_stock_data(html)
-            if not rows:
-                print("[crawl] no rows; stop.")
-                break
-            all_rows.extend(rows)
-            page += 1
-    finally:
-        try:
-            driver.quit()
-        except Exception:
-            pass
+                print(f"[crawl] failed {url}; stop.")
+                return all_rows, True
+            all_rows.extend(StockRow(*r) for r in rankingparse.parse(html).rows)
+        return all_rows, False
+    page = 2
+    while first.rows and page <= MAX_PAGES:
+        url = page_url(page)
+        print(f"[crawl] page={page} -> {url}")
+        html = render(url)
+        if not html:
+            print(f"[crawl] failed {url}; stop.")
+            return all_rows, True
+        rows = rankingparse.parse(html).rows
+        if not rows:
+            print("[crawl] no rows; stop.")
+            break
+        all_rows.extend(StockRow(*r) for r in rows)
+        page += 1
+    return all_rows, False
+
 
+def main():
+    ap = argparse.ArgumentParser(description="年初来高値ランキングをブラウザで取得")
+    ap.add_argument("-v", "--verbose", help="vorbose", action="count", default=0)
+    ap.add_argument("-j", "--drivers", help="ブラウザ数(並行ページ数) default:%(default)s", type=int, default=2)
+    ap.add_argument("-r", "--rate", help="1秒あたりのページ数、0は無制限 default:%(default)s", type=float, default=1.0)
+    ap.add_argument("--browser", help="優先するブラウザ default:%(default)s", choices=["firefox", "chromium"], default="firefox")
+    ap.add_argument("--noblock", help="画像・フォント・CSS・トラッカーも読み込む", action="store_true")
+    args = ap.parse_args()
+
+    pool = browserpool.browserpool(
+        lambda: setup_driver(prefer=args.browser, headless=True, block=not args.noblock),
+        size=args.drivers, rate=args.rate, wait=WAIT_SEC, retries=RETRY, verbose=args.verbose)
+    with pool:
+        # ブラウザの起動は1ページ目を待たずに全台並行で
+        pool.warm()
+        all_rows, failed = crawl(pool)
+
+    # 欠けたページのまま保存すると下流でランキング外の日として数えられる
+    if failed or not all_rows:
+        print("データが取得できませんでした。")
+        sys.exit(1)
     today = datetime.datetime.now().strftime("%Y%m%d")
     out = Path(f"{today}.csv")
     save_to_csv(all_rows, out)
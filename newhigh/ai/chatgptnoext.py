@@ -22,6 +22,7 @@ from typing import List, Optional
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import argparse
+from scrapecache import httpcache
 
 BASE_URL = "https://finance.yahoo.co.jp/stocks/ranking/yearToDateHigh?market=all&term=daily"
 
@@ -58,10 +59,8 @@ class RowItem:
     high: str
 
 def fetch(url: str, timeout: float = 15.0) -> str:
-    req = urllib.request.Request(url, headers={"User-Agent": UA})
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        charset = resp.headers.get_content_charset() or "utf-8"
-        return resp.read().decode(charset, errors="replace")
+    resp = httpcache.urlopen(url, headers={"User-Agent": UA}, timeout=timeout)
+    return resp.body.decode(resp.charset(), errors="replace")
 
 def load_local(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
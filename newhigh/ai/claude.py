@@ -46,6 +46,7 @@ import time  # 時間操作や待機のためのライブラリ
 import logging  # ログ出力を管理するためのライブラリ
 import os  # ファイルやディレクトリを操作するためのライブラリ
 from typing import List, Dict, Optional, Tuple, Any  # 型ヒントを提供するためのライブラリ
+from scrapecache import httpcache
 
 # ロギングの設定
 # logging.basicConfigで、ログの出力レベルやフォーマット、出力先を設定します
@@ -152,7 +153,7 @@ class YahooFinanceScraper:
                 # requestsライブラリを使ってHTTP GETリクエストを送信
                 # headers: ブラウザからのアクセスに見せかけるためのヘッダー情報
                 # timeout: 30秒以内に応答がない場合はタイムアウト
-                response = requests.get(url, headers=self.HEADERS, timeout=30)
+                response = httpcache.requestsget(url, headers=self.HEADERS, timeout=30)
                 
                 # HTTPステータスコードが200番台以外の場合は例外を発生
                 response.raise_for_status()
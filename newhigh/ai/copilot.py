@@ -25,6 +25,7 @@ import csv
 import re
 from datetime import datetime
 import time
+from scrapecache import httpcache
 
 def get_stock_data(page=1):
     """
@@ -45,7 +46,7 @@ def get_stock_data(page=1):
     
     try:
         # HTTPリクエストを送信
-        response = requests.get(url, headers=headers)
+        response = httpcache.requestsget(url, headers=headers)
         response.raise_for_status()  # HTTPエラーが発生した場合は例外を発生
     except requests.exceptions.RequestException as e:
         print(f"Error accessing URL {url}: {e}")
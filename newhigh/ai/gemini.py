@@ -40,6 +40,7 @@ from datetime import datetime  # 日付と時刻を扱うためのライブラ
 import re  # 正規表現を扱うためのライブラリ
 import time  # 時間を制御するためのライブラリ
 import logging  # ログを記録するためのライブラリ
+from scrapecache import httpcache
 
 # ロギングの設定（エラーの詳細を記録）
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -70,7 +71,7 @@ def scrape_stock_data(base_url, max_pages=10):
         print(f"Scraping page {page_num}: {url}")  # どのページを処理しているかを表示
 
         try:
-            response = session.get(url, timeout=10)  # URLからHTMLを取得 (10秒でタイムアウト)
+            response = httpcache.requestsget(url, session=session, timeout=10)  # URLからHTMLを取得 (10秒でタイムアウト)
             response.raise_for_status()  # HTTPエラーが発生した場合に例外を発生させる
             soup = BeautifulSoup(response.content, "html.parser")  # HTMLを解析
         except requests.exceptions.RequestException as e:  # requests関連のエラーをキャッチ
@@ -47,6 +47,7 @@ import pandas as pd  # データを表形式で扱い、CSVに保存するため
 from datetime import datetime  # 現在の日付を取得するためのライブラリ
 import time  # 処理の間に待機時間を入れるためのライブラリ
 import logging  # 処理の進捗やエラーを記録するためのライブラリ
+from scrapecache import httpcache
 
 # ロギングの設定（処理の状況を分かりやすく表示）
 logging.basicConfig(
@@ -76,7 +77,7 @@ def fetch_page(page_num):
     url = f"{BASE_URL}&page={page_num}" if page_num > 1 else BASE_URL
     try:
         # ウェブページを取得（ヘッダーとタイムアウトを設定）
-        response = requests.get(url, headers=HEADERS, timeout=10)
+        response = httpcache.requestsget(url, headers=HEADERS, timeout=10)
         # エラーがあれば例外を発生させる
         response.raise_for_status()
         # 取得したHTMLを返す
@@ -21,6 +21,7 @@ import requests  # ウェブページ取得用
 from bs4 import BeautifulSoup  # HTML解析用
 import csv  # CSVファイル操作用
 from datetime import datetime  # 日付処理用
+from scrapecache import httpcache
 
 def fetch_page(page):
     """
@@ -36,7 +37,7 @@ def fetch_page(page):
     url = f'https://finance.yahoo.co.jp/stocks/ranking/yearToDateHigh?market=all&term=daily&page={page}'
     
     # ウェブページの取得（GETリクエスト送信）
-    response = requests.get(url)
+    response = httpcache.requestsget(url)
     
     # 取得したHTMLをBeautifulSoupで解析
     return BeautifulSoup(response.text, 'html.parser')
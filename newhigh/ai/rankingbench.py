@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+"""
+Parse benchmark of the ranking scrapers against rankingparse.
+
+Every implementation parses the same recorded pages:
+  rankingparse   rankingparse.parse, the preloaded state when the page has it
+  rankingdom     rankingparse.parsedom, the single pass over the DOM
+  chatgptnoext   parse_page (regex per row)
+  chatgpt        StockRow of rankingparse.parse, as its crawl does
+  claude         extract_stock_data + check_more_pages on one soup
+  copilot        get_stock_data, the page is served instead of fetched
+  gemini         scrape_stock_data with max_pages=1, served
+  grok           parse_page
+  perplexity     fetch_page (served) + parse_row of each row
+
+Reported per implementation: ms per page (best of -n rounds), peak
+allocated KB of one parse (tracemalloc), rows and the pages whose rows
+differ from rankingparse. Before that, the pages whose preloaded state maps
+to the same rows as the DOM, the check of STATEFIELDS on captured pages.
+An implementation whose imports are missing (bs4, selenium) is reported
+as skipped.
+
+Pages come from html files, from the ranking records of an httpcache dir
+(--cache), or are made by fakesite.py when neither is given (--nostate
+leaves the preloaded state out of them).
+
+usage:
+  python3 rankingbench.py                       synthetic 812 rows
+  python3 rankingbench.py --cache httpcache -n 20
+  python3 rankingbench.py page1.html page2.html
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+import importlib
+import contextlib
+import tracemalloc
+from scrapecache import httpcache
+import rankingparse
+
+SCRAPERS = ["chatgptnoext", "chatgpt", "claude", "copilot", "gemini", "grok", "perplexity"]
+RANKINGURL = "https://finance.yahoo.co.jp/stocks/ranking/yearToDateHigh?market=all&term=daily"
+
+class servedresponse:
+    """requests.Response stand-in for the scrapers that fetch and parse in one call"""
+    def __init__(self, html):
+        self.text = html
+        self.content = html.encode("utf-8")
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+@contextlib.contextmanager
+def served(html):
+    """httpcache.requestsget answers html, no sleeps and no prints while inside"""
+    requestsget = httpcache.requestsget
+    sleep = time.sleep
+    httpcache.requestsget = lambda url, session=None, **kw: servedresponse(html)
+    time.sleep = lambda s: None
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        httpcache.requestsget = requestsget
+        time.sleep = sleep
+
+def loadscraper(name):
+    """import newhigh/ai/<name>.py in a temp dir, claude opens its log file on import"""
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="rankingbench"))
+    try:
+        return importlib.import_module(name)
+    finally:
+        os.chdir(cwd)
+
+def adapter(name, m):
+    """function html -> rows of 6 strings for scraper module m"""
+    if name == "chatgptnoext":
+        return lambda html: [[r.name, r.code, r.price, r.prev_ytd_high, r.prev_ytd_high_date, r.high]
+                             for r in m.parse_page(html)]
+    if name == "chatgpt":
+        return lambda html: [m.StockRow(*r).as_list() for r in m.rankingparse.parse(html).rows]
+    if name == "claude":
+        def parseclaude(html):
+            scraper = m.YahooFinanceScraper()
+            soup = m.BeautifulSoup(html, "html.parser")
+            rows = scraper.extract_stock_data(soup)
+            scraper.check_more_pages(soup, 1)
+            return rows
+        return parseclaude
+    if name == "copilot":
+        def parsecopilot(html):
+            with served(html):
+                return m.get_stock_data(1)
+        return parsecopilot
+    if name == "gemini":
+        def parsegemini(html):
+            with served(html):
+                return m.scrape_stock_data(RANKINGURL, max_pages=1)
+        return parsegemini
+    if name == "grok":
+        return lambda html: [list(d.values()) for d in m.parse_page(html)]
+    if name == "perplexity":
+        def parseperplexity(html):
+            with served(html):
+                soup = m.fetch_page(1)
+            return [m.parse_row(r) for r in soup.select("tr.RankingTable__row__1Gwp")]
+        return parseperplexity
+    raise ValueError(name)
+
+def cachedpages(cachedir):
+    """bodies of the ranking pages recorded in an httpcache dir"""
+    import json
+    c = httpcache.httpcache(cachedir)
+    pages = []
+    for name in sorted(c.records()):
+        with open(name, "r") as fp:
+            meta = json.load(fp)
+        if "yearToDateHigh" in meta["url"]:
+            pages.append(httpcache.response(meta["url"], c.body(meta), meta["headers"]).text(errors="replace"))
+    return pages
+
+def syntheticpages(rows, state=True):
+    import fakesite
+    codes = [1300 + i * 7 for i in range(rows)]
+    today = datetime.date.today().toordinal()
+    pages = []
+    for page in range(1, -(-rows // fakesite.RANKINGPAGE) + 1):
+        pages.append(fakesite.rankingpage(codes, today, page, state)[0])
+    return pages
+
+def bench(parse, pages, rounds):
+    """(seconds per page, peak KB, outputs)"""
+    outputs = [parse(html) for html in pages]
+    best = None
+    for i in range(rounds):
+        t = time.perf_counter()
+        for html in pages:
+            parse(html)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    peak = 0
+    for html in pages:
+        tracemalloc.start()
+        parse(html)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best / len(pages), peak / 1024, outputs
+
+def report(name, seconds, peak, outputs, reference):
+    rows = sum(len(o) for o in outputs)
+    differ = sum(1 for o, r in zip(outputs, reference) if [list(x) for x in o] != r)
+    print("%-14s %9.3f ms/page %9.1f KB peak %6d rows  %s" % (
+        name, seconds * 1000, peak, rows, "same" if differ == 0 else "differs on %d pages" % differ))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Parse benchmark of the ranking scrapers")
+    ap.add_argument("-n", "--rounds", help="timed rounds, the best is reported default:%(default)s", type=int, default=5)
+    ap.add_argument("--cache", help="httpcache dir with recorded ranking pages", default=None)
+    ap.add_argument("--rows", help="rows of the synthetic ranking default:%(default)s", type=int, default=812)
+    ap.add_argument("--nostate", help="synthetic pages without the preloaded state", action="store_true")
+    ap.add_argument("pages", help="html files of ranking pages", nargs="*")
+    args = ap.parse_args()
+
+    if args.pages:
+        pages = []
+        for filename in args.pages:
+            with open(filename, "r", encoding="utf-8") as fp:
+                pages.append(fp.read())
+    elif args.cache:
+        pages = cachedpages(args.cache)
+    else:
+        pages = syntheticpages(args.rows, not args.nostate)
+    if not pages:
+        sys.stderr.write("no pages\n")
+        sys.exit(1)
+    print("%d pages %d bytes" % (len(pages), sum(len(p) for p in pages)))
+    states = [rankingparse.parsestate(p) for p in pages]
+    print("state on %d pages, all rows equal to the DOM on %d, parse took the state on %d" % (
+        sum(1 for st in states if st is not None),
+        sum(1 for st, p in zip(states, pages) if st is not None and st.rows == rankingparse.parsedom(p).rows),
+        sum(1 for p in pages if rankingparse.parse(p).source == "state")))
+
+    seconds, peak, reference = bench(lambda html: rankingparse.parse(html).rows, pages, args.rounds)
+    report("rankingparse", seconds, peak, reference, reference)
+    seconds, peak, outputs = bench(lambda html: rankingparse.parsedom(html).rows, pages, args.rounds)
+    report("rankingdom", seconds, peak, outputs, reference)
+    for name in SCRAPERS:
+        try:
+            m = loadscraper(name)
+        except ImportError as e:
+            print("%-14s skipped: %s" % (name, e))
+            continue
+        seconds, peak, outputs = bench(adapter(name, m), pages, args.rounds)
+        report(name, seconds, peak, outputs, reference)
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""
+Concurrent crawl of the yahoo yearToDateHigh ranking into <YYYYMMDD>.csv.
+
+Page 1 is fetched first, its pager ("1〜50件 / 812件中") gives the number of
+pages, and pages 2..N are fetched at once, -j in flight and -r requests per
+second, through asyncfetch and crawlsched (429/403 back off, 5xx and
+timeouts are retried). Rows are merged in page order, so the file is in
+rank order as the sequential scrapers write it, and no empty page after the
+last one is requested. When page 1 has no pager the pages are walked one by
+one until an empty page, as before.
+
+A page that can't be fetched leaves no file: a snapshot with missing rows
+would count as days off the ranking in newhighdays/pickupcode.
+
+usage:
+  python3 rankingcrawl.py -j 4 -r 2
+  python3 rankingcrawl.py -o 20240105.csv --cache httpcache
+"""
+import os
+import sys
+import csv
+import time
+import asyncio
+import argparse
+import datetime
+from scrapecache import httpcache
+import asyncfetch
+import crawlsched
+import rankingparse
+
+BASE_URL = "https://finance.yahoo.co.jp/stocks/ranking/yearToDateHigh?market=all&term=daily"
+RANKINGHOST = "finance.yahoo.co.jp"
+UA = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+      "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36")
+
+def pageurl(page):
+    return BASE_URL if page == 1 else "%s&page=%d" % (BASE_URL, page)
+
+class rankingcrawl:
+    """pages of the ranking as they come in, rows() merges them in page order"""
+    def __init__(self, maxpages=200, verbose=0):
+        self.maxpages = maxpages
+        self.verbose = verbose
+        self.pages = {}
+        self.total = None
+        self.pagecount = None
+
+    def handle(self, sched, j, html):
+        page = rankingparse.parse(html)
+        self.pages[j.page] = page.rows
+        if self.verbose > 0:
+            print("page %d %d rows" % (j.page, len(page.rows)))
+        if j.page == 1:
+            self.total = page.total
+            self.pagecount = page.pagecount()
+            if self.pagecount is not None:
+                for p in range(2, min(self.pagecount, self.maxpages) + 1):
+                    sched.add(crawlsched.job(RANKINGHOST, "ranking", p))
+                return
+        if self.pagecount is None and page.rows and j.page < self.maxpages:
+            # no pager, walk on until an empty page
+            sched.add(crawlsched.job(RANKINGHOST, "ranking", j.page + 1))
+
+    def rows(self):
+        """rows in rank order, a code seen on an earlier page is dropped (the ranking moved while paging)"""
+        seen = set()
+        rows = []
+        for p in sorted(self.pages):
+            for r in self.pages[p]:
+                if r[1] in seen:
+                    continue
+                seen.add(r[1])
+                rows.append(r)
+        return rows
+
+async def crawl(args):
+    """(rows, failed jobs, total), total is the ranking size of page 1 or None when it never came"""
+    sched = crawlsched.scheduler(ratedelay=args.ratedelay)
+    fetch = asyncfetch.fetcher(concurrency=args.concurrency, rate=args.rate, headers={"User-Agent": UA})
+    ranking = rankingcrawl(args.maxpages, args.verbose)
+    sched.add(crawlsched.job(RANKINGHOST, "ranking", 1))
+
+    async def fetchjob(j):
+        return await fetch.get(pageurl(j.page))
+
+    try:
+        await crawlsched.runasync(sched, fetchjob, lambda j, html: ranking.handle(sched, j, html),
+                                  args.concurrency, args.verbose)
+    finally:
+        fetch.close()
+    if ranking.total is not None and args.verbose > 0:
+        print("total %d pages %s" % (ranking.total, ranking.pagecount))
+    return ranking.rows(), sched.failed, ranking.total
+
+def writecsv(filename, rows):
+    tmpname = filename + ".tmp%d" % os.getpid()
+    with open(tmpname, "w", newline="", encoding="utf-8-sig") as wfp:
+        writer = csv.writer(wfp)
+        writer.writerow(rankingparse.HEADER)
+        writer.writerows(rows)
+    os.replace(tmpname, filename)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Concurrent crawl of the year-to-date high ranking")
+    ap.add_argument("-v", "--verbose", help="vorbose", action="count", default=0)
+    ap.add_argument("-j", "--concurrency", help="pages in flight default:%(default)s", type=int, default=4)
+    ap.add_argument("-r", "--rate", help="requests per second, 0 is unlimited default:%(default)s", type=float, default=2.0)
+    ap.add_argument("--ratedelay", help="first backoff seconds on 429/403 default:%(default)s", type=float, default=60)
+    ap.add_argument("--maxpages", help="pages at most default:%(default)s", type=int, default=200)
+    ap.add_argument("-o", "--out", help="output csv default:<today>.csv", default=None)
+    httpcache.addarguments(ap)
+    args = ap.parse_args()
+    if args.verbose > 0:
+        print(args)
+    httpcache.configureargs(args)
+    t = time.perf_counter()
+    rows, failed, total = asyncio.run(crawl(args))
+    for j, e in failed:
+        print("failed page %d %s" % (j.page, e))
+    if failed or not rows:
+        print("データが取得できませんでした。")
+        sys.exit(1)
+    if total is not None and len(rows) != total:
+        print("rows %d total %d (ranking moved while paging)" % (len(rows), total))
+    out = args.out or "%s.csv" % datetime.datetime.now().strftime("%Y%m%d")
+    writecsv(out, rows)
+    print("%d件を %s に保存しました。 %.1fs" % (len(rows), out, time.perf_counter() - t))
@@ -0,0 +1,240 @@
+"""
+Parser of the yahoo yearToDateHigh ranking page.
+
+The rows are read from the page's window.__PRELOADED_STATE__ first, as
+getyahoostock.findhistories reads the history pages: only the
+mainRankingList.results array is decoded, in place with raw_decode, and
+its items are mapped to the row columns by the explicit key paths of
+STATEFIELDS. The paths are those of fakesite.py and are not confirmed on a
+captured page, so the state is only used when its first row equals the
+first row of the DOM (the DOM parser stopped after one row). When the
+state is missing, an item lacks a column or the first rows differ, the
+page is parsed from the DOM. rankingbench.py on captured pages (--cache or
+html files) shows which source a page took.
+
+The DOM parser is a single pass: a cursor moves once through the page with str.find, from one ranking row
+(tr RankingTable__row__*) to the next. In a row it takes the first a
+(name), the li RankingTable__supplement__* (code) and the span
+StyledNumber__value__* (price, previous year-to-date high, its date, high).
+The pager "1〜50件 / 812件中" gives the total. Class names are matched on
+their prefix, the hash suffix changes when the site is rebuilt, and only
+inside a tr start tag, the same names appear in the page's css.
+
+Rows are [名称, コード, 取引値, 前営業日までの年初来高値, 前営業日までの年初来高値の日付, 高値]
+with the commas of the numbers removed, as the scrapers write them. A row
+with fewer than 4 values is skipped.
+
+usage:
+  python3 rankingparse.py page.html [page2.html ...]     csv to stdout
+"""
+import re
+import sys
+import csv
+import json
+from html import unescape
+
+HEADER = ["名称", "コード", "取引値", "前営業日までの年初来高値", "前営業日までの年初来高値の日付", "高値"]
+
+ROWCLASS = "RankingTable__row__"
+CODECLASS = "RankingTable__supplement__"
+VALUECLASS = "StyledNumber__value__"
+PAGERMARK = "件中"
+
+STATEMARK = "window.__PRELOADED_STATE__"
+RANKINGKEY = '"mainRankingList"'
+# column -> key paths in a results item, the first present one is used
+STATEFIELDS = [
+    ("name", (("stockName",),)),
+    ("code", (("stockCode",),)),
+    ("price", (("savePrice",),)),
+    ("prevhigh", (("rankingResult", "previousYearToDateHighPrice"),)),
+    ("prevhighdate", (("rankingResult", "previousYearToDateHighDate"),)),
+    ("high", (("rankingResult", "highPrice"),)),
+]
+
+stripre = re.compile(r'<[^>]*>')
+resultsre = re.compile(r'"results"\s*:\s*')
+jsondecoder = json.JSONDecoder()
+pagerre = re.compile(r'(\d+)〜(\d+)件 / (\d+)件中')
+
+def element(html, start, tag):
+    """(text, end) of the element whose start tag holds start, inner tags dropped and entities decoded"""
+    gt = html.find(">", start)
+    if gt < 0:
+        return "", len(html)
+    close = html.find("</" + tag, gt)
+    if close < 0:
+        close = len(html)
+    s = html[gt + 1:close]
+    if "<" in s:
+        s = stripre.sub("", s)
+    if "&" in s:
+        s = unescape(s)
+    return s.strip(), close
+
+class rankingpage:
+    """rows of one ranking page and the pager numbers, None when there is no pager"""
+    def __init__(self):
+        self.rows = []
+        self.first = None
+        self.last = None
+        self.total = None
+        self.source = None
+
+    def more(self):
+        """pages after this one, from the pager, None when it is unknown"""
+        if self.total is None:
+            return None
+        return self.last < self.total
+
+    def pagecount(self, perpage=None):
+        """
+        pages of the whole ranking, perpage defaults to the rows of this page
+        (page 1). None without a pager or rows.
+        """
+        perpage = perpage or len(self.rows)
+        if self.total is None or not perpage:
+            return None
+        return -(-self.total // perpage)
+
+def makerow(name, code, values):
+    return [name or "", code or "",
+            values[0].replace(",", ""), values[1].replace(",", ""),
+            values[2], values[3].replace(",", "")]
+
+def pager(page, html):
+    i = html.find(PAGERMARK)
+    if i < 0:
+        return
+    t = pagerre.search(html, max(0, i - 40), i + len(PAGERMARK))
+    if t:
+        page.first, page.last, page.total = map(int, t.groups())
+
+def parserow(row):
+    """[name, code, values] of the html of one tr"""
+    a = row.find("<a ")
+    if a < 0:
+        a = row.find("<a>")
+    name = element(row, a, "a")[0] if a >= 0 else ""
+    c = row.find(CODECLASS)
+    code = element(row, c, "li")[0] if c >= 0 else ""
+    values = []
+    p = row.find(VALUECLASS)
+    while p >= 0:
+        v, p = element(row, p, "span")
+        values.append(v)
+        p = row.find(VALUECLASS, p)
+    return name, code, values
+
+def findresults(html):
+    """mainRankingList.results of the preloaded state, None when the page has no such state"""
+    p = html.find(STATEMARK)
+    if p < 0:
+        return None
+    p = html.find(RANKINGKEY, p)
+    if p < 0:
+        return None
+    t = resultsre.search(html, p + len(RANKINGKEY))
+    if not t:
+        return None
+    try:
+        results, ep = jsondecoder.raw_decode(html, t.end())
+    except ValueError:
+        return None
+    if not isinstance(results, list):
+        return None
+    return results
+
+def statevalue(v):
+    """text of a state value as the DOM shows it, commas dropped and dates with /"""
+    if isinstance(v, str):
+        v = v.strip().replace(",", "")
+        if len(v) == 10 and v[4] == "-" and v[7] == "-":
+            v = v.replace("-", "/")
+        return v
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return None
+    return str(v)
+
+def statelookup(item, path):
+    """value at path (keys from the item's top level), None when a key is missing"""
+    v = item
+    for k in path:
+        if not isinstance(v, dict) or k not in v:
+            return None
+        v = v[k]
+    return v
+
+def staterow(item):
+    """row of one results item, None when a column is missing"""
+    if not isinstance(item, dict):
+        return None
+    row = []
+    for column, paths in STATEFIELDS:
+        v = None
+        for path in paths:
+            v = statelookup(item, path)
+            if v is not None:
+                break
+        v = statevalue(v) if v is not None else None
+        if v is None:
+            return None
+        row.append(v)
+    return row
+
+def parsestate(html):
+    """rankingpage from the preloaded state, None to fall back to the DOM"""
+    results = findresults(html)
+    if results is None:
+        return None
+    page = rankingpage()
+    page.source = "state"
+    for item in results:
+        row = staterow(item)
+        if row is None:
+            return None
+        page.rows.append(row)
+    pager(page, html)
+    return page
+
+def parse(html):
+    """rankingpage of html, from the preloaded state when it agrees with the DOM, or else the DOM"""
+    page = parsestate(html)
+    if page is not None:
+        first = parsedom(html, 1).rows
+        if not first or page.rows[:1] == first:
+            return page
+    return parsedom(html)
+
+def parsedom(html, limit=None):
+    """rankingpage of the DOM of html, limit stops after that many rows"""
+    page = rankingpage()
+    page.source = "dom"
+    pager(page, html)
+    pos = 0
+    while True:
+        i = html.find(ROWCLASS, pos)
+        if i < 0:
+            break
+        lt = html.rfind("<", 0, i)
+        if not html.startswith("<tr", lt) or html.find(">", lt) < i:
+            # not the class of a tr start tag
+            pos = i + len(ROWCLASS)
+            continue
+        end = html.find("</tr>", i)
+        if end < 0:
+            end = len(html)
+        name, code, values = parserow(html[lt:end])
+        if len(values) >= 4:
+            page.rows.append(makerow(name, code, values))
+            if limit is not None and len(page.rows) >= limit:
+                break
+        pos = end
+    return page
+
+if __name__ == "__main__":
+    writer = csv.writer(sys.stdout)
+    writer.writerow(HEADER)
+    for filename in sys.argv[1:]:
+        with open(filename, "r", encoding="utf-8") as fp:
+            writer.writerows(parse(fp.read()).rows)
@@ -0,0 +1,18 @@
+"""
+scrape/ on the module path and its httpcache, for the scripts of newhigh/ai.
+
+  from scrapecache import httpcache
+
+HTTPCACHE=<dir> keeps the fetched pages on disk (see scrape/httpcache.py)
+and HTTPSITES sends them to the local stand-in server of scrape/fakesite.py.
+The other modules of scrape/ (asyncfetch, crawlsched, fakesite) can be
+imported after this one.
+"""
+import os
+import sys
+
+SCRAPEDIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scrape"))
+if SCRAPEDIR not in sys.path:
+    sys.path.append(SCRAPEDIR)
+
+import httpcache
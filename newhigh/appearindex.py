@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+新高値スナップショット(YYYYMMDD.csv)の出現インデックス
+
+コード毎に営業日(ファイル)を1ビットとする整数のビット列を持つ。
+日付順でi番目のファイルにコードがあれば bit i が立つ。
+期間内の出現回数は窓のマスクとのANDの bit_count、ある日に
+あるかどうかはそのビットを見るだけで、CSVを読み直さない。
+
+<datadir>/appearindex.json に保存し、次回からは増えたファイルだけを読む。
+大きさかmtimeが変わった日はその日のビットだけを読み直し、途中の日が
+増えた・消えたときはその日から後を読み直す。
+store (snapshotstore.py) を渡すとCSVではなくストアの日を読む。インデックスは
+<storedir>/appearindex.json に置く。
+
+usage:
+  python3 appearindex.py update [-d datadir]
+  python3 appearindex.py show 1301 7203 [-d datadir]
+  python3 appearindex.py update -s newhighstore
+"""
+import os
+import re
+import sys
+import csv
+import json
+import bisect
+import argparse
+
+DATA_DIR = "/hddhome/home/jun/stock/newhigh"
+INDEXNAME = "appearindex.json"
+INDEXVERSION = 1
+
+# スクレイパー毎に違う列名 (perplexity.py は 前営業日高値/高値日付)
+COLUMNALIASES = {
+    "前営業日高値": "前営業日までの年初来高値",
+    "高値日付": "前営業日までの年初来高値の日付",
+}
+
+snapshotre = re.compile(r"^\d{8}\.csv$")
+
+def snapshotfiles(datadir):
+    """YYYYMMDD.csv を日付順に"""
+    return sorted(f for f in os.listdir(datadir) if snapshotre.match(f))
+
+def readsnapshot(filepath):
+    """行を列名→値の辞書で返す。BOMの有無、列名の空白と別名を吸収する"""
+    with open(filepath, newline="", encoding="utf-8-sig") as fp:
+        reader = csv.reader(fp)
+        header = next(reader, None)
+        if header is None:
+            return []
+        names = [COLUMNALIASES.get(h.strip(), h.strip()) for h in header]
+        return [dict(zip(names, (v.strip() for v in row))) for row in reader if row]
+
+def snapshotcodes(filepath):
+    """ファイルにあるコード、'コード' 列の無いファイルは空"""
+    with open(filepath, newline="", encoding="utf-8-sig") as fp:
+        reader = csv.reader(fp)
+        header = [h.strip() for h in next(reader, [])]
+        if "コード" not in header:
+            return []
+        col = header.index("コード")
+        return [row[col].strip() for row in reader if len(row) > col]
+
+class appearindex:
+    def __init__(self, datadir=DATA_DIR, indexfile=None, store=None):
+        self.datadir = datadir
+        self.store = store
+        if store is not None:
+            self.datadir = store.path
+        self.indexfile = indexfile or os.path.join(self.datadir, INDEXNAME)
+        self.days = []     # [日付, 大きさ, mtime] 日付順、ストアでは [日付, 行数, 位置]
+        self.bits = {}     # コード -> ビット列
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        self.days = []
+        self.bits = {}
+        try:
+            with open(self.indexfile, "r") as fp:
+                saved = json.load(fp)
+            if saved.get("version") != INDEXVERSION:
+                return
+            self.days = saved["days"]
+            self.bits = {code: int(b, 16) for code, b in saved["bits"].items()}
+        except (OSError, ValueError, KeyError):
+            self.days = []
+            self.bits = {}
+
+    def save(self):
+        """一時ファイル経由で書く、変わっていなければ何もしない"""
+        if not self.dirty:
+            return
+        tmpname = self.indexfile + ".tmp%d" % os.getpid()
+        with open(tmpname, "w") as fp:
+            json.dump({"version": INDEXVERSION, "days": self.days,
+                       "bits": {code: "%x" % b for code, b in self.bits.items()}}, fp)
+        os.replace(tmpname, self.indexfile)
+        self.dirty = False
+
+    def clearday(self, i):
+        mask = ~(1 << i)
+        for code in list(self.bits):
+            b = self.bits[code] & mask
+            if b:
+                self.bits[code] = b
+            else:
+                del self.bits[code]
+
+    def truncate(self, n):
+        """最初のn日だけ残す"""
+        mask = (1 << n) - 1
+        for code in list(self.bits):
+            b = self.bits[code] & mask
+            if b:
+                self.bits[code] = b
+            else:
+                del self.bits[code]
+        del self.days[n:]
+        self.dirty = True
+
+    def daycodes(self, i):
+        """i日目のコード、CSVかストアから"""
+        if self.store is not None:
+            return self.store.codes(int(self.days[i][0]))
+        return snapshotcodes(self.filepath(i))
+
+    def addday(self, i):
+        bit = 1 << i
+        for code in self.daycodes(i):
+            self.bits[code] = self.bits.get(code, 0) | bit
+
+    def sources(self):
+        """今ある日の [日付, 大きさ, mtime] (ストアでは [日付, 行数, 位置])"""
+        if self.store is not None:
+            return [["%d" % d["date"], d["rows"], d["offset"]] for d in self.store.days]
+        stats = []
+        for f in snapshotfiles(self.datadir):
+            st = os.stat(os.path.join(self.datadir, f))
+            stats.append([f[:-4], st.st_size, st.st_mtime_ns])
+        return stats
+
+    def refresh(self):
+        """ディレクトリかストアに合わせて更新し、読んだ日数を返す"""
+        stats = self.sources()
+        keep = 0
+        while keep < min(len(stats), len(self.days)) and stats[keep][0] == self.days[keep][0]:
+            keep += 1
+        if keep < len(self.days):
+            # 日が増えた・消えた位置から後はビットの位置がずれるので捨てて読み直す
+            self.truncate(keep)
+        read = 0
+        for i, s in enumerate(stats):
+            if i < len(self.days):
+                if self.days[i] == s:
+                    continue
+                self.clearday(i)
+                self.days[i] = s
+            else:
+                self.days.append(s)
+            self.addday(i)
+            self.dirty = True
+            read += 1
+        return read
+
+    def dates(self):
+        return [d[0] for d in self.days]
+
+    def span(self, start=None, end=None):
+        """日付 start..end (YYYYMMDD、両端含む、None は端まで) の添字 (first, last)"""
+        dates = self.dates()
+        first = bisect.bisect_left(dates, start) if start else 0
+        last = bisect.bisect_right(dates, end) - 1 if end else len(dates) - 1
+        return first, last
+
+    def filepath(self, i):
+        return os.path.join(self.datadir, self.days[i][0] + ".csv")
+
+    @staticmethod
+    def mask(first, last):
+        """日 first..last (添字、両端含む) のマスク"""
+        if last < first:
+            return 0
+        return ((1 << (last - first + 1)) - 1) << first
+
+    def present(self, code, i):
+        return (self.bits.get(code, 0) >> i) & 1 == 1
+
+    def count(self, code, first, last):
+        return (self.bits.get(code, 0) & self.mask(first, last)).bit_count()
+
+    def counts(self, first, last):
+        """日 first..last に出現したコード -> 回数"""
+        m = self.mask(first, last)
+        result = {}
+        for code, b in self.bits.items():
+            n = (b & m).bit_count()
+            if n:
+                result[code] = n
+        return result
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="新高値スナップショットの出現インデックス")
+    ap.add_argument("command", choices=["update", "show"])
+    ap.add_argument("codes", help="銘柄コード", nargs="*")
+    ap.add_argument("-d", "--datadir", help="CSVファイルのディレクトリ default:%(default)s", default=DATA_DIR)
+    ap.add_argument("-i", "--index", help="インデックスファイル default:<datadir>/" + INDEXNAME, default=None)
+    ap.add_argument("-s", "--store", help="CSVの代わりに読む snapshotstore のディレクトリ", default=None)
+    args = ap.parse_args()
+    store = None
+    if args.store:
+        import snapshotstore
+        store = snapshotstore.snapshotstore(args.store)
+    elif not os.path.isdir(args.datadir):
+        sys.stderr.write("%s doesn't exists\n" % args.datadir)
+        sys.exit(1)
+    index = appearindex(args.datadir, args.index, store)
+    read = index.refresh()
+    index.save()
+    dates = index.dates()
+    if args.command == "update":
+        print("days %d codes %d read %d" % (len(dates), len(index.bits), read))
+    elif args.command == "show":
+        for code in args.codes:
+            b = index.bits.get(code, 0)
+            print(code, b.bit_count(), " ".join(d for i, d in enumerate(dates) if (b >> i) & 1))
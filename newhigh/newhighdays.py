@@ -1,9 +1,23 @@
 #!/usr/bin/env python3
+"""
+銘柄毎の新高値日数 (DATA_DIR のスナップショットに出た日数)
+
+日数は appearindex.py のインデックスから数える。インデックスはファイル名・
+大きさ・mtime で日毎に覚えているので、毎日の実行で読むのは増えたファイル
+だけ。-s/-e の期間もインデックスのビット演算で、古いCSVは読まない。
+--store でCSVの代わりに snapshotstore.py のストアを読む (銘柄は最後の日の行)。
+
+usage:
+  python3 newhighdays.py [target.csv] [-s 20240101] [-e 20241231]
+"""
 import os
 import sys
 import csv
+import argparse
+import appearindex
+import snapshotstore
 
-DATA_DIR = "/hddhome/home/jun/stock/newhigh"
+DATA_DIR = appearindex.DATA_DIR
 
 def get_latest_file():
     """最新日付のCSVファイルを取得"""
@@ -30,34 +44,55 @@ def read_csv(filepath):
             result.append((row[name_col].strip(), row[code_col].strip()))
     return result
 
-def count_newhigh_days(codes):
-    """全ファイルから各コードの新高値日数をカウント"""
-    counts = {code: {"name": name, "days": 0} for name, code in codes}
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith(".csv")]
-    for f in files:
-        with open(os.path.join(DATA_DIR, f), newline="", encoding="utf-8-sig") as csvfile:
-            reader = csv.DictReader(csvfile)
-            fieldnames = {name.strip(): name for name in reader.fieldnames}
-            code_col = fieldnames.get("コード")
-            if code_col is None:
-                continue
-            file_codes = {row[code_col].strip() for row in reader}
-            for code in counts:
-                if code in file_codes:
-                    counts[code]["days"] += 1
+def count_newhigh_days(codes, start=None, end=None, index=None):
+    """
+    各コードの新高値日数をカウント、start/end (YYYYMMDD) で期間を絞る。
+    index を省くと DATA_DIR のインデックスを更新して使う
+    """
+    if index is None:
+        index = appearindex.appearindex(DATA_DIR)
+        index.refresh()
+        index.save()
+    first, last = index.span(start, end)
+    mask = index.mask(first, last)
+    counts = {}
+    for name, code in codes:
+        counts[code] = {"name": name, "days": (index.bits.get(code, 0) & mask).bit_count()}
     return counts
 
 def main():
-    if len(sys.argv) > 1:
-        target_file = sys.argv[1]
+    global DATA_DIR
+    ap = argparse.ArgumentParser(description="銘柄毎の新高値日数")
+    ap.add_argument("target_file", help="銘柄を取るCSV default:最新のファイル", nargs="?", default=None)
+    ap.add_argument("-d", "--datadir", help="CSVファイルのディレクトリ default:%(default)s", default=DATA_DIR)
+    ap.add_argument("-s", "--start", help="数える期間の最初の日 YYYYMMDD", default=None)
+    ap.add_argument("-e", "--end", help="数える期間の最後の日 YYYYMMDD", default=None)
+    ap.add_argument("-i", "--index", help="出現インデックスのファイル default:<datadir>/" + appearindex.INDEXNAME, default=None)
+    ap.add_argument("--store", help="CSVの代わりに読む snapshotstore のディレクトリ", default=None)
+    args = ap.parse_args()
+    DATA_DIR = args.datadir
+
+    store = snapshotstore.snapshotstore(args.store) if args.store else None
+    if store is not None and not args.target_file:
+        # 最後の日の行の銘柄
+        if not store.days:
+            raise FileNotFoundError(f"{args.store} にスナップショットがありません")
+        codes = [(store.name(code), code) for code in store.codes(store.lastdate())]
     else:
-        target_file = get_latest_file()
+        if args.target_file:
+            target_file = args.target_file
+        else:
+            target_file = get_latest_file()
+
+        if not os.path.exists(target_file):
+            raise FileNotFoundError(f"{target_file} が存在しません")
 
-    if not os.path.exists(target_file):
-        raise FileNotFoundError(f"{target_file} が存在しません")
+        codes = read_csv(target_file)
 
-    codes = read_csv(target_file)
-    counts = count_newhigh_days(codes)
+    index = appearindex.appearindex(DATA_DIR, args.index, store)
+    index.refresh()
+    index.save()
+    counts = count_newhigh_days(codes, args.start, args.end, index)
 
     for code, info in counts.items():
         print(f"{info['name']} {code} {info['days']}")
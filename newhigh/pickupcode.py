@@ -1,7 +1,53 @@
+"""
+新高値スナップショットから条件に合う銘柄コードを抽出
+
+銘柄の出現は appearindex.py のインデックス(コード毎の営業日ビット列)で数え、
+毎回読むのは新しく増えたファイルと基準日のファイルだけ。-s でCSVの代わりに
+snapshotstore.py のストアを読む。
+
+--periods/--thresholds/--appearances を指定するとパラメータの組み合わせを
+まとめて評価する。基準日の候補と出現回数は期間毎に1回だけ求めて、しきい値と
+最小出現数の組み合わせで共有する。組み合わせが SWEEPPARALLEL 以上あれば
+全コアで分担する (-j で指定)。結果は組み合わせ毎に1行の表。
+
+--replay は基準日を履歴全体で1日ずつ動かし、基準日毎に条件を満たすコードを
+1回の走査で出す (バックテスト用のシグナル履歴)。
+
+usage:
+  python3 pickupcode.py -d newhigh -p 10 -t 30 -m 8
+  python3 pickupcode.py -d newhigh --replay [--since 20240101] -o signals.csv
+  python3 pickupcode.py -d newhigh --periods 5,10,20 --thresholds 10-60:10 --appearances 3-8 -o sweep.csv
+"""
 import os
+import sys
+import csv
 import argparse
-import pandas as pd
-from datetime import datetime
+import itertools
+from datetime import date, datetime
+import appearindex
+import snapshotstore
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scrape"))
+import batch
+
+SWEEPPARALLEL = 64
+SWEEPHEADER = ['period', 'past_high_threshold', 'min_appearance', '抽出基準日', '件数', 'コード']
+
+def intlist(s):
+    """"5,10,20" や "10-60:10" (10から60まで10刻み) を整数のリストに"""
+    values = []
+    for part in s.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        r, sep, step = part.partition(':')
+        first, sep2, last = r.partition('-')
+        if sep2:
+            values.extend(range(int(first), int(last) + 1, int(step) if sep else 1))
+        else:
+            values.append(int(r))
+    if not values:
+        raise argparse.ArgumentTypeError("値がありません: %s" % s)
+    return values
 
 def parse_args():
     parser = argparse.ArgumentParser(description="条件に合う銘柄コードを抽出")
@@ -10,73 +56,220 @@ def parse_args():
     parser.add_argument('-t', '--past_high_threshold', type=int, default=30, help='前営業日までの年初来高値日からの日数しきい値')
     parser.add_argument('-m', '--min_appearance', type=int, default=8, help='指定期間内に銘柄が出現すべき最小営業日数')
     parser.add_argument('-o', '--output', type=str, help='結果を保存するCSVファイルのパス')
+    parser.add_argument('-i', '--index', type=str, default=None, help='出現インデックスのファイル (既定: <datadir>/appearindex.json)')
+    parser.add_argument('-s', '--store', type=str, default=None, help='CSVの代わりに読む snapshotstore のディレクトリ')
+    parser.add_argument('--periods', type=intlist, default=None, help='スイープする期間 (例: 5,10,20 や 5-20)')
+    parser.add_argument('--thresholds', type=intlist, default=None, help='スイープする年初来高値日からの日数しきい値 (例: 10-60:10)')
+    parser.add_argument('--appearances', type=intlist, default=None, help='スイープする最小出現営業日数 (例: 3-8)')
+    parser.add_argument('--replay', action='store_true', help='基準日を履歴全体で動かして各基準日の結果を出す')
+    parser.add_argument('--since', type=str, default=None, help='--replay で結果を出す最初の基準日 YYYYMMDD')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='スイープのプロセス数、0は組み合わせが多いとき全コア')
     return parser.parse_args()
 
-def main():
-    args = parse_args()
+def dateordinal(s, fmt):
+    """日付文字列の通し日数、YYYY/MM/DD と YYYYMMDD は strptime を通さずに読む"""
+    if fmt == '%Y/%m/%d' and len(s) == 10 and s[4] == '/' and s[7] == '/' and (s[:4] + s[5:7] + s[8:]).isdigit():
+        return date(int(s[:4]), int(s[5:7]), int(s[8:10])).toordinal()
+    if fmt == '%Y%m%d' and len(s) == 8 and s.isdigit():
+        return date(int(s[:4]), int(s[4:6]), int(s[6:8])).toordinal()
+    return datetime.strptime(s, fmt).toordinal()
 
-    # CSVファイルの一覧を日付順に取得
-    files = sorted([f for f in os.listdir(args.datadir) if f.endswith('.csv')])
-    if len(files) <= args.period:
-        print("ファイル数が足りません")
+def highages(index, i):
+    """i日目のCSVかストアの行の (コード, 年初来高値日からの日数)、日付の読めない行は除く"""
+    current_date = dateordinal(index.days[i][0], '%Y%m%d')
+    result = []
+    if index.store is not None:
+        cols = index.store.day(int(index.days[i][0]), ['code', 'prevhighdate'])
+        for code, d in zip(cols['code'].tolist(), cols['prevhighdate'].tolist()):
+            if d:
+                result.append((code.decode('ascii'), current_date - date(d // 10000, d // 100 % 100, d % 100).toordinal()))
+        return result
+    for row in appearindex.readsnapshot(index.filepath(i)):
+        try:
+            high_date = dateordinal(row.get('前営業日までの年初来高値の日付', ''), '%Y/%m/%d')
+        except ValueError:
+            continue
+        result.append((row.get('コード', ''), current_date - high_date))
+    return result
+
+def candidates(index, period):
+    """
+    基準日(最新からperiod+1営業日前)と、基準日の行のうち最新日にもある銘柄の
+    (コード, 年初来高値日からの日数, 直近period営業日の出現回数) のリスト。
+    基準日のCSVだけを読み、出現はインデックスのビット演算で数える。
+    ファイルが足りなければ (None, [])
+    """
+    dates = index.dates()
+    n = len(dates)
+    if n <= period:
+        return None, []
+
+    # 最新日付と基準日
+    latest = n - 1
+    target = n - (period + 1)
+    recent = index.mask(n - period, latest)
+
+    result = []
+    for code, age in highages(index, target):
+        bits = index.bits.get(code, 0)
+        # 条件3: 最新データに存在
+        if not (bits >> latest) & 1:
+            continue
+        result.append((code, age, (bits & recent).bit_count()))
+    return dates[target], result
+
+def screen(index, period, past_high_threshold, min_appearance):
+    """基準日と条件を満たす銘柄コード、ファイルが足りなければ (None, [])"""
+    target_date, cands = candidates(index, period)
+    # 条件2: 年初来高値の日付が過去past_high_threshold日以上前
+    # 条件4: 直近period営業日中にmin_appearance回以上出現
+    return target_date, [code for code, age, count in cands
+                         if age >= past_high_threshold and count >= min_appearance]
+
+def daycodes(index):
+    """日毎のコードのリスト、インデックスのビットから"""
+    days = [[] for d in index.days]
+    for code, b in index.bits.items():
+        while b:
+            low = b & -b
+            days[low.bit_length() - 1].append(code)
+            b ^= low
+    return days
+
+def replay(index, period, past_high_threshold, min_appearance, since=None):
+    """
+    基準日を履歴の最初から動かし、各基準日 (その period 営業日後を最新日と
+    みなす) の (基準日, 条件を満たすコード) を順に返す。直近period営業日の
+    出現回数はコード毎に持ち、基準日を1日進める毎に窓に入る日のコードを足し
+    出る日のコードを引く。CSVは各基準日のものを1回だけ読む。
+    since (YYYYMMDD) より前の基準日は数を進めるだけで結果を出さない
+    """
+    dates = index.dates()
+    n = len(dates)
+    if n <= period:
         return
+    days = daycodes(index)
+    counts = {}
+    for i in range(1, period + 1):
+        for code in days[i]:
+            counts[code] = counts.get(code, 0) + 1
+    for target in range(n - period):
+        if target > 0:
+            # 窓 target..target+period-1 -> target+1..target+period
+            for code in days[target]:
+                counts[code] -= 1
+            for code in days[target + period]:
+                counts[code] = counts.get(code, 0) + 1
+        if since and dates[target] < since:
+            continue
+        latest = target + period
+        codes = []
+        for code, age in highages(index, target):
+            if age < past_high_threshold:
+                continue
+            if not (index.bits.get(code, 0) >> latest) & 1:
+                continue
+            if counts.get(code, 0) >= min_appearance:
+                codes.append(code)
+        yield dates[target], codes
 
-    # 日付のリスト
-    dates = [f.replace('.csv', '') for f in files]
+def loadindex(datadir, indexfile, storedir):
+    """保存済みのインデックス、storedir があればストアの"""
+    store = snapshotstore.snapshotstore(storedir) if storedir else None
+    return appearindex.appearindex(datadir, indexfile, store)
 
-    # 銘柄出現記録と日付→データフレームキャッシュ
-    stock_presence = {}
-    data_by_date = {}
+def sweepshard(paramsets, datadir, indexfile, storedir=None):
+    """paramsets の各 (period, threshold, appearance) の [基準日, コード] 、期間毎の候補は1回だけ求める"""
+    index = loadindex(datadir, indexfile, storedir)
+    bycandidates = {}
+    results = []
+    for period, threshold, appearance in paramsets:
+        if period not in bycandidates:
+            bycandidates[period] = candidates(index, period)
+        target_date, cands = bycandidates[period]
+        results.append((target_date, [code for code, age, count in cands
+                                      if age >= threshold and count >= appearance]))
+    return results
 
-    for f in files:
-        date_str = f.replace('.csv', '')
-        filepath = os.path.join(args.datadir, f)
-        df = pd.read_csv(filepath)
-        df['日付'] = date_str
-        data_by_date[date_str] = df
+def sweep(datadir, indexfile, storedir, periods, thresholds, appearances, jobs=0):
+    """全組み合わせの (period, threshold, appearance, 基準日, コード) のリスト、インデックスは保存済みのもの"""
+    paramsets = list(itertools.product(periods, thresholds, appearances))
+    if jobs <= 0:
+        jobs = (os.cpu_count() or 1) if len(paramsets) >= SWEEPPARALLEL else 1
+    # 同じ期間の組み合わせはまとめて分ける (候補を求めるのは塊毎に1回)
+    size = max(1, -(-len(paramsets) // jobs))
+    groups = []
+    for period, g in itertools.groupby(paramsets, key=lambda ps: ps[0]):
+        g = list(g)
+        groups.extend(g[i:i + size] for i in range(0, len(g), size))
+    parts = batch.runshards(sweepgroups, groups, jobs, datadir, indexfile, storedir)
+    merged = {}
+    for part in parts:
+        merged.update(part)
+    return [ps + merged[ps] for ps in paramsets]
 
-        for code in df['コード']:
-            stock_presence.setdefault(str(code), []).append(date_str)
+def sweepgroups(groups, datadir, indexfile, storedir):
+    """期間毎の塊を sweepshard して {(period, threshold, appearance): (基準日, コード)}"""
+    paramsets = [ps for g in groups for ps in g]
+    return dict(zip(paramsets, sweepshard(paramsets, datadir, indexfile, storedir)))
 
-    # 最新日付と基準日
-    latest_date = dates[-1]
-    target_date = dates[-(args.period + 1)]
+def writesweep(fp, rows):
+    writer = csv.writer(fp)
+    writer.writerow(SWEEPHEADER)
+    for period, threshold, appearance, target_date, codes in rows:
+        writer.writerow([period, threshold, appearance, target_date or '', len(codes), ' '.join(codes)])
 
-    df_target = data_by_date[target_date]
-    result = []
+def main():
+    args = parse_args()
 
-    for _, row in df_target.iterrows():
-        code = str(row['コード'])
-        high_date_str = row['前営業日までの年初来高値の日付']
-        try:
-            high_date = datetime.strptime(high_date_str, '%Y/%m/%d')
-        except ValueError:
-            continue
-        current_date = datetime.strptime(target_date, '%Y%m%d')
+    # 出現インデックスを増えたファイルの分だけ更新
+    store = snapshotstore.snapshotstore(args.store) if args.store else None
+    index = appearindex.appearindex(args.datadir, args.index, store)
+    index.refresh()
+    index.save()
 
-        # 条件2: 年初来高値の日付が過去past_high_threshold日以上前
-        if (current_date - high_date).days < args.past_high_threshold:
-            continue
+    if args.replay:
+        fp = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            writer = csv.writer(fp)
+            writer.writerow(['コード', '抽出基準日'])
+            for target_date, codes in replay(index, args.period, args.past_high_threshold,
+                                             args.min_appearance, args.since):
+                for code in codes:
+                    writer.writerow([code, target_date])
+        finally:
+            if fp is not sys.stdout:
+                fp.close()
+        return
 
-        # 条件3: 最新データに存在
-        if code not in data_by_date[latest_date]['コード'].astype(str).values:
-            continue
+    if args.periods or args.thresholds or args.appearances:
+        rows = sweep(args.datadir, index.indexfile, args.store, args.periods or [args.period],
+                     args.thresholds or [args.past_high_threshold],
+                     args.appearances or [args.min_appearance], args.jobs)
+        if args.output:
+            with open(args.output, 'w', newline='', encoding='utf-8') as fp:
+                writesweep(fp, rows)
+        else:
+            writesweep(sys.stdout, rows)
+        return
 
-        # 条件4: 直近period営業日中にmin_appearance回以上出現
-        recent_days = dates[-args.period:]
-        count = sum(code in data_by_date[d]['コード'].astype(str).values for d in recent_days)
-        if count >= args.min_appearance:
-            result.append({'コード': code, '抽出基準日': target_date})
+    target_date, codes = screen(index, args.period, args.past_high_threshold, args.min_appearance)
+    if target_date is None:
+        print("ファイル数が足りません")
+        return
 
     # 結果表示
     print("条件を満たす銘柄コード:")
-    for item in result:
-        print(item['コード'])
+    for code in codes:
+        print(code)
 
     # 出力オプション
     if args.output:
-        df_out = pd.DataFrame(result)
-        df_out.to_csv
+        with open(args.output, 'w', newline='', encoding='utf-8') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['コード', '抽出基準日'])
+            for code in codes:
+                writer.writerow([code, target_date])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+新高値ランキングのスナップショット(YYYYMMDD.csv)を追記専用のカラムストアに
+
+スクレイパー毎に違う文字コード(BOMの有無)と列名(perplexity の
+前営業日高値/高値日付)は取り込むときに一度だけ吸収し、値は数値と
+YYYYMMDD の整数で持つ。年毎のパーティションに項目毎の列ファイルを置き、
+numpy.memmap で読む (scrape/pricestore.py と同じ形式)。
+
+<storedir>/days.csv            date,partition,offset,rows,size,mtime  日付順
+<storedir>/names.csv           code,name  最後に見た名称
+<storedir>/<YYYY>/date.bin     int32 YYYYMMDD スナップショットの日
+<storedir>/<YYYY>/rank.bin     int32 その日の順位 (ファイルの行順、1から)
+<storedir>/<YYYY>/code.bin     S8
+<storedir>/<YYYY>/price.bin    float64 取引値、読めなければ nan
+...
+
+days.csv が確定した行数で、取り込みの途中で止まって列ファイルの末尾に
+残った行は読まれず、次の追記で切り捨てる。追記できるのは最後の日より後の
+日だけで、過去の日を直すときは backfill --force で作り直す。
+
+usage:
+  python3 snapshotstore.py backfill newhigh newhighstore      既存のCSVを全部取り込む
+  python3 snapshotstore.py ingest newhigh newhighstore        増えた日だけ追記
+  python3 snapshotstore.py show newhighstore 20240105
+"""
+import os
+import sys
+import csv
+import shutil
+import argparse
+import numpy as np
+import appearindex
+
+FIELDS = [
+    ("date", "<i4"),
+    ("rank", "<i4"),
+    ("code", "S8"),
+    ("price", "<f8"),
+    ("prevhigh", "<f8"),
+    ("prevhighdate", "<i4"),
+    ("high", "<f8"),
+    ]
+
+# 列 -> CSVの列名 (appearindex.COLUMNALIASES で正規化した後)
+COLUMNS = {
+    "price": "取引値",
+    "prevhigh": "前営業日までの年初来高値",
+    "prevhighdate": "前営業日までの年初来高値の日付",
+    "high": "高値",
+    }
+
+DAYSNAME = "days.csv"
+DAYSHEADER = ["date", "partition", "offset", "rows", "size", "mtime"]
+NAMESNAME = "names.csv"
+
+def price(s):
+    """'1,234.5' を数値に、読めなければ nan"""
+    try:
+        return float(s.replace(",", ""))
+    except ValueError:
+        return float("nan")
+
+def dateint(s):
+    """'2024/01/05' を 20240105 に、読めなければ 0"""
+    p = s.replace("-", "/").split("/")
+    if len(p) != 3 or not all(x.isdigit() for x in p):
+        return 0
+    y, m, d = int(p[0]), int(p[1]), int(p[2])
+    if not (1 <= m <= 12 and 1 <= d <= 31):
+        return 0
+    return y * 10000 + m * 100 + d
+
+def readrows(filepath, date):
+    """スナップショットの行を (FIELDS の値のタプル, 名称) のリストに"""
+    rows = []
+    for rank, row in enumerate(appearindex.readsnapshot(filepath), 1):
+        code = row.get("コード", "")
+        if not code:
+            continue
+        rows.append(((date, rank, code.encode("ascii", "replace")[:8],
+                      price(row.get(COLUMNS["price"], "")),
+                      price(row.get(COLUMNS["prevhigh"], "")),
+                      dateint(row.get(COLUMNS["prevhighdate"], "")),
+                      price(row.get(COLUMNS["high"], ""))),
+                     row.get("名称", "")))
+    return rows
+
+class snapshotstore:
+    def __init__(self, path):
+        self.path = path
+        self.days = []      # days.csv の行の辞書、日付順
+        self.byday = {}
+        self.names = {}
+        self.load()
+
+    def load(self):
+        self.days = []
+        self.names = {}
+        daysname = os.path.join(self.path, DAYSNAME)
+        if os.path.exists(daysname):
+            with open(daysname, "r") as fp:
+                for line in csv.reader(fp):
+                    if not line or line[0] == "date":
+                        continue
+                    self.days.append({"date": int(line[0]), "partition": line[1],
+                                      "offset": int(line[2]), "rows": int(line[3]),
+                                      "size": int(line[4]), "mtime": int(line[5])})
+        self.byday = {d["date"]: d for d in self.days}
+        namesname = os.path.join(self.path, NAMESNAME)
+        if os.path.exists(namesname):
+            with open(namesname, "r", newline="", encoding="utf-8") as fp:
+                for line in csv.reader(fp):
+                    if line and line[0] != "code":
+                        self.names[line[0]] = line[1]
+
+    def writeatomic(self, name, header, lines, encoding=None):
+        """一時ファイルに書いて fsync し、置き換える"""
+        filename = os.path.join(self.path, name)
+        tmpname = filename + ".tmp%d" % os.getpid()
+        with open(tmpname, "w", newline="", encoding=encoding) as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            writer.writerows(lines)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpname, filename)
+
+    def commit(self):
+        """names.csv、最後に days.csv を書く。days.csv が書けた時点で確定"""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.writeatomic(NAMESNAME, ["code", "name"], sorted(self.names.items()), "utf-8")
+        self.writeatomic(DAYSNAME, DAYSHEADER, [[d[k] for k in DAYSHEADER] for d in self.days])
+        self.byday = {d["date"]: d for d in self.days}
+
+    def dates(self):
+        return [d["date"] for d in self.days]
+
+    def lastdate(self):
+        return self.days[-1]["date"] if self.days else None
+
+    def partitiondir(self, partition):
+        return os.path.join(self.path, partition)
+
+    def partitionrows(self, partition):
+        """パーティションの確定した行数"""
+        n = 0
+        for d in self.days:
+            if d["partition"] == partition:
+                n = d["offset"] + d["rows"]
+        return n
+
+    def appenddays(self, days):
+        """
+        days の (日付, 行, 大きさ, mtime) を日付順に追記して確定する。
+        列ファイルへはパーティション毎にまとめて書く
+        """
+        if not days:
+            return
+        last = self.lastdate() or 0
+        for date, rows, size, mtime in days:
+            if date <= last:
+                raise ValueError("append %d is not after %d" % (date, last))
+            last = date
+        partitions = []
+        for date, rows, size, mtime in days:
+            partition = "%d" % (date // 10000)
+            if not partitions or partitions[-1][0] != partition:
+                partitions.append((partition, []))
+            partitions[-1][1].append((date, rows, size, mtime))
+        for partition, pdays in partitions:
+            pdir = self.partitiondir(partition)
+            if not os.path.exists(pdir):
+                os.makedirs(pdir)
+            n = self.partitionrows(partition)
+            for name, dtype in FIELDS:
+                filename = os.path.join(pdir, name + ".bin")
+                if os.path.exists(filename):
+                    # 確定していない末尾を捨てる
+                    with open(filename, "r+b") as fp:
+                        fp.truncate(n * np.dtype(dtype).itemsize)
+            allrows = [r for date, rows, size, mtime in pdays for r, name in rows]
+            for i, (name, dtype) in enumerate(FIELDS):
+                col = np.array([r[i] for r in allrows], dtype=dtype)
+                with open(os.path.join(pdir, name + ".bin"), "ab") as fp:
+                    fp.write(col.tobytes())
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            for date, rows, size, mtime in pdays:
+                self.days.append({"date": date, "partition": partition, "offset": n,
+                                  "rows": len(rows), "size": size, "mtime": mtime})
+                n += len(rows)
+                for r, name in rows:
+                    if name:
+                        self.names[r[2].decode("ascii", "replace")] = name
+        self.commit()
+
+    def ingestdir(self, csvdir, verbose=0):
+        """csvdir の YYYYMMDD.csv のうち最後の日より後のものを取り込み、取り込んだ日数を返す"""
+        last = self.lastdate() or 0
+        days = []
+        for f in appearindex.snapshotfiles(csvdir):
+            date = int(f[:-4])
+            filepath = os.path.join(csvdir, f)
+            st = os.stat(filepath)
+            if date <= last:
+                d = self.byday.get(date)
+                if d is None or d["size"] != st.st_size or d["mtime"] != st.st_mtime_ns:
+                    sys.stderr.write("%s: 取り込み済みの日より前か変更されています (backfill --force で作り直し)\n" % f)
+                continue
+            days.append((date, readrows(filepath, date), st.st_size, st.st_mtime_ns))
+            if verbose > 0:
+                print(f, len(days[-1][1]))
+        self.appenddays(days)
+        return len(days)
+
+    def read(self, partition, fields=None):
+        """パーティションの列 -> 読み出し専用の memmap"""
+        n = self.partitionrows(partition)
+        cols = {}
+        for name, dtype in FIELDS:
+            if fields and name not in fields:
+                continue
+            if n == 0:
+                cols[name] = np.zeros(0, dtype=dtype)
+                continue
+            cols[name] = np.memmap(os.path.join(self.partitiondir(partition), name + ".bin"),
+                                   dtype=dtype, mode="r", shape=(n,))
+        return cols
+
+    def day(self, date, fields=None):
+        """日 date (YYYYMMDD の整数) の列、無い日は None"""
+        d = self.byday.get(date)
+        if d is None:
+            return None
+        cols = self.read(d["partition"], fields)
+        return {k: v[d["offset"]:d["offset"] + d["rows"]] for k, v in cols.items()}
+
+    def range(self, start=None, end=None, fields=None):
+        """日 start..end (両端含む、None は端まで) の列を日付順につないだ配列"""
+        days = [d for d in self.days
+                if (start is None or d["date"] >= start) and (end is None or d["date"] <= end)]
+        parts = {}
+        for d in days:
+            p = parts.setdefault(d["partition"], [d["offset"], d["offset"]])
+            p[1] = d["offset"] + d["rows"]
+        result = {name: [] for name, dtype in FIELDS if not fields or name in fields}
+        for partition in sorted(parts):
+            s, e = parts[partition]
+            for k, v in self.read(partition, fields).items():
+                result[k].append(v[s:e])
+        return {k: np.concatenate(v) if v else np.zeros(0, dtype=dict(FIELDS)[k])
+                for k, v in result.items()}
+
+    def codes(self, date):
+        """日 date のコード、順位順"""
+        cols = self.day(date, ["code"])
+        if cols is None:
+            return []
+        return [c.decode("ascii") for c in cols["code"]]
+
+    def name(self, code):
+        return self.names.get(code, "")
+
+def backfill(args):
+    """csvdir を全部取り込む。--force は別の場所に作ってから置き換える"""
+    if os.path.exists(os.path.join(args.storedir, DAYSNAME)) and not args.force:
+        n = snapshotstore(args.storedir).ingestdir(args.csvdir, args.verbose)
+        print("appended %d days" % n)
+        return
+    tmpdir = args.storedir.rstrip("/") + ".tmp%d" % os.getpid()
+    store = snapshotstore(tmpdir)
+    n = store.ingestdir(args.csvdir, args.verbose)
+    if n == 0:
+        # 取り込む日が無くても空のストアとして確定し、次からは追記にする
+        store.commit()
+    if os.path.exists(args.storedir):
+        olddir = args.storedir.rstrip("/") + ".old%d" % os.getpid()
+        os.rename(args.storedir, olddir)
+        os.rename(tmpdir, args.storedir)
+        shutil.rmtree(olddir)
+    else:
+        os.rename(tmpdir, args.storedir)
+    print("backfilled %d days" % n)
+
+def show(args):
+    store = snapshotstore(args.storedir)
+    dates = [int(args.date)] if args.date else store.dates()[-1:]
+    writer = csv.writer(sys.stdout)
+    writer.writerow([name for name, dtype in FIELDS] + ["name"])
+    for date in dates:
+        cols = store.day(date)
+        if cols is None:
+            continue
+        for i in range(len(cols["date"])):
+            code = cols["code"][i].decode("ascii")
+            writer.writerow([cols[name][i] if name != "code" else code for name, dtype in FIELDS]
+                            + [store.name(code)])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="新高値スナップショットのカラムストア")
+    ap.add_argument("-v", "--verbose", help="vorbose", action="count", default=0)
+    sub = ap.add_subparsers(dest="command")
+    bp = sub.add_parser("backfill", help="CSVディレクトリを全部取り込む")
+    bp.add_argument("--force", help="既存のストアを作り直す", action="store_true")
+    bp.add_argument("csvdir", help="CSVディレクトリ")
+    bp.add_argument("storedir", help="ストアのディレクトリ")
+    ip = sub.add_parser("ingest", help="最後の日より後のCSVを追記")
+    ip.add_argument("csvdir", help="CSVディレクトリ")
+    ip.add_argument("storedir", help="ストアのディレクトリ")
+    sp = sub.add_parser("show", help="1日分をcsvで出す")
+    sp.add_argument("storedir", help="ストアのディレクトリ")
+    sp.add_argument("date", help="YYYYMMDD default:最後の日", nargs="?", default=None)
+    args = ap.parse_args()
+    if args.verbose > 0:
+        print(args)
+    if args.command == "backfill":
+        backfill(args)
+    elif args.command == "ingest":
+        n = snapshotstore(args.storedir).ingestdir(args.csvdir, args.verbose)
+        print("appended %d days" % n)
+    elif args.command == "show":
+        show(args)
+    else:
+        ap.print_help()
@@ -0,0 +1,74 @@
+"""
+asyncio fetch engine shared by the scrapers.
+
+Requests go through a blocking urllib call in a thread pool, bounded by a
+semaphore for the number of requests in flight, and each host has its own
+token bucket so the rate to one site stays under its limit while other
+hosts proceed. check(body) is handed to httpcache.urlopen, a body it
+refuses is raised to the caller and not cached.
+"""
+import asyncio
+import concurrent.futures
+import time
+import urllib.parse
+import httpcache
+
+class tokenbucket:
+    """rate tokens per second, up to burst tokens saved. rate <= 0 is unlimited"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class fetcher:
+    def __init__(self, concurrency=8, rate=1.0, burst=1, timeout=30, headers=None, check=None):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.check = check
+        self.buckets = {}
+        self.sem = asyncio.Semaphore(concurrency)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.requestcount = 0
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = tokenbucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def _get(self, url):
+        response = httpcache.urlopen(url, self.headers, self.timeout, self.check)
+        return response.body.decode(response.charset(), errors="replace")
+
+    async def get(self, url):
+        """GET url and return decoded body, urllib errors are raised to the caller"""
+        host = urllib.parse.urlsplit(url).hostname
+        await self.bucket(host).acquire()
+        async with self.sem:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, self._get, url)
+        self.requestcount += 1
+        return data
+
+    def close(self):
+        self.executor.shutdown(wait=False)
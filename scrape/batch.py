@@ -0,0 +1,50 @@
+"""
+Helpers for batch runs over the code list.
+
+Work is split into shards of codes, each shard runs in a worker process
+and returns a partial result. The caller merges the partial results in
+shard order, so the output does not depend on which worker finished first.
+"""
+import csv
+import codecs
+import concurrent.futures
+
+def readcodes(codefile):
+    """Codes in first column of codefile, header line skipped"""
+    with codecs.open(codefile,encoding='utf-8') as cfp:
+        cfpreader = csv.reader(cfp)
+        cfpreader.__next__()
+        codes=[int(line[0]) for line in cfpreader if line and line[0].isdigit()]
+        cfp.close()
+    return codes
+
+def shard(codes,n):
+    """Split codes into n interleaved shards so large and small codes mix"""
+    n=max(1,min(n,len(codes)))
+    return [codes[i::n] for i in range(n)]
+
+def runshards(func,codes,jobs,*args):
+    """
+    Run func(shardcodes,*args) for each shard and return the results in shard order.
+    jobs <= 1 runs in this process.
+    """
+    if jobs <= 1:
+        return [func(codes,*args)]
+    shards=shard(codes,jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as ex:
+        futures=[ex.submit(func,s,*args) for s in shards]
+        return [f.result() for f in futures]
+
+def eachshard(func,codes,jobs,*args):
+    """
+    runshards yielding each result as its shard finishes, in no fixed order,
+    for callers that don't need the shard order.
+    """
+    if jobs <= 1:
+        yield func(codes,*args)
+        return
+    shards=shard(codes,jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as ex:
+        futures=[ex.submit(func,s,*args) for s in shards]
+        for f in concurrent.futures.as_completed(futures):
+            yield f.result()
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+End-to-end crawl throughput against the local stand-in server (fakesite.py).
+
+  yahoo     getyahoostock over -n codes, sequential or -j requests in flight
+  stooq     getstooqtock over -n codes with -j (at least 1) requests in flight
+  ranking   every newhigh/ai scraper as a subprocess, chatgpt through its
+            browser pool (HTTPSITES reaches the browsers too), a scraper
+            that can't start is reported as failed
+
+Reported per run: pages (200 answers) and rows served per second, failed and
+quota limited requests and p50/p99 latency. Latency is measured in the client for the
+in-process runs and in the server for the subprocess ones.
+
+usage:
+  python3 crawlbench.py -n 50 -j 8 --latency 0.05 --errorrate 0.01 yahoo stooq
+"""
+import os
+import sys
+import csv
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import fakesite
+import httpcache
+import getyahoostock
+import getstooqtock
+
+AIDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "newhigh", "ai")
+RANKINGSCRAPERS = ["rankingcrawl.py", "chatgpt.py", "chatgptnoext.py", "claude.py", "copilot.py", "gemini.py", "grok.py", "perplexity.py"]
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+class timedurlopen:
+    """httpcache.urlopen that keeps the seconds of every call"""
+    def __init__(self):
+        self.urlopen = httpcache.urlopen
+        self.seconds = []
+
+    def __call__(self, url, headers=None, timeout=30, check=None):
+        t = time.perf_counter()
+        try:
+            return self.urlopen(url, headers, timeout, check)
+        finally:
+            self.seconds.append(time.perf_counter() - t)
+
+    def __enter__(self):
+        httpcache.urlopen = self
+        return self
+
+    def __exit__(self, *exc):
+        httpcache.urlopen = self.urlopen
+
+def report(name, site, mark, wall, latencies=None, note=""):
+    log = site.since(mark)
+    pages = sum(1 for s, status, seconds, rows, limited in log if status == 200 and not limited)
+    rows = sum(rows for s, status, seconds, rows, limited in log)
+    limits = sum(1 for s, status, seconds, rows, limited in log if limited)
+    errors = len(log) - pages - limits
+    if latencies is None:
+        latencies = [seconds for s, status, seconds, rows, limited in log]
+    print("%-16s %6d pages %8d rows %5d errors %5d limited %7.2fs %8.1f pages/s %10.1f rows/s p50 %6.1fms p99 %6.1fms %s" % (
+        name, pages, rows, errors, limits, wall, pages / wall if wall else 0, rows / wall if wall else 0,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, note))
+
+def writecodes(filename, n):
+    with open(filename, "w") as wfp:
+        writer = csv.writer(wfp)
+        for i in range(n):
+            writer.writerow([1301 + i, "銘柄%d" % (1301 + i), "東証1部", "", 100, ""])
+
+def benchyahoo(site, workdir, args):
+    yargs = argparse.Namespace(verbose=0, codefile=os.path.join(workdir, "codes.csv"),
+                               startdate=args.startdate, enddate=args.enddate,
+                               datadir=os.path.join(workdir, "yahoo"), concurrency=args.jobs,
+                               rate=args.rate, budget=0, ratedelay=args.ratedelay)
+    os.makedirs(yargs.datadir)
+    writecodes(yargs.codefile, args.codes)
+    mark = site.mark()
+    with timedurlopen() as timer:
+        t = time.perf_counter()
+        if args.jobs > 0:
+            asyncio.run(getyahoostock.getstockasync(yargs))
+        else:
+            getyahoostock.scheduler = None
+            getyahoostock.getstock(yargs, pause=0)
+        wall = time.perf_counter() - t
+    report("yahoo j=%d" % args.jobs, site, mark, wall, timer.seconds)
+
+def benchstooq(site, workdir, args):
+    sargs = argparse.Namespace(verbose=0, codefile=os.path.join(workdir, "codes.csv"),
+                               datadir=os.path.join(workdir, "stooq"), store=None, update=False,
+                               concurrency=max(args.jobs, 1), rate=args.rate, budget=0,
+                               ratedelay=args.ratedelay)
+    writecodes(sargs.codefile, args.codes)
+    mark = site.mark()
+    with timedurlopen() as timer:
+        t = time.perf_counter()
+        getstooqtock.getstock(sargs)
+        wall = time.perf_counter() - t
+    report("stooq j=%d" % sargs.concurrency, site, mark, wall, timer.seconds)
+
+def benchranking(site, workdir, args):
+    for script in RANKINGSCRAPERS:
+        rundir = os.path.join(workdir, "ranking", script[:-3])
+        os.makedirs(rundir)
+        mark = site.mark()
+        t = time.perf_counter()
+        with open(os.path.join(rundir, "log"), "w") as log:
+            result = subprocess.run([sys.executable, os.path.join(AIDIR, script)], cwd=rundir,
+                                    stdout=log, stderr=subprocess.STDOUT, env=os.environ.copy(),
+                                    timeout=args.timeout)
+        wall = time.perf_counter() - t
+        note = ""
+        if result.returncode != 0:
+            with open(os.path.join(rundir, "log"), "r") as log:
+                lines = log.read().strip().splitlines()
+            note = "failed: %s" % (lines[-1] if lines else result.returncode)
+        report(script[:-3], site, mark, wall, note=note)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Crawl throughput against the local stand-in server")
+    ap.add_argument("-n", "--codes", help="codes to crawl default:%(default)s", type=int, default=20)
+    ap.add_argument("-j", "--jobs", help="requests in flight, 0 is sequential yahoo default:%(default)s", type=int, default=0)
+    ap.add_argument("-r", "--rate", help="requests per second with -j, 0 is unlimited default:%(default)s", type=float, default=0)
+    ap.add_argument("-s", "--startdate", help="yahoo from date default:%(default)s", default="20200101")
+    ap.add_argument("-e", "--enddate", help="yahoo to date default:%(default)s", default="20201113")
+    ap.add_argument("--latency", help="server seconds per response default:%(default)s", type=float, default=0.02)
+    ap.add_argument("--jitter", help="server extra random seconds default:%(default)s", type=float, default=0.01)
+    ap.add_argument("--errorrate", help="fraction of 503 answers default:%(default)s", type=float, default=0)
+    ap.add_argument("--limit", help="requests per site before the quota answer default:%(default)s", type=int, default=0)
+    ap.add_argument("--limitwindow", help="seconds until the quota opens again default:%(default)s", type=float, default=5)
+    ap.add_argument("--ratedelay", help="first backoff seconds on a rate limit default:%(default)s", type=float, default=1)
+    ap.add_argument("--ranking", help="rows of the ranking default:%(default)s", type=int, default=812)
+    ap.add_argument("--timeout", help="seconds per ranking scraper default:%(default)s", type=float, default=600)
+    ap.add_argument("-k", "--keep", help="keep the work dir", action="store_true")
+    ap.add_argument("runs", help="yahoo stooq ranking", nargs="*", default=["yahoo", "stooq", "ranking"])
+    args = ap.parse_args()
+
+    site = fakesite.fakesite(args.latency, args.jitter, args.errorrate, args.limit, args.limitwindow, args.ranking)
+    base = site.start()
+    os.environ.pop("HTTPCACHE", None)
+    os.environ["HTTPSITES"] = "https://finance.yahoo.co.jp=%s,https://stooq.com=%s" % (base, base)
+    httpcache.configure()
+    workdir = tempfile.mkdtemp(prefix="crawlbench")
+    print("server %s work %s" % (base, workdir))
+    for run in args.runs:
+        if run == "yahoo":
+            benchyahoo(site, workdir, args)
+        elif run == "stooq":
+            benchstooq(site, workdir, args)
+        elif run == "ranking":
+            benchranking(site, workdir, args)
+        else:
+            print("unknown run %s" % run)
+    site.stop()
+    if not args.keep:
+        import shutil
+        shutil.rmtree(workdir)
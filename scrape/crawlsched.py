@@ -0,0 +1,230 @@
+"""
+Crawl scheduler with per-host request budget and retry queue.
+
+Fetch failures are sorted into three kinds:
+  ratelimit  HTTP 429/403 or a quota message in the body. The host backs
+             off exponentially with jitter, its jobs wait, other hosts go on.
+  transient  HTTP 5xx/408, timeouts, connection errors. Only the failed job
+             is parked in the retry queue with its own backoff, the crawl
+             continues with the rest.
+  permanent  other HTTP 4xx and parse errors. The job is dropped and
+             recorded in scheduler.failed.
+
+Jobs are (host, key, page) plus free data for the caller. The drivers
+runsync/runasync take jobs from the scheduler and only sleep when no host
+has a job it is allowed to send. A job whose cancelled flag is set while it
+waits is dropped without being sent.
+"""
+import asyncio
+import collections
+import heapq
+import random
+import time
+import urllib.error
+
+RATELIMIT = "ratelimit"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+LIMITTEXT = "Exceeded the daily hits limit"
+
+class ratelimited(Exception):
+    """raised by a fetch function when the response body says the quota is used up"""
+
+def classify(err):
+    if isinstance(err, ratelimited):
+        return RATELIMIT
+    if isinstance(err, urllib.error.HTTPError):
+        if err.code in (403, 429):
+            return RATELIMIT
+        if err.code >= 500 or err.code == 408:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(err, (urllib.error.URLError, OSError, asyncio.TimeoutError)):
+        return TRANSIENT
+    return PERMANENT
+
+class job:
+    def __init__(self, host, key, page=1, data=None):
+        self.host = host
+        self.key = key
+        self.page = page
+        self.data = data
+        self.tries = 0
+        self.cancelled = False
+
+    def __repr__(self):
+        return "job(%s,%s,%d)" % (self.host, self.key, self.page)
+
+class hostbudget:
+    """budget requests per window seconds (0 is unlimited) and rate limit backoff of one host"""
+    def __init__(self, budget=0, window=86400, basedelay=60, maxdelay=86400):
+        self.budget = budget
+        self.window = window
+        self.basedelay = basedelay
+        self.maxdelay = maxdelay
+        self.used = 0
+        self.total = 0
+        self.windowstart = None
+        self.blockeduntil = 0
+        self.failures = 0
+
+    def readyat(self, now):
+        t = self.blockeduntil
+        if self.budget and self.windowstart is not None and self.used >= self.budget:
+            t = max(t, self.windowstart + self.window)
+        return t
+
+    def spend(self, now):
+        if self.windowstart is None or now - self.windowstart >= self.window:
+            self.windowstart = now
+            self.used = 0
+        self.used += 1
+        self.total += 1
+
+    def ratelimited(self, now):
+        self.failures += 1
+        delay = min(self.maxdelay, self.basedelay * 2 ** (self.failures - 1))
+        self.blockeduntil = now + delay * random.uniform(0.8, 1.2)
+
+    def success(self):
+        self.failures = 0
+
+class scheduler:
+    def __init__(self, budget=0, window=86400, ratedelay=60, retrydelay=5,
+                 maxdelay=86400, maxtries=5, clock=time.monotonic):
+        self.budget = budget
+        self.window = window
+        self.ratedelay = ratedelay
+        self.retrydelay = retrydelay
+        self.maxdelay = maxdelay
+        self.maxtries = maxtries
+        self.clock = clock
+        self.hosts = {}
+        self.ready = {}
+        self.retry = []
+        self.seq = 0
+        self.inflight = 0
+        self.failed = []
+
+    def host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = hostbudget(self.budget, self.window, self.ratedelay, self.maxdelay)
+        return self.hosts[host]
+
+    def queue(self, host):
+        if host not in self.ready:
+            self.ready[host] = collections.deque()
+        return self.ready[host]
+
+    def add(self, j, first=False):
+        """queue j, in front of the jobs already waiting when first"""
+        if first:
+            self.queue(j.host).appendleft(j)
+        else:
+            self.queue(j.host).append(j)
+
+    def pending(self):
+        return self.inflight > 0 or self.retry or any(self.ready.values())
+
+    def next(self):
+        """return (job, 0) to send now, or (None, seconds to wait)"""
+        now = self.clock()
+        while self.retry and self.retry[0][0] <= now:
+            t, seq, j = heapq.heappop(self.retry)
+            if not j.cancelled:
+                self.queue(j.host).appendleft(j)
+        wait = None
+        for host, q in self.ready.items():
+            while q and q[0].cancelled:
+                q.popleft()
+            if not q:
+                continue
+            h = self.host(host)
+            t = h.readyat(now)
+            if t <= now:
+                j = q.popleft()
+                h.spend(now)
+                j.tries += 1
+                self.inflight += 1
+                return j, 0
+            wait = t - now if wait is None else min(wait, t - now)
+        if self.retry:
+            t = self.retry[0][0] - now
+            wait = t if wait is None else min(wait, t)
+        if wait is None:
+            wait = 0.05 if self.inflight else 0
+        return None, max(wait, 0)
+
+    def done(self, j):
+        self.inflight -= 1
+        self.host(j.host).success()
+
+    def fail(self, j, err):
+        """record failure of j and return its kind"""
+        self.inflight -= 1
+        now = self.clock()
+        kind = classify(err)
+        if kind == RATELIMIT:
+            # not the job's fault, retry it first when the host opens again
+            j.tries -= 1
+            self.host(j.host).ratelimited(now)
+            self.queue(j.host).appendleft(j)
+        elif kind == TRANSIENT and j.tries < self.maxtries:
+            delay = min(self.maxdelay, self.retrydelay * 2 ** (j.tries - 1))
+            self.seq += 1
+            heapq.heappush(self.retry, (now + delay * random.uniform(0.5, 1.5), self.seq, j))
+        else:
+            self.failed.append((j, err))
+        return kind
+
+    def requestcount(self):
+        return {host: h.total for host, h in self.hosts.items()}
+
+def runsync(sched, fetch, handle, verbose=0):
+    """fetch(job) returns the body or raises, handle(job, body) may add jobs"""
+    while sched.pending():
+        j, wait = sched.next()
+        if j is None:
+            time.sleep(wait)
+            continue
+        try:
+            data = fetch(j)
+        except Exception as e:
+            kind = sched.fail(j, e)
+            if verbose > 0:
+                print("%s %s %s" % (kind, j, e))
+            continue
+        sched.done(j)
+        try:
+            handle(j, data)
+        except Exception as e:
+            # the body arrived but could not be used, refetching will not help
+            sched.failed.append((j, e))
+            if verbose > 0:
+                print("%s %s %s" % (PERMANENT, j, e))
+
+async def runasync(sched, fetch, handle, workers, verbose=0):
+    """same as runsync with workers coroutines, fetch is a coroutine function"""
+    async def worker():
+        while sched.pending():
+            j, wait = sched.next()
+            if j is None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                data = await fetch(j)
+            except Exception as e:
+                kind = sched.fail(j, e)
+                if verbose > 0:
+                    print("%s %s %s" % (kind, j, e))
+                continue
+            sched.done(j)
+            try:
+                handle(j, data)
+            except Exception as e:
+                # the body arrived but could not be used, refetching will not help
+                sched.failed.append((j, e))
+                if verbose > 0:
+                    print("%s %s %s" % (PERMANENT, j, e))
+    await asyncio.gather(*[worker() for i in range(workers)])
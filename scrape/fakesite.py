@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+"""
+Local stand-in for the sites the scrapers crawl, for benchmarks and tests.
+
+  /quote/<code>.<market>/history?from=&to=&timeFrame=d&page=N
+        yahoo history page, 20 weekdays per page newest first in
+        window.__PRELOADED_STATE__, an empty list after the last page
+  /q/d/l/?s=<code>.jp&i=d
+        stooq csv, Date,Open,High,Low,Close,Volume ascending
+  /stocks/ranking/yearToDateHigh?market=all&term=daily&page=N
+        yahoo year-to-date high ranking, 50 rows per page with the pager,
+        the rows also in window.__PRELOADED_STATE__ unless --rankingdom
+
+Prices are a function of code and date, so every run serves the same data.
+Each response waits latency + uniform(0, jitter) seconds, errorrate of the
+requests get 503, and after limit requests per site the site answers as it
+does when the quota is used up: stooq 200 with "Exceeded the daily hits
+limit", yahoo 429. The quota opens again after limitwindow seconds, 0 is
+never.
+
+Point the scrapers at it with
+  HTTPSITES=https://finance.yahoo.co.jp=http://127.0.0.1:8765,https://stooq.com=http://127.0.0.1:8765
+
+usage:
+  python3 fakesite.py -p 8765 --latency 0.05 --errorrate 0.01
+"""
+import re
+import json
+import math
+import time
+import random
+import datetime
+import argparse
+import threading
+import http.server
+import urllib.parse
+import crawlsched
+
+HISTORYPAGE = 20
+RANKINGPAGE = 50
+
+historyre = re.compile(r"^/quote/(\d+)\.(\w+)/history$")
+
+def price(code, day):
+    """deterministic close of code on day (ordinal)"""
+    base = 100 + code % 4000
+    return round(base * (1 + 0.2 * math.sin(day / (5 + code % 17)) + 0.0001 * (day % 1000)), 1)
+
+def ohlcv(code, day):
+    c = price(code, day)
+    o = price(code, day - 1)
+    h = max(o, c) + 1
+    l = min(o, c) - 1
+    v = (code * 31 + day * 17) % 10000 * 100
+    return o, h, l, c, v
+
+def weekdays(first, last):
+    """ordinals of weekdays first..last newest first"""
+    days = []
+    d = last
+    while d >= first:
+        if datetime.date.fromordinal(d).weekday() < 5:
+            days.append(d)
+        d -= 1
+    return days
+
+def parsedate(s):
+    return datetime.datetime.strptime(s, "%Y%m%d").date().toordinal()
+
+def historypage(code, first, last, page):
+    """(html, rows) of one yahoo history page"""
+    days = weekdays(first, last)[(page - 1) * HISTORYPAGE:page * HISTORYPAGE]
+    histories = []
+    for d in days:
+        o, h, l, c, v = ohlcv(code, d)
+        histories.append({
+            "baseDateIso": datetime.date.fromordinal(d).isoformat(),
+            "openPrice": "{:,}".format(o), "highPrice": "{:,}".format(h),
+            "lowPrice": "{:,}".format(l), "closePrice": "{:,}".format(c),
+            "volume": "{:,}".format(v), "adjustedClosePrice": "{:,}".format(c)})
+    state = {"pageInfo": {"code": "%d" % code},
+             "mainStocksHistory": {"history": {"histories": histories}}}
+    html = ("<html><head><title>%d</title></head><body><div id=\"root\"></div>\n"
+            "<script>\nwindow.__PRELOADED_STATE__ = %s\n</script></body></html>\n"
+            % (code, json.dumps(state, ensure_ascii=False)))
+    return html, len(histories)
+
+def stooqcsv(code, first, last):
+    """(csv, rows) of the whole stooq history"""
+    lines = ["Date,Open,High,Low,Close,Volume"]
+    days = weekdays(first, last)
+    for d in reversed(days):
+        o, h, l, c, v = ohlcv(code, d)
+        lines.append("%s,%s,%s,%s,%s,%d" % (datetime.date.fromordinal(d).isoformat(), o, h, l, c, v))
+    return "\n".join(lines) + "\n", len(days)
+
+def rankingvalues(code, day):
+    """price, previous year-to-date high, its date, high"""
+    o, h, l, c, v = ohlcv(code, day)
+    prevhigh = round(h * 0.97, 1)
+    prevdate = datetime.date.fromordinal(day - 30 - code % 200).strftime("%Y/%m/%d")
+    return c, prevhigh, prevdate, h
+
+def rankingitem(rank, code, day):
+    """mainRankingList.results item of the preloaded state"""
+    c, prevhigh, prevdate, h = rankingvalues(code, day)
+    return {"rank": rank, "stockCode": "%d" % code, "stockName": "銘柄%d" % code,
+            "marketName": "東証PRM", "savePrice": "{:,}".format(c),
+            "rankingResult": {"previousYearToDateHighPrice": "{:,}".format(prevhigh),
+                              "previousYearToDateHighDate": prevdate,
+                              "highPrice": "{:,}".format(h)}}
+
+def rankingrow(code, day):
+    c, prevhigh, prevdate, h = rankingvalues(code, day)
+    return ('<tr class="RankingTable__row__1Gwp">'
+            '<td class="RankingTable__detail__P452"><a href="https://finance.yahoo.co.jp/quote/%d.T">銘柄%d</a>'
+            '<ul class="RankingTable__supplements__15Cu"><li class="RankingTable__supplement__vv_m">%d</li>'
+            '<li class="RankingTable__supplement__vv_m">東証PRM</li></ul></td>'
+            '<td class="RankingTable__detail__P452"><span class="StyledNumber__value__3rXW">{:,}</span></td>'
+            '<td class="RankingTable__detail__P452"><span class="StyledNumber__value__3rXW">{:,}</span>'
+            '<span class="StyledNumber__value__3rXW">%s</span></td>'
+            '<td class="RankingTable__detail__P452"><span class="StyledNumber__value__3rXW">{:,}</span></td>'
+            '</tr>' % (code, code, code, prevdate)).format(c, prevhigh, h)
+
+def rankingpage(codes, day, page, state=True):
+    """(html, rows) of one ranking page of codes, state False leaves out the preloaded state"""
+    total = len(codes)
+    start = (page - 1) * RANKINGPAGE
+    rows = codes[start:start + RANKINGPAGE]
+    last = start + len(rows) >= total
+    pager = ('<div id="pagertop"><p>%d〜%d件 / %d件中</p>'
+             '<button class="ymuiPagination__button--next" data-cl-params="_cl_link:next;_cl_position:0"%s>次へ</button></div>'
+             % (start + 1 if rows else 0, start + len(rows), total, " disabled" if last else ""))
+    script = ""
+    if state:
+        ranking = {"results": [rankingitem(start + i + 1, code, day) for i, code in enumerate(rows)],
+                   "totalResultsAvailable": total, "firstResultPosition": start + 1}
+        script = ("<script>\nwindow.__PRELOADED_STATE__ = %s\n</script>"
+                  % json.dumps({"pageInfo": {"title": "年初来高値更新"}, "mainRankingList": ranking},
+                               ensure_ascii=False))
+    html = ("<html><body>%s<div id=\"item\"><table><thead><tr><th>名称・コード・市場</th><th>取引値</th>"
+            "<th>前営業日までの年初来高値</th><th>高値</th></tr></thead><tbody>%s</tbody></table></div>%s</body></html>\n"
+            % (pager, "".join(rankingrow(code, day) for code in rows), script))
+    return html, len(rows)
+
+class fakesite:
+    def __init__(self, latency=0, jitter=0, errorrate=0, limit=0, limitwindow=0, ranking=812,
+                 stooqfrom="20100101", today=None, seed=0, rankingstate=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrate = errorrate
+        self.limit = limit
+        self.limitwindow = limitwindow
+        self.rankingcodes = [1300 + i * 7 for i in range(ranking)]
+        self.rankingstate = rankingstate
+        self.stooqfrom = parsedate(stooqfrom)
+        self.today = parsedate(today) if today else datetime.date.today().toordinal()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.windowstart = time.monotonic()
+        self.log = []
+        self.server = None
+
+    def count(self, site):
+        with self.lock:
+            if self.limitwindow and time.monotonic() - self.windowstart >= self.limitwindow:
+                self.windowstart = time.monotonic()
+                self.counts = {}
+            self.counts[site] = self.counts.get(site, 0) + 1
+            return self.counts[site]
+
+    def record(self, site, status, seconds, rows, limited):
+        with self.lock:
+            self.log.append((site, status, seconds, rows, limited))
+
+    def mark(self):
+        return len(self.log)
+
+    def since(self, mark):
+        with self.lock:
+            return self.log[mark:]
+
+    def answer(self, path, query):
+        """(site, status, content type, body, rows, limited)"""
+        t = historyre.match(path)
+        if t:
+            site = "yahoo"
+        elif path == "/q/d/l/":
+            site = "stooq"
+        elif path == "/stocks/ranking/yearToDateHigh":
+            site = "ranking"
+        else:
+            return "other", 404, "text/plain", "not found\n", 0, False
+        n = self.count(site)
+        with self.lock:
+            error = self.random.random() < self.errorrate
+        if self.limit and n > self.limit:
+            if site == "stooq":
+                return site, 200, "text/plain", crawlsched.LIMITTEXT + "\n", 0, True
+            return site, 429, "text/plain", "too many requests\n", 0, True
+        if error:
+            return site, 503, "text/plain", "service unavailable\n", 0, False
+        if site == "yahoo":
+            body, rows = historypage(int(t.group(1)), parsedate(query["from"][0]),
+                                     parsedate(query["to"][0]), int(query.get("page", ["1"])[0]))
+            return site, 200, "text/html; charset=utf-8", body, rows, False
+        if site == "stooq":
+            code = int(query["s"][0].split(".")[0])
+            body, rows = stooqcsv(code, self.stooqfrom, self.today)
+            return site, 200, "text/csv", body, rows, False
+        body, rows = rankingpage(self.rankingcodes, self.today, int(query.get("page", ["1"])[0]),
+                                 self.rankingstate)
+        return site, 200, "text/html; charset=utf-8", body, rows, False
+
+    def handler(self):
+        site = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                start = time.perf_counter()
+                u = urllib.parse.urlsplit(self.path)
+                wait = site.latency + (site.random.uniform(0, site.jitter) if site.jitter else 0)
+                if wait > 0:
+                    time.sleep(wait)
+                name, status, ctype, body, rows, limited = site.answer(u.path, urllib.parse.parse_qs(u.query))
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                site.record(name, status, time.perf_counter() - start, rows, limited)
+
+        return handler
+
+    def start(self, port=0, host="127.0.0.1"):
+        """serve in a thread, port 0 takes a free one, returns the base url"""
+        self.server = http.server.ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://%s:%d" % (host, self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local stand-in yahoo/stooq server")
+    ap.add_argument("-p", "--port", help="port default:%(default)s", type=int, default=8765)
+    ap.add_argument("--latency", help="seconds before each response default:%(default)s", type=float, default=0)
+    ap.add_argument("--jitter", help="extra uniform random seconds default:%(default)s", type=float, default=0)
+    ap.add_argument("--errorrate", help="fraction of requests answered 503 default:%(default)s", type=float, default=0)
+    ap.add_argument("--limit", help="requests per site before the quota answer, 0 is unlimited default:%(default)s", type=int, default=0)
+    ap.add_argument("--limitwindow", help="seconds until the quota opens again, 0 is never default:%(default)s", type=float, default=0)
+    ap.add_argument("--ranking", help="rows of the ranking default:%(default)s", type=int, default=812)
+    ap.add_argument("--today", help="last date served YYYYMMDD default:today", default=None)
+    ap.add_argument("--rankingdom", help="ranking pages without the preloaded state", action="store_true")
+    args = ap.parse_args()
+    site = fakesite(args.latency, args.jitter, args.errorrate, args.limit, args.limitwindow,
+                    args.ranking, today=args.today, rankingstate=not args.rankingdom)
+    print(site.start(args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
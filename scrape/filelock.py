@@ -0,0 +1,25 @@
+"""
+Exclusive lock of a file shared by processes.
+
+Files that several processes rewrite from what they read (the catalog of a
+pricestore written by queue workers, a resultcache of two runs) are read,
+merged and replaced while <file>.lock is held with fcntl.flock. The lock
+goes with the process, a killed writer leaves nothing to clean up.
+"""
+import os
+import fcntl
+import contextlib
+
+@contextlib.contextmanager
+def locked(filename):
+    """hold the lock of filename, its directory is made when missing"""
+    lockname = filename + ".lock"
+    dirname = os.path.dirname(lockname)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    fd = os.open(lockname, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
@@ -2,90 +2,263 @@
 """
 http://kabusapo.com/dl-file/dl-stocklist.php
 https://stooq.com/q/d/l/?s=6758.jp&i=d
+
+Download the whole daily history of each code from stooq into
+stooqdata/<code>.csv, or into a pricestore with --store.
+
+A body with "Exceeded the daily hits limit" is a rate limit, it is
+detected before anything is written, the http cache included, and the
+host waits (--ratedelay, doubling up to a day). The time of the last
+limit is kept in .stooqlimit of the data dir or store, a restarted run
+waits for the rest of ratedelay before its first request and skips the
+codes already written. Several -q workers may share one --store.
+
+usage:
+  python3 getstooqtock.py                      codes of stocklist.csv
+  python3 getstooqtock.py -c codefile -j 2     codes one per line
+  python3 getstooqtock.py --store stooqstore -u
+  python3 getstooqtock.py -q crawl.db          work on a job queue
 """
-import urllib.parse
-import urllib.request
-import io
-import re
 import codecs
 import csv
 import os
+import io
+import json
 import time
-import sys
+import asyncio
+import argparse
+import asyncfetch
+import crawlsched
+import httpcache
+import jobqueue
+import pricestore
+import manifest
 
-requestcount = 0
+STOOQHOST = "stooq.com"
+LIMITFILE = ".stooqlimit"
 
-def send(code):
-    """send query to yahoo api"""
-    global requestcount
-    url = getcodeurl(code)
-    try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        print("Request count %d" % requestcount)
-        return -1
-    print(response)
-    data = response.read()
-    requestcount += 1
-    return data
+marketdict={
+    "東証1部":"T",
+    "マザーズ":"T",
+    "札証":"S",
+    "札幌ア":"S",
+    "東証":"T",
+    "東証1部":"T",
+    "東証2部":"T",
+    "東証JQG":"T",
+    "東証JQS":"T",
+    "東証外国":"T",
+    "福岡Q":"F",
+    "福証":"F",
+    "名古屋セ":"N",
+    "名証1部":"N",
+    "名証2部":"N",
+    }
 
 def getcodeurl(code):
-    """
-    market="T"
-    sy=2018
-    sm=1
-    sd=1
-    ey=2020
-    em=5
-    ed=1
-    """
     url="https://stooq.com/q/d/l/?s=%s.jp&i=d" % code
     return url
 
-def getcodedata(code):
-    url=getcodeurl(code)
-    print(url)
-    data= send(url)
-    
-def getstock(codefile="stocklist.csv"):
-    marketdict={
-        "東証1部":"T",
-        "マザーズ":"T",
-        "札証":"S",
-        "札幌ア":"S",
-        "東証":"T",
-        "東証1部":"T",
-        "東証2部":"T",
-        "東証JQG":"T",
-        "東証JQS":"T",
-        "東証外国":"T",
-        "福岡Q":"F",
-        "福証":"F",
-        "名古屋セ":"N",
-        "名証1部":"N",
-        "名証2部":"N",
-        }
+def checklimit(body):
+    """raise crawlsched.ratelimited on the quota message, before httpcache stores the body"""
+    if crawlsched.LIMITTEXT.encode("utf-8") in body[:1000]:
+        raise crawlsched.ratelimited(crawlsched.LIMITTEXT)
 
+def send(code):
+    """csv text of code, urllib errors and the quota are raised"""
+    return httpcache.urlopen(getcodeurl(code),check=checklimit).body.decode("utf-8",errors="replace")
+
+def checkcsv(data):
+    """
+    Rows of a stooq csv body, header included. The quota message raises
+    crawlsched.ratelimited, anything else that is not a csv raises ValueError.
+    "No data" (unknown code) is an empty list.
+    """
+    if crawlsched.LIMITTEXT in data[:1000]:
+        raise crawlsched.ratelimited(crawlsched.LIMITTEXT)
+    if data.startswith("No data"):
+        return []
+    if not data.startswith("Date,"):
+        raise ValueError("not a stooq csv: %r" % data[:80])
+    return [r for r in csv.reader(io.StringIO(data)) if r]
+
+def readcodes(codefile):
+    """(code,market) of a stocklist.csv, or of a file with one code per line"""
+    codes=[]
     with codecs.open(codefile,encoding='utf-8') as cfp:
         reader = csv.reader(cfp)
         for line in reader:
-            if line[2] in marketdict:
-                code=int(line[0])
-                stockfilename = os.path.join("stooqdata","%d.csv" % code)
-                if os.path.exists(stockfilename):
+            if not line or not line[0].strip().isdigit():
+                continue
+            if len(line) >= 3:
+                if line[2] not in marketdict:
                     continue
-                data=getcodedata(code)
-                print(code)
-                print(data)
-                sys.exit(1)
-                if data:
-                    with open(stockfilename,"w") as wfp:
-                        writer=csv.writer(wfp)
-                        writer.writerows(data)
-                        wfp.close()
-                        print(code)
-                        time.sleep(1)
+                codes.append((int(line[0]),marketdict[line[2]]))
+            else:
+                codes.append((int(line[0]),"T"))
         cfp.close()
+    return codes
+
+class stooqwriter:
+    """writes the rows of a code to datadir csv or to a pricestore"""
+    def __init__(self,args):
+        self.datadir=args.datadir
+        self.store=pricestore.pricestore(args.store) if args.store else None
+        self.update=args.update
+        os.makedirs(args.store or args.datadir,exist_ok=True)
+
+    def filename(self,code):
+        return os.path.join(self.datadir,"%d.csv" % code)
+
+    def done(self,code):
+        if self.update:
+            return False
+        if self.store is not None:
+            return self.store.exists(code)
+        return os.path.exists(self.filename(code))
+
+    def write(self,code,rows):
+        if self.store is not None:
+            storerows=[r for r in (pricestore.stooqrow(d) for d in rows) if r is not None]
+            lastdate=self.store.lastdate(code) if self.update else None
+            if lastdate is not None:
+                # stooq answers the whole history, only the days after the store go in
+                storerows=[r for r in storerows if r[0] > lastdate]
+                if storerows:
+                    self.store.append(code,storerows,"stooq")
+            else:
+                self.store.write(code,storerows,"stooq")
+            return
+        filename=self.filename(code)
+        tmpname=filename + ".tmp%d" % os.getpid()
+        with open(tmpname,"w",newline="") as wfp:
+            writer=csv.writer(wfp)
+            writer.writerows(rows)
+        os.replace(tmpname,filename)
+
+def limitfile(args):
+    return os.path.join(args.store or args.datadir,LIMITFILE)
+
+def savelimit(args):
+    with open(limitfile(args),"w") as wfp:
+        json.dump({"limitedat":time.time()},wfp)
+
+def clearlimit(args):
+    if os.path.exists(limitfile(args)):
+        os.remove(limitfile(args))
+
+def limitwait(args):
+    """seconds left of the quota wait of a previous run"""
+    try:
+        with open(limitfile(args),"r") as fp:
+            limitedat=json.load(fp)["limitedat"]
+    except (OSError,ValueError,KeyError):
+        return 0
+    return max(0,limitedat + args.ratedelay - time.time())
+
+def getstock(args):
+    writer=stooqwriter(args)
+    sched=crawlsched.scheduler(budget=args.budget,ratedelay=args.ratedelay)
+    for code,market in readcodes(args.codefile):
+        if writer.done(code):
+            continue
+        sched.add(crawlsched.job(STOOQHOST,code))
+    wait=limitwait(args)
+    if wait > 0:
+        print("quota of a previous run, waiting {:.0f}s".format(wait))
+        h=sched.host(STOOQHOST)
+        h.blockeduntil=time.monotonic() + wait
+        h.failures=1
+    fetch=asyncfetch.fetcher(concurrency=args.concurrency,rate=args.rate,check=checklimit)
+    counts={"written":0,"nodata":0}
+    written=[]
+
+    async def fetchjob(j):
+        try:
+            return checkcsv(await fetch.get(getcodeurl(j.key)))
+        except crawlsched.ratelimited:
+            savelimit(args)
+            print("{} exceeded".format(j.key))
+            raise
+
+    def handle(j,rows):
+        if len(rows) < 2:
+            counts["nodata"]+=1
+            if args.verbose > 0:
+                print("{} no data".format(j.key))
+            return
+        writer.write(j.key,rows)
+        if writer.store is None:
+            written.append(j.key)
+        clearlimit(args)
+        counts["written"]+=1
+        print(j.key)
+
+    async def run():
+        try:
+            await crawlsched.runasync(sched,fetchjob,handle,args.concurrency,args.verbose)
+        finally:
+            fetch.close()
+
+    asyncio.run(run())
+    manifest.updated(args.datadir,written)
+    for j,e in sched.failed:
+        print("failed {} {}".format(j.key,e))
+    print("written {written} nodata {nodata} failed {failed} requests {requests}".format(
+        failed=len(sched.failed),requests=sched.requestcount().get(STOOQHOST,0),**counts))
+
+def feedqueue(queue,args):
+    """Queue one job per code, stooq returns the whole history in one csv"""
+    writer=stooqwriter(args)
+    queue.addmany([("stooq",code,market,"","",1)
+                   for code,market in readcodes(args.codefile) if not writer.done(code)])
+
+def queuestock(args):
+    """Feed args.queue and work on it, several processes may run this at once"""
+    writer=stooqwriter(args)
+    queue=jobqueue.jobqueue(args.queue)
+    feedqueue(queue,args)
+
+    budget=crawlsched.hostbudget(basedelay=args.ratedelay)
+    wait=limitwait(args)
+    if wait > 0:
+        print("quota of a previous run, waiting {:.0f}s".format(wait))
+        budget.blockeduntil=time.time() + wait
+        budget.failures=1
+
+    def fetchpage(job):
+        try:
+            return checkcsv(send(job["code"]))
+        except crawlsched.ratelimited:
+            savelimit(args)
+            raise
+
+    def writecode(job,rows):
+        writer.write(job["code"],rows)
+        clearlimit(args)
+
+    jobqueue.runworker(queue,"stooq",fetchpage,writecode,maxpage=1,verbose=max(args.verbose,1),
+                       budget=budget)
+    queue.close()
 
 if __name__ == '__main__':
-    getstock()
+    ap = argparse.ArgumentParser(description="Download stooq daily history")
+    ap.add_argument("-v","--verbose",help="vorbose",action="count", default=0)
+    ap.add_argument("-c","--codefile",help="stocklist.csv or one code per line default:%(default)s",default="stocklist.csv")
+    ap.add_argument("-d","--datadir",help="csv data dir default:%(default)s",default="stooqdata")
+    ap.add_argument("--store",help="write to this pricestore instead of datadir csv",default=None)
+    ap.add_argument("-u","--update",help="download codes already written too, the store appends new days",action="store_true")
+    ap.add_argument("-j","--concurrency",help="requests in flight default:%(default)s",type=int,default=2)
+    ap.add_argument("-r","--rate",help="requests per second default:%(default)s",type=float,default=0.2)
+    ap.add_argument("-b","--budget",help="requests per day, 0 is unlimited default:%(default)s",type=int,default=0)
+    ap.add_argument("--ratedelay",help="first wait in seconds after the daily limit default:%(default)s",type=float,default=3600)
+    ap.add_argument("-q","--queue",help="sqlite job queue file shared by worker processes",default=None)
+    httpcache.addarguments(ap)
+    args=ap.parse_args()
+    if args.verbose > 0:
+        print(args)
+    httpcache.configureargs(args)
+    if args.queue:
+        queuestock(args)
+    else:
+        getstock(args)
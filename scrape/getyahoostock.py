@@ -17,27 +17,85 @@ import time
 import json
 import datetime
 import argparse
+import asyncio
+import asyncfetch
+import crawlsched
+import jobqueue
+import httpcache
+import manifest
 
-requestcount = 0
+YAHOOHOST = "finance.yahoo.co.jp"
 
-def dataparse(data,args):
+scheduler = None
+
+marketdict={
+    "東証1部":"T",
+    "マザーズ":"T",
+    "札証":"S",
+    "札幌ア":"S",
+    "東証":"T",
+    "東証1部":"T",
+    "東証2部":"T",
+    "東証JQG":"T",
+    "東証JQS":"T",
+    "東証外国":"T",
+    "福岡Q":"F",
+    "福証":"F",
+    "名古屋セ":"N",
+    "名証1部":"N",
+    "名証2部":"N",
+    }
+
+STATEMARK="window.__PRELOADED_STATE__ = "
+HISTORYKEYS=('"mainStocksHistory"','"history"')
+historiesre=re.compile(r'"histories"\s*:\s*')
+jsondecoder=json.JSONDecoder()
+
+def findhistories(data):
+    """
+    Decode only mainStocksHistory.history.histories of the preloaded state.
+    The keys are searched in order after the state mark and the array is
+    decoded in place with raw_decode, the rest of the state is never parsed.
+    None when the page is not as expected.
+    """
+    p=data.find(STATEMARK)
+    if p < 0:
+        return None
+    for key in HISTORYKEYS:
+        p=data.find(key,p)
+        if p < 0:
+            return None
+        p+=len(key)
+    t=historiesre.search(data,p)
+    if not t:
+        return None
+    try:
+        histories,ep=jsondecoder.raw_decode(data,t.end())
+    except ValueError:
+        return None
+    if not isinstance(histories,list):
+        return None
+    return histories
+
+def preloadedstate(data):
+    """whole __PRELOADED_STATE__ object"""
     fp=io.StringIO(data)
     pat=re.compile('window.__PRELOADED_STATE__ = ')
     for line in fp:
         t=pat.search(line)
         if t:
             ep=t.end()
-            print(t.end())
             break
     jdata=line[ep:]
-    j=json.loads(jdata)
-#print(j['mainStocksHistory']['history']["histories"])
+    return json.loads(jdata)
+
+def historyrows(histories,args):
     sdata=[]
-    for datedata in j['mainStocksHistory']['history']["histories"]:
+    for datedata in histories:
         if args.verbose > 3:
             print(datedata)
-        dt = datetime.datetime.fromisoformat(datedata['baseDateIso'])
-        vl = [ dt.year, dt.month, dt.day ]
+        iso=datedata['baseDateIso']
+        vl = [ int(iso[:4]), int(iso[5:7]), int(iso[8:10]) ]
         for k in ['openPrice','highPrice','lowPrice','closePrice']:
             vl.append(float(datedata[k].replace(",","")))
         vl.append(int(datedata['volume'].replace(",","")))
@@ -47,6 +105,16 @@ def dataparse(data,args):
         print(sdata)
     return sdata
 
+def dataparse(data,args):
+    histories=findhistories(data)
+    if histories is None:
+        histories=preloadedstate(data)['mainStocksHistory']['history']["histories"]
+    return historyrows(histories,args)
+
+def dataparsefull(data,args):
+    """json.loads of the whole state, reference for dataparse"""
+    return historyrows(preloadedstate(data)['mainStocksHistory']['history']["histories"],args)
+
 def dataparseold(data,args):
     sdata=[]
     vdata=data.split("\n")
@@ -74,39 +142,20 @@ def dataparseold(data,args):
     print(sdata)
     return sdata
 
-def getpricedata(code,market,sy,sm,sd,ey,em,ed,p,args):
-    global requestcount
-    #datare="<td>2020年4月8日</td><td>2,556</td><td>2,631</td><td>2,532</td><td>2,597</td><td>40,500</td><td>2,597</td>"
-    datare=re.compile("<td>(\d+)年(\d+)月(\d+)日</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,]+)</td><td>([0-9,.]+)</td>")
-    sdata=[]
-    tryrepeat = 1
-    while tryrepeat == 1:
-        data=send(code,market,sy,sm,sd,ey,em,ed,p,args)
-        if data != -1:
-            tryrepat = 0
-            break
-        time.sleep(60*60*24)
-        requestcount = 0
-    sdata=dataparse(data,args)
-    if args.verbose > 1:
-        print("No data %s\n",code)
-    return sdata
-   
+def getscheduler(args):
+    global scheduler
+    if scheduler is None:
+        scheduler=crawlsched.scheduler(budget=getattr(args,"budget",0),ratedelay=getattr(args,"ratedelay",60))
+    return scheduler
+
 def send(code,market,sy,sm,sd,ey,em,ed,p,args):
-    """send query to yahoo api"""
-    global requestcount
+    """send query to yahoo api, urllib errors are raised"""
     url = getcodeurl(code,market,sy,sm,sd,ey,em,ed,p)
     if args.verbose > 2:
         print(url)
-    try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        print("Request count %d" % requestcount)
-        return -1
-    data = response.read().decode('utf-8')
+    data = httpcache.urlopen(url).body.decode('utf-8')
     if args.verbose > 5:
         print(data)
-    requestcount += 1
     return data
 
 def getcodeurl(code,market,sy,sm,sd,ey,em,ed,p):
@@ -124,71 +173,339 @@ def getcodeurl(code,market,sy,sm,sd,ey,em,ed,p):
     return url
 
 def getcodedataperiod(code,market,sy,sm,sd,ey,em,ed,args):
-    p=1
-    stockdata=[]
-    while p < 500:
-        data = getpricedata(code,market,sy,sm,sd,ey,em,ed,p,args)
-        if args.verbose > 1:
-            print("getpricedata data len={}".format(len(data)))
-        if not data:
-            break
-        stockdata += data
-        p += 1
-    return(stockdata)
+    """
+    Rows of code in the period newest first, [] when a page was given up.
+    Pages are fetched by historycrawl, args.concurrency at once when > 0.
+    """
+    period=(sy,sm,sd,ey,em,ed)
+    sched=getscheduler(args)
+    nfailed=len(sched.failed)
+    crawl=historycrawl([(code,market,None)],period,args)
+    for j in crawl.jobs():
+        sched.add(j)
+    if getattr(args,"concurrency",0) > 0:
+        asyncio.run(crawlasync(crawl,sched,args))
+    else:
+        crawlsync(crawl,sched,args)
+    crawl.abandon(sched.failed[nfailed:])
+    return crawl.results.pop(code,[])
+
+def weekdaycount(sy,sm,sd,ey,em,ed):
+    """weekdays of the period, no less than its trading days"""
+    first=datetime.date(sy,sm,sd)
+    n=(datetime.date(ey,em,ed) - first).days + 1
+    if n <= 0:
+        return 0
+    weeks,rest=divmod(n,7)
+    return weeks * 5 + sum(1 for i in range(rest)
+                           if (first + datetime.timedelta(weeks * 7 + i)).weekday() < 5)
 
+def estimatepages(period,perpage):
+    return max(1,-(-weekdaycount(*period) // perpage))
 
-def getstock(args):
+def parseperiod(args):
     startdate=args.startdate
     enddate=args.enddate
-    codefile=args.codefile
-    datadir=args.datadir
-    marketdict={
-        "東証1部":"T",
-        "マザーズ":"T",
-        "札証":"S",
-        "札幌ア":"S",
-        "東証":"T",
-        "東証1部":"T",
-        "東証2部":"T",
-        "東証JQG":"T",
-        "東証JQS":"T",
-        "東証外国":"T",
-        "福岡Q":"F",
-        "福証":"F",
-        "名古屋セ":"N",
-        "名証1部":"N",
-        "名証2部":"N",
-        }
-
     sy=int(startdate[:4])
     sm=int(startdate[4:6])
     sd=int(startdate[6:])
     ey=int(enddate[:4])
     em=int(enddate[4:6])
     ed=int(enddate[6:])
-    print(sy,sm,sd,ey,em,ed)
+    return sy,sm,sd,ey,em,ed
 
-    with codecs.open(codefile,encoding='utf-8') as cfp:
+def stocktargets(args):
+    """(code,market,stockfilename) of codefile lines not yet in datadir"""
+    targets=[]
+    with codecs.open(args.codefile,encoding='utf-8') as cfp:
         reader = csv.reader(cfp)
         for line in reader:
             if line[2] in marketdict:
                 code=int(line[0])
                 market=marketdict[line[2]]
-                stockfilename = os.path.join(datadir,"%d.csv" % code)
-                if args.verbose > 1:
-                    print("targetfilename {}\n".format(stockfilename))
+                stockfilename = os.path.join(args.datadir,"%d.csv" % code)
                 if os.path.exists(stockfilename):
-                    print("exists {}\n".format(stockfilename))
+                    if args.verbose > 1:
+                        print("exists {}\n".format(stockfilename))
                     continue
-                data=getcodedataperiod(code,market,sy,sm,sd,ey,em,ed,args)
-                if data:
-                    with open(stockfilename,"w") as wfp:
-                        writer=csv.writer(wfp)
-                        writer.writerows(data)
-                        wfp.close()
-                        print(code)
-                        time.sleep(1)
+                targets.append((code,market,stockfilename))
         cfp.close()
+    return targets
+
+class rowcheck:
+    """
+    Validate stage between parse and write. Rows pass through unchanged, a
+    row that is not 9 columns or whose date is not older than the row before
+    raises ValueError, pages that shifted while a code was fetched would
+    otherwise repeat or skip days. The last date is kept across calls, so the
+    pages of a code can go through one by one.
+    """
+    def __init__(self):
+        self.last=None
+
+    def __call__(self,rows):
+        for r in rows:
+            if len(r) != 9:
+                raise ValueError("{} columns {}".format(len(r),r))
+            date=tuple(r[:3])
+            if self.last is not None and date >= self.last:
+                raise ValueError("date {} after {}".format(date,self.last))
+            self.last=date
+            yield r
+
+def writestock(stockfilename,rows):
+    """
+    Write rows (any iterable, newest first) through a temporary file renamed
+    to stockfilename, so a file in datadir is always complete. Nothing is
+    written when there are no rows, returns the row count.
+    """
+    tmpname=stockfilename + ".tmp%d" % os.getpid()
+    count=0
+    try:
+        with open(tmpname,"w") as wfp:
+            writer=csv.writer(wfp)
+            for r in rowcheck()(rows):
+                writer.writerow(r)
+                count += 1
+    except BaseException:
+        os.remove(tmpname)
+        raise
+    if count:
+        os.replace(tmpname,stockfilename)
+    else:
+        os.remove(tmpname)
+    return count
+
+MAXPAGE = 499
+
+class codepages:
+    """
+    Pages of one code. They may come in any order, rows are written in page
+    order (newest first) as soon as the pages before them are in, to a
+    temporary file renamed to stockfilename at the end. Without a file name
+    the rows are kept in self.rows.
+    """
+    def __init__(self,code,stockfilename):
+        self.code=code
+        self.stockfilename=stockfilename
+        self.perpage=0
+        self.maxpage=MAXPAGE
+        self.last=None
+        self.next=1
+        self.pages={}
+        self.jobs=[]
+        self.rows=[]
+        self.count=0
+        self.check=rowcheck()
+        self.wfp=None
+        self.writer=None
+
+    def tmpname(self):
+        return self.stockfilename + ".tmp%d" % os.getpid()
+
+    def setlast(self,page):
+        """page is the last one with rows, cancel the jobs after it"""
+        if self.last is not None and self.last <= page:
+            return
+        self.last=page
+        for j in self.jobs:
+            if j.page > page:
+                j.cancelled=True
+        for p in [p for p in self.pages if p > page]:
+            del self.pages[p]
+
+    def add(self,page,data):
+        self.pages[page]=data
+        while self.next in self.pages:
+            self.write(self.pages.pop(self.next))
+            self.next += 1
+
+    def write(self,data):
+        data=list(self.check(data))
+        self.count += len(data)
+        if self.stockfilename is None:
+            self.rows += data
+            return
+        if not data:
+            return
+        if self.wfp is None:
+            self.wfp=open(self.tmpname(),"w")
+            self.writer=csv.writer(self.wfp)
+        self.writer.writerows(data)
+
+    def complete(self):
+        return self.last is not None and self.next > self.last
+
+    def finish(self):
+        """put the file in place, return the row count"""
+        if self.wfp is not None:
+            self.wfp.close()
+            os.replace(self.tmpname(),self.stockfilename)
+        return self.count
+
+    def abort(self):
+        if self.wfp is not None:
+            self.wfp.close()
+            os.remove(self.tmpname())
+
+class historycrawl:
+    """
+    (code,page) jobs of targets. Page 1 gives the rows per page, and the rest
+    of the pages are queued at once ahead of the other codes, so they are
+    fetched concurrently. There are no more pages than the weekdays of the
+    period fill. A page with fewer rows than page 1, or one that reaches the
+    start date, is the last one and the later pages still waiting are
+    cancelled, so no empty page is requested to find the end. url and parse
+    may be overridden for another page layout.
+    """
+    def __init__(self,targets,period,args,pause=0):
+        self.targets=targets
+        self.period=period
+        self.start=tuple(period[:3])
+        self.args=args
+        self.pause=pause
+        self.codes={}
+        self.results={}
+        self.written=[]
+
+    def jobs(self):
+        jobs=[]
+        for code,market,stockfilename in self.targets:
+            cp=codepages(code,stockfilename)
+            j=crawlsched.job(YAHOOHOST,code,1,(market,stockfilename))
+            cp.jobs.append(j)
+            self.codes[code]=cp
+            jobs.append(j)
+        return jobs
+
+    def url(self,j):
+        return getcodeurl(j.key,j.data[0],*self.period,j.page)
+
+    def parse(self,body):
+        return dataparse(body,self.args)
+
+    def queuepage(self,sched,cp,j,page):
+        nj=crawlsched.job(j.host,j.key,page,j.data)
+        cp.jobs.append(nj)
+        sched.add(nj,first=True)
+
+    def handle(self,sched,j,body):
+        data=self.parse(body)
+        if self.args.verbose > 1:
+            print("getpricedata data len={}".format(len(data)))
+        cp=self.codes.get(j.key)
+        if cp is None or (cp.last is not None and j.page > cp.last):
+            return
+        if j.page == 1:
+            cp.perpage=len(data)
+            cp.maxpage=min(estimatepages(self.period,max(cp.perpage,1)),MAXPAGE)
+        if not data:
+            cp.setlast(j.page - 1)
+        elif len(data) < cp.perpage or tuple(data[-1][:3]) <= self.start or j.page >= cp.maxpage:
+            cp.setlast(j.page)
+        elif j.page == 1:
+            for page in range(cp.maxpage,1,-1):
+                self.queuepage(sched,cp,j,page)
+        if cp.last is None or j.page <= cp.last:
+            try:
+                cp.add(j.page,data)
+            except ValueError:
+                # pages that don't fit together, drop the code and its waiting pages
+                del self.codes[j.key]
+                cp.setlast(0)
+                cp.abort()
+                raise
+        if cp.complete():
+            del self.codes[j.key]
+            count=cp.finish()
+            if cp.stockfilename is None:
+                self.results[j.key]=cp.rows
+            elif count:
+                self.written.append(j.key)
+                print(j.key)
+                if self.pause:
+                    time.sleep(self.pause)
+
+    def abandon(self,failed):
+        """codes with a page given up are not written, the next run picks them up again"""
+        for j,e in failed:
+            cp=self.codes.pop(j.key,None)
+            if cp is not None:
+                cp.abort()
+
+    def report(self,sched):
+        self.abandon(sched.failed)
+        for j,e in sched.failed:
+            print("failed {} page {} {}".format(j.key,j.page,e))
+        if self.args.verbose > 0:
+            print("Request count {}".format(sched.requestcount()))
+
+def crawlsync(crawl,sched,args):
+    crawlsched.runsync(sched,lambda j: send(j.key,j.data[0],*crawl.period,j.page,args),
+        lambda j,body: crawl.handle(sched,j,body),args.verbose)
+
+async def crawlasync(crawl,sched,args):
+    """args.concurrency requests in flight and args.rate requests/s per host"""
+    fetch=asyncfetch.fetcher(concurrency=args.concurrency,rate=getattr(args,"rate",1.0))
+
+    async def fetchjob(j):
+        url=crawl.url(j)
+        if args.verbose > 2:
+            print(url)
+        return await fetch.get(url)
+
+    try:
+        await crawlsched.runasync(sched,fetchjob,
+            lambda j,body: crawl.handle(sched,j,body),args.concurrency,args.verbose)
+    finally:
+        fetch.close()
+
+async def getstockasync(args):
+    """getstock with args.concurrency requests in flight and args.rate requests/s per host"""
+    period=parseperiod(args)
+    print(*period)
+    sched=crawlsched.scheduler(budget=args.budget,ratedelay=getattr(args,"ratedelay",60))
+    crawl=historycrawl(stocktargets(args),period,args)
+    for j in crawl.jobs():
+        sched.add(j)
+    await crawlasync(crawl,sched,args)
+    crawl.report(sched)
+    manifest.updated(args.datadir,crawl.written)
+
+def getstock(args,pause=1):
+    period=parseperiod(args)
+    print(*period)
+    sched=getscheduler(args)
+    crawl=historycrawl(stocktargets(args),period,args,pause=pause)
+    for j in crawl.jobs():
+        sched.add(j)
+    crawlsync(crawl,sched,args)
+    crawl.report(sched)
+    manifest.updated(args.datadir,crawl.written)
+
+def feedqueue(queue,args):
+    """Queue page 1 of every target code, jobs already queued are kept"""
+    queue.addmany([("yahoo",code,market,args.startdate,args.enddate,1)
+                   for code,market,stockfilename in stocktargets(args)])
+
+def queuestock(args):
+    """
+    Feed args.queue and work on it, several processes may run this at once.
+    The manifest is not written here, readers hash the new files again.
+    """
+    period=parseperiod(args)
+    queue=jobqueue.jobqueue(args.queue)
+    feedqueue(queue,args)
+
+    def fetchpage(job):
+        return dataparse(send(job["code"],job["market"],*period,job["page"],args),args)
+
+    def writecode(job,rows):
+        writestock(os.path.join(args.datadir,"%d.csv" % job["code"]),rows)
+
+    jobqueue.runworker(queue,"yahoo",fetchpage,writecode,verbose=max(args.verbose,1),
+                       ratedelay=args.ratedelay)
+    queue.close()
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser(description="Conjuction yahoo stock.\n create retrycode file to reget")
@@ -197,7 +514,21 @@ if __name__ == '__main__':
     ap.add_argument("-s","--startdate",help="get stock from date default:%(default)s",default="20100101")
     ap.add_argument("-e","--enddate",help="get stock to date default:%(default)s",default="20201113")
     ap.add_argument("-d","--datadir",help="store data dir default:%(default)s",default="data")
+    ap.add_argument("-j","--concurrency",help="requests in flight, 0 is sequential default:%(default)s",type=int,default=0)
+    ap.add_argument("-r","--rate",help="requests per second per host with -j default:%(default)s",type=float,default=1.0)
+    ap.add_argument("-b","--budget",help="requests per host per day, 0 is unlimited default:%(default)s",type=int,default=0)
+    ap.add_argument("--ratedelay",help="first wait in seconds after a rate limit default:%(default)s",type=float,default=60)
+    ap.add_argument("-q","--queue",help="sqlite job queue file shared by worker processes",default=None)
+    httpcache.addarguments(ap)
     args=ap.parse_args()
     if args.verbose > 0:
         print(args)
-    getstock(args)
+    cache=httpcache.configureargs(args)
+    if args.queue:
+        queuestock(args)
+    elif args.concurrency > 0:
+        asyncio.run(getstockasync(args))
+    else:
+        getstock(args)
+    if cache is not None and args.verbose > 0:
+        print(cache.report())
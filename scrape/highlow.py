@@ -5,39 +5,93 @@ import csv
 import argparse
 import codecs
 import datetime
+import collections
+import numpy as np
+import pricestore
+import batch
+import manifest
 
-def counttime(args):
+def codeextremes(stockfilename,st,et):
+    """(date of min, date of max) adjclose of the rows within [st, et], 0 when there is none"""
+    with open(stockfilename,"r") as sfp:
+        stockreader=csv.reader(sfp)
+        maxd=[0,0]
+        mind=[0,1e99]
+        for sdata in stockreader:
+            d=int(sdata[0]) * 10000 + int(sdata[1]) * 100 + int(sdata[2])
+            if st <= d <= et:
+                v=float(sdata[8])
+                if maxd[1] < v:
+                    maxd=[d,v]
+                if mind[1] > v:
+                    mind=[d,v]
+    return mind[0],maxd[0]
+
+def countshard(codes,args):
+    """Row scan of codes, return (mincount, maxcount) Counters keyed by YYYYMMDD"""
     st=int(args.startdate)
     et=int(args.enddate)
 
-    maxcount=[0] * (et-st + 1)
-    mincount=[0] * (et-st + 1)
+    maxcount=collections.Counter()
+    mincount=collections.Counter()
+
+    for code in codes:
+        stockfilename = os.path.join(args.datadir,"%d.csv" % code)
+        if os.path.exists(stockfilename):
+            mind,maxd=codeextremes(stockfilename,st,et)
+            maxcount[maxd] += 1
+            mincount[mind] += 1
+    return mincount,maxcount
+
+def extremeshard(codes,args):
+    """[(code, date of min, date of max)] of codes"""
+    st=int(args.startdate)
+    et=int(args.enddate)
+    return [(code,)+codeextremes(os.path.join(args.datadir,"%d.csv" % code),st,et) for code in codes]
+
+def mergecount(parts):
+    """Sum (mincount, maxcount) partial results of shards"""
+    maxcount=collections.Counter()
+    mincount=collections.Counter()
+    for pmin,pmax in parts:
+        mincount.update(pmin)
+        maxcount.update(pmax)
+    return mincount,maxcount
+
+def counttime(args):
+    codes=batch.readcodes(args.codefile)
+    mincount,maxcount=mergecount(batch.runshards(countshard,codes,args.jobs,args))
+    printcount(int(args.startdate),int(args.enddate),mincount,maxcount)
+
+def counttimeincremental(args):
+    """
+    counttime that scans only the codes whose file digest (manifest of
+    datadir) changed since the run that wrote the args.incremental cache
+    """
+    codes=batch.readcodes(args.codefile)
+    m=manifest.manifest(args.datadir)
+    digests=m.digests(codes)
+    cache=manifest.resultcache(args.incremental,"%s %s" % (args.startdate,args.enddate))
+    stale=[code for code in digests if cache.stale(code,digests[code])]
+    for part in batch.runshards(extremeshard,stale,args.jobs,args):
+        for code,mind,maxd in part:
+            cache.put(code,digests[code],[mind,maxd])
+    cache.drop(digests)
+    cache.save()
+    m.save()
+    if args.verbose > 0:
+        sys.stderr.write("scanned %d of %d codes\n" % (len(stale),len(digests)))
+    maxcount=collections.Counter()
+    mincount=collections.Counter()
+    for code in codes:
+        if code in digests:
+            mind,maxd=cache.get(code)
+            maxcount[maxd] += 1
+            mincount[mind] += 1
+    printcount(int(args.startdate),int(args.enddate),mincount,maxcount)
 
-    with codecs.open(args.codefile,encoding='utf-8') as cfp:
-        cfpreader = csv.reader(cfp)
-        cfpreader.__next__()
-        c=0
-        for line in cfpreader:
-            #if c > 10:
-            #    break
-            c += 1
-            code=int(line[0])
-            stockfilename = os.path.join(args.datadir,"%d.csv" % code)
-            if os.path.exists(stockfilename):
-                with open(stockfilename,"r") as sfp:
-                    stockreader=csv.reader(sfp)
-                    maxd=[0,0]
-                    mind=[0,1e99]
-                    for sdata in stockreader:
-                        d=int(sdata[0]) * 10000 + int(sdata[1]) * 100 + int(sdata[2])
-                        if st <= d <= et:
-                            v=float(sdata[8])
-                            if maxd[1] < v:
-                                maxd=[d,v]
-                            if mind[1] > v:
-                                mind=[d,v]
-                    maxcount[maxd[0] - st] += 1
-                    mincount[mind[0] - st] += 1
+def printcount(st,et,mincount,maxcount):
+    """print date mincount maxcount, mincount/maxcount are YYYYMMDD -> count"""
     for d in range(et-st):
         t=d+st
         month=int(t % 10000) // 100
@@ -50,7 +104,69 @@ def counttime(args):
             continue
         if month in (4,6,9,11) and day > 30:
             continue
-        print(d+st,mincount[d],maxcount[d])
+        print(d+st,mincount.get(t,0),maxcount.get(t,0))
+
+def readadjclose(code,args,store):
+    """return (dates, adjclose) arrays of code, dates as YYYYMMDD"""
+    if store is not None:
+        if not store.exists(code):
+            return None
+        cols=store.read(code,fields=("date","adjclose"))
+        return cols["date"],cols["adjclose"]
+    stockfilename = os.path.join(args.datadir,"%d.csv" % code)
+    if not os.path.exists(stockfilename):
+        return None
+    a=np.loadtxt(stockfilename,delimiter=",",ndmin=2)
+    if a.size == 0:
+        return None
+    dates=(a[:,0] * 10000 + a[:,1] * 100 + a[:,2]).astype(np.int32)
+    return dates,a[:,8]
+
+def buildpanel(codes,st,et,args):
+    """
+    Dense trading day x code panel of adjclose within [st, et], NaN where a code has no row.
+    return (dates, panel, codes present)
+    """
+    store=pricestore.pricestore(args.store) if args.store else None
+    series=[]
+    for code in codes:
+        r=readadjclose(code,args,store)
+        if r is None:
+            continue
+        dates,values=r
+        inrange=(dates >= st) & (dates <= et)
+        series.append((code,dates[inrange],values[inrange]))
+    alldates=np.unique(np.concatenate([s[1] for s in series])) if series else np.zeros(0,dtype=np.int32)
+    panel=np.full((len(alldates),len(series)),np.nan)
+    for j,(code,dates,values) in enumerate(series):
+        panel[np.searchsorted(alldates,dates),j]=values
+    return alldates,panel,[s[0] for s in series]
+
+def panelshard(codes,args):
+    """Panel argmax/argmin of codes, return (mincount, maxcount) Counters keyed by YYYYMMDD"""
+    st=int(args.startdate)
+    et=int(args.enddate)
+    dates,panel,present=buildpanel(codes,st,et,args)
+    valid=~np.isnan(panel).all(axis=0)
+    panel=panel[:,valid]
+    if panel.shape[1] == 0:
+        return collections.Counter(),collections.Counter()
+    n=len(dates)
+    #countshard keeps the first row in file order on ties, yahoo files are newest first
+    rpanel=panel[::-1]
+    maxidx=n - 1 - np.argmax(np.where(np.isnan(rpanel),-np.inf,rpanel),axis=0)
+    minidx=n - 1 - np.argmin(np.where(np.isnan(rpanel),np.inf,rpanel),axis=0)
+    maxbins=np.bincount(maxidx,minlength=n)
+    minbins=np.bincount(minidx,minlength=n)
+    maxcount=collections.Counter({int(dates[i]):int(maxbins[i]) for i in np.nonzero(maxbins)[0]})
+    mincount=collections.Counter({int(dates[i]):int(minbins[i]) for i in np.nonzero(minbins)[0]})
+    return mincount,maxcount
+
+def counttimepanel(args):
+    """Same output as counttime, computed over the whole universe at once"""
+    codes=batch.readcodes(args.codefile)
+    mincount,maxcount=mergecount(batch.runshards(panelshard,codes,args.jobs,args))
+    printcount(int(args.startdate),int(args.enddate),mincount,maxcount)
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser(description="Conjuction yahoo stock.\n create retrycode file to reget")
@@ -59,7 +175,19 @@ if __name__ == "__main__":
     ap.add_argument("-d","--datadir",help="data dir default:%(default)s",default="data")
     ap.add_argument("-s","--startdate",help="from date default:%(default)s",default="20100101")
     ap.add_argument("-e","--enddate",help="to date default:%(default)s",default="20201113")
+    ap.add_argument("-p","--panel",help="vectorized trading day x code panel mode",action="store_true")
+    ap.add_argument("--store",help="read pricestore dir instead of datadir csv (panel mode)",default=None)
+    ap.add_argument("-j","--jobs",help="worker processes default:%(default)s",type=int,default=1)
+    ap.add_argument("-i","--incremental",help="scan only codes changed since the last run, results kept in this file",
+                    nargs="?",const="highlow.cache.json",default=None)
     args=ap.parse_args()
+    if args.panel and args.incremental:
+        ap.error("--incremental works with the row scan, not --panel")
     if args.verbose > 0:
         print(args)
-    counttime(args)
+    if args.panel:
+        counttimepanel(args)
+    elif args.incremental:
+        counttimeincremental(args)
+    else:
+        counttime(args)
@@ -2,7 +2,11 @@ import os
 import datetime
 import csv
 import sys
-import copy
+import pricestore
+import rollingextreme
+import batch
+import manifest
+import argparse
 
 class highvalue:
   def __init__(self):
@@ -20,49 +24,75 @@ class highvalue:
       cfp.close()
     self.sortdata()
 
+  def readstore(self,code):
+    """Read code from pricestore in storepath instead of csv"""
+    store=pricestore.pricestore(self.storepath)
+    self.rawdata=self.convertstore(store.read(code))
+    #store is ascending, keep rawdata newest first as readdata does
+    self.rawdata.reverse()
+
   def sortdata(self):
     pass
 
   def convertcsvline(self,d):
     return d
 
+  def convertstore(self,cols):
+    """Convert store columns to rawdata rows [date,open,high,low,close,volume]"""
+    dates=[pricestore.inttodate(d) for d in cols["date"]]
+    return [list(r) for r in zip(dates,
+      cols["open"].tolist(), cols["high"].tolist(),
+      cols["low"].tolist(), cols["close"].tolist(),
+      cols["volume"].tolist())]
+
   def addmaxvalue(self):
     """Add max value in span maxspan"""
     maxspan=datetime.timedelta(self.span)
-    maxlist=[]
-    self.data=copy.deepcopy(self.rawdata)
-    i=len(self.data)
+    self.data=[list(d) for d in self.rawdata]
+    n=len(self.data)
+    if n == 0:
+      return
+    if n == 1:
+      self.data[0].append(self.data[0][2])
+      return
     startdate=self.data[-1][0]
-    maxlist.append((self.data[-1][2],startdate))
-  
-    for i in range(len(self.data)-1,0,-1):
-      dt=self.data[i][0]
-      maxlist.append((self.data[i][2],dt))
+    #rows from the oldest up to the first one past maxspan get -1
+    b=n-1
+    while b > 1 and self.data[b][0] - startdate <= maxspan:
+      b -= 1
+    #rollingextremes works in ascending order, position t is data[n-1-t]
+    ext=rollingextreme.rollingextremes(
+      [d[0] for d in reversed(self.data)],
+      [d[2] for d in reversed(self.data)],
+      [d[3] for d in reversed(self.data)],
+      [maxspan,None])
+    spanmax=ext[(maxspan,"max")]
+    allmax=ext[(None,"max")]
+    for i in range(n-1,b-1,-1):
       self.data[i].append(-1)
-      if dt - startdate > maxspan:
-        break
+    #first row after the warm up sees every warm up row
+    self.data[b-1].append(allmax[n-1-b])
+    #later rows see the span ending at the previous day
+    for i in range(b-2,-1,-1):
+      self.data[i].append(spanmax[n-2-i])
+
+  def addextremes(self,spans=(7*52,7*26,None)):
+    """
+    Rolling max of high and min of low for several spans in days (None is all-time).
+    self.extremes[(span,"max"|"min")] is aligned with self.rawdata (newest first)
+    """
+    rawdata=self.rawdata
+    deltas=[datetime.timedelta(s) if s is not None else None for s in spans]
+    ext=rollingextreme.rollingextremes(
+      [d[0] for d in reversed(rawdata)],
+      [d[2] for d in reversed(rawdata)],
+      [d[3] for d in reversed(rawdata)],
+      deltas)
+    self.extremes={}
+    for s,delta in zip(spans,deltas):
+      for kind in ("max","min"):
+        self.extremes[(s,kind)]=ext[(delta,kind)][::-1]
 
-    maxlist.sort(reverse=True)
-    #At this point maxlist contains maxspan maxvalue
-    #for pp in maxlist:
-    #  print(pp)
-    #print(maxlist)
-    #sys.exit(1)
-    i -= 1
-    while i >= 0:
-      dt=self.data[i][0]
-      self.data[i].append(maxlist[0][0])
-      maxlist.append((self.data[i][2],dt))
-      maxlist.sort(reverse=True)
-      lt = dt - maxspan
-      for j in range(len(maxlist)):
-        if maxlist[j][1] >= lt:
-          break
-      if j > 0:
-        maxlist[:j] = []
-      
-      i -= 1
-  
   def addmaxvaluecode(self,code):
     with open(os.path.join("/home/jun/stock/data","%d.csv" % code),"r") as cfp:
       data=[]
@@ -99,6 +129,7 @@ class yahoostock(highvalue):
   def __init__(self):
     highvalue.__init__(self)
     self.datapath="/home/jun/stock/data"
+    self.storepath="/home/jun/stock/datastore"
 
   def convertcsvline(self,d):
     dt = datetime.date(int(d[0]),int(d[1]),int(d[2]))
@@ -108,10 +139,19 @@ class yahoostock(highvalue):
       float(d[3])*r, float(d[4])*r, float(d[5])*r, float(d[6])*r,
       int(d[7])/r]
 
+  def convertstore(self,cols):
+    r = cols["adjclose"] / cols["close"]
+    dates=[pricestore.inttodate(d) for d in cols["date"]]
+    return [list(v) for v in zip(dates,
+      (cols["open"]*r).tolist(), (cols["high"]*r).tolist(),
+      (cols["low"]*r).tolist(), (cols["close"]*r).tolist(),
+      (cols["volume"]/r).tolist())]
+
 class stooqstock(highvalue):
   def __init__(self):
     highvalue.__init__(self)
     self.datapath="/home/jun/stock/stooqdata"
+    self.storepath="/home/jun/stock/stooqstore"
 
   def convertcsvline(self,d):
     if d[0] == "Date":
@@ -177,13 +217,70 @@ def commonrange(y,s):
   print(y.data[ye])
   print(s.data[se])
 
+DATASOURCE={
+  "stooq":stooqstock,
+  "yahoo":yahoostock,
+  }
+
+def maxvalueshard(codes,source,usestore,path=None):
+  """
+  addmaxvalue for each code and write xaddmaxs<code>.csv here in the worker,
+  return the codes written. Only one code's rows are held at a time.
+  """
+  written=[]
+  for code in codes:
+    datainstance = DATASOURCE[source]()
+    if path:
+      if usestore:
+        datainstance.storepath=path
+      else:
+        datainstance.datapath=path
+    try:
+      if usestore:
+        datainstance.readstore(code)
+      else:
+        datainstance.readdata(code)
+    except FileNotFoundError:
+      continue
+    if not datainstance.rawdata:
+      continue
+    datainstance.addmaxvalue()
+    datainstance.data.sort()
+    datainstance.csvwrite("xaddmaxs%d.csv" % code)
+    written.append(code)
+  return written
+
 if __name__ == "__main__":
-  datasource=stooqstock
-  #datasource=yahoostock
-  datainstance = datasource()
-  datainstance.readdata(int(sys.argv[1]))
-  datainstance.addmaxvalue()
-  datainstance.data.sort()
-  datainstance.csvwrite("xaddmaxs%s.csv" % sys.argv[1])
-    
+  ap = argparse.ArgumentParser(description="Add max value column and write xaddmaxs<code>.csv")
+  ap.add_argument("-v","--verbose",help="vorbose",action="count", default=0)
+  ap.add_argument("-c","--codefile",help="code list file used when no code is given default:%(default)s",default="stocklist.csv")
+  ap.add_argument("-s","--source",help="data source default:%(default)s",choices=sorted(DATASOURCE),default="stooq")
+  ap.add_argument("--store",help="read from pricestore instead of csv",action="store_true")
+  ap.add_argument("-d","--datapath",help="csv or store dir instead of the source default",default=None)
+  ap.add_argument("-j","--jobs",help="worker processes default:%(default)s",type=int,default=1)
+  ap.add_argument("-i","--incremental",help="write only codes whose csv changed since the last run, digests kept in this file",
+                  nargs="?",const="xaddmaxs.cache.json",default=None)
+  ap.add_argument("codes",help="stock codes",nargs="*",type=int)
+  args=ap.parse_args()
+  if args.verbose > 0:
+    print(args)
+  codes=args.codes if args.codes else batch.readcodes(args.codefile)
+  if args.incremental:
+    if args.store:
+      ap.error("--incremental works on csv data")
+    m=manifest.manifest(args.datapath or DATASOURCE[args.source]().datapath)
+    digests=m.digests(codes)
+    cache=manifest.resultcache(args.incremental,"%s %d" % (args.source,highvalue().span))
+    codes=[code for code in codes if code in digests and
+           (cache.stale(code,digests[code]) or not os.path.exists("xaddmaxs%d.csv" % code))]
+    if args.verbose > 0:
+      print("changed %d of %d codes" % (len(codes),len(digests)))
+  for written in batch.eachshard(maxvalueshard,codes,args.jobs,args.source,args.store,args.datapath):
+    if args.incremental:
+      for code in written:
+        cache.put(code,digests[code])
+  if args.incremental:
+    cache.save()
+    m.save()
+
   #buynextopensellnextweekopen(y.data)
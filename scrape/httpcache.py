@@ -0,0 +1,363 @@
+#!/usr/bin/python3
+"""
+On-disk HTTP response cache shared by the scrapers.
+
+Bodies are stored once under their sha256 (body/ab/<digest>), every url has
+a small json record (meta/ab/<sha256 of url>.json) with the body digest,
+ETag, Last-Modified, Content-Type and the time it was fetched.
+
+modes:
+  use      a record younger than ttl is served without a request, an older
+           one is revalidated with If-None-Match/If-Modified-Since from the
+           stored ETag/Last-Modified and a 304 serves the stored body. A
+           record with neither is fetched again
+  refresh  always revalidate
+  replay   never touch the network, an url that was not recorded raises
+           cachemiss
+
+Only 200 responses are stored. The cache is turned on by configure() or by
+the environment, so scripts without options can use it too:
+  HTTPCACHE=cachedir HTTPCACHE_TTL=3600 HTTPCACHE_MODE=replay
+HTTPSITES=https://stooq.com=http://127.0.0.1:8765 sends the requests of a
+site to another base url, the local stand-in server of fakesite.py.
+
+usage:
+  python3 httpcache.py stats cachedir
+  python3 httpcache.py purge cachedir 86400     records older than a day
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import argparse
+import urllib.error
+import urllib.request
+
+USE = "use"
+REFRESH = "refresh"
+REPLAY = "replay"
+MODES = [USE, REFRESH, REPLAY]
+
+class cachemiss(Exception):
+    """replay mode and the url was never recorded"""
+
+class response:
+    """body and headers of a fetched or cached 200 response"""
+    def __init__(self, url, body, headers, fromcache=False):
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.fromcache = fromcache
+
+    def charset(self, default="utf-8"):
+        ctype = self.headers.get("content-type", "")
+        for part in ctype.split(";")[1:]:
+            k, sep, v = part.strip().partition("=")
+            if k.lower() == "charset" and v:
+                return v.strip('"')
+        return default
+
+    def text(self, errors="strict"):
+        return self.body.decode(self.charset(), errors=errors)
+
+KEEPHEADERS = ["content-type", "etag", "last-modified"]
+
+def keepheaders(headers):
+    """lower-cased subset of headers worth storing, headers is any mapping"""
+    kept = {}
+    for k in KEEPHEADERS:
+        v = headers.get(k)
+        if v is not None:
+            kept[k] = v
+    return kept
+
+def writeatomic(filename, data):
+    tmpname = filename + ".tmp%d-%d" % (os.getpid(), threading.get_ident())
+    with open(tmpname, "wb") as wfp:
+        wfp.write(data)
+    os.replace(tmpname, filename)
+
+class httpcache:
+    def __init__(self, path, ttl=3600, mode=USE):
+        if mode not in MODES:
+            raise ValueError("unknown cache mode %s" % mode)
+        self.path = path
+        self.ttl = ttl
+        self.mode = mode
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+
+    def metaname(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, "meta", key[:2], key + ".json")
+
+    def bodyname(self, digest):
+        return os.path.join(self.path, "body", digest[:2], digest)
+
+    def load(self, url):
+        """record of url, None when there is none or it can't be read"""
+        try:
+            with open(self.metaname(url), "r") as fp:
+                meta = json.load(fp)
+            if not os.path.exists(self.bodyname(meta["digest"])):
+                return None
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def body(self, meta):
+        with open(self.bodyname(meta["digest"]), "rb") as fp:
+            return fp.read()
+
+    def store(self, url, body, headers):
+        digest = hashlib.sha256(body).hexdigest()
+        bodyname = self.bodyname(digest)
+        if not os.path.exists(bodyname):
+            os.makedirs(os.path.dirname(bodyname), exist_ok=True)
+            writeatomic(bodyname, body)
+        meta = {"url": url, "digest": digest, "size": len(body),
+                "fetched": time.time(), "headers": keepheaders(headers)}
+        self.savemeta(meta)
+        return meta
+
+    def savemeta(self, meta):
+        metaname = self.metaname(meta["url"])
+        os.makedirs(os.path.dirname(metaname), exist_ok=True)
+        writeatomic(metaname, json.dumps(meta).encode("utf-8"))
+
+    def touch(self, meta):
+        """304: the stored body is good for another ttl"""
+        meta["fetched"] = time.time()
+        self.savemeta(meta)
+
+    def fresh(self, meta):
+        return self.mode == USE and time.time() - meta["fetched"] < self.ttl
+
+    def conditional(self, meta):
+        headers = {}
+        if "etag" in meta["headers"]:
+            headers["If-None-Match"] = meta["headers"]["etag"]
+        if "last-modified" in meta["headers"]:
+            headers["If-Modified-Since"] = meta["headers"]["last-modified"]
+        return headers
+
+    def cached(self, meta):
+        self.hits += 1
+        return response(meta["url"], self.body(meta), meta["headers"], fromcache=True)
+
+    def lookup(self, url):
+        """(meta, response to serve without a request or None)"""
+        meta = self.load(url)
+        if self.mode == REPLAY:
+            if meta is None:
+                raise cachemiss(url)
+            return meta, self.cached(meta)
+        if meta is not None and self.fresh(meta):
+            return meta, self.cached(meta)
+        return meta, None
+
+    def get(self, url, headers=None, timeout=30, check=None):
+        """
+        GET through urllib, HTTP errors other than 304 are raised as urlopen does.
+        check(body) sees a fetched body before it is stored, what it raises goes
+        to the caller and nothing is stored.
+        """
+        meta, r = self.lookup(url)
+        if r is not None:
+            return r
+        headers = dict(headers or {})
+        if meta is not None:
+            headers.update(self.conditional(meta))
+        req = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as res:
+                body = res.read()
+                resheaders = res.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and meta is not None:
+                self.touch(meta)
+                self.revalidated += 1
+                return response(url, self.body(meta), meta["headers"], fromcache=True)
+            raise
+        if check is not None:
+            check(body)
+        self.fetched += 1
+        meta = self.store(url, body, resheaders)
+        return response(url, body, meta["headers"])
+
+    def requestsget(self, getter, url, **kwargs):
+        """getter.get(url, **kwargs) of requests or a Session, answers are requests.Response"""
+        meta, r = self.lookup(url)
+        if r is not None:
+            return requestsresponse(r)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if meta is not None:
+            headers.update(self.conditional(meta))
+        res = getter.get(url, headers=headers, **kwargs)
+        if res.status_code == 304 and meta is not None:
+            self.touch(meta)
+            self.revalidated += 1
+            return requestsresponse(response(url, self.body(meta), meta["headers"], fromcache=True))
+        if res.status_code == 200:
+            self.fetched += 1
+            self.store(url, res.content, res.headers)
+        return res
+
+    def remember(self, url, produce):
+        """
+        Text of url for fetchers that are not plain GETs (a browser). produce()
+        returns the text or None, None is not stored.
+        """
+        meta, r = self.lookup(url)
+        if r is not None:
+            return r.text()
+        text = produce()
+        if text is not None:
+            self.fetched += 1
+            self.store(url, text.encode("utf-8"), {"content-type": "text/html; charset=utf-8"})
+        return text
+
+    def report(self):
+        return "cache hits %d revalidated %d fetched %d" % (self.hits, self.revalidated, self.fetched)
+
+    def records(self):
+        metadir = os.path.join(self.path, "meta")
+        for root, dirs, files in os.walk(metadir):
+            for f in files:
+                if f.endswith(".json"):
+                    yield os.path.join(root, f)
+
+    def purge(self, age):
+        """drop records older than age seconds and bodies nothing refers to"""
+        now = time.time()
+        used = set()
+        removed = 0
+        for name in list(self.records()):
+            try:
+                with open(name, "r") as fp:
+                    meta = json.load(fp)
+            except (OSError, ValueError):
+                os.remove(name)
+                removed += 1
+                continue
+            if now - meta["fetched"] > age:
+                os.remove(name)
+                removed += 1
+            else:
+                used.add(meta["digest"])
+        for root, dirs, files in os.walk(os.path.join(self.path, "body")):
+            for f in files:
+                if f not in used and ".tmp" not in f:
+                    os.remove(os.path.join(root, f))
+        return removed
+
+def requestsresponse(r):
+    """requests.Response holding a cached response"""
+    import requests
+    res = requests.models.Response()
+    res.status_code = 200
+    res.url = r.url
+    res._content = r.body
+    res.headers = requests.structures.CaseInsensitiveDict(r.headers)
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+cache = None
+configured = False
+sites = None
+
+def rewrite(url):
+    """url with its site replaced as HTTPSITES says"""
+    global sites
+    if sites is None:
+        sites = {}
+        for item in os.environ.get("HTTPSITES", "").split(","):
+            site, sep, base = item.partition("=")
+            if sep:
+                sites[site] = base
+    for site, base in sites.items():
+        if url.startswith(site):
+            return base + url[len(site):]
+    return url
+
+def configure(path=None, ttl=None, mode=None):
+    """
+    Set the cache used by urlopen/requestsget/remember. Arguments left None
+    come from HTTPCACHE, HTTPCACHE_TTL and HTTPCACHE_MODE, no path is no cache.
+    """
+    global cache, configured
+    path = path or os.environ.get("HTTPCACHE")
+    if ttl is None:
+        ttl = float(os.environ.get("HTTPCACHE_TTL", 3600))
+    mode = mode or os.environ.get("HTTPCACHE_MODE", USE)
+    cache = httpcache(path, ttl, mode) if path else None
+    configured = True
+    return cache
+
+def current():
+    if not configured:
+        configure()
+    return cache
+
+def urlopen(url, headers=None, timeout=30, check=None):
+    """response of url, through the cache when one is configured. check as httpcache.get"""
+    url = rewrite(url)
+    c = current()
+    if c is not None:
+        return c.get(url, headers, timeout, check)
+    req = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=timeout) as res:
+        body = res.read()
+        headers = keepheaders(res.headers)
+    if check is not None:
+        check(body)
+    return response(url, body, headers)
+
+def requestsget(url, session=None, **kwargs):
+    """requests.get(url, **kwargs), or session.get, through the cache when one is configured"""
+    import requests
+    getter = session or requests
+    url = rewrite(url)
+    c = current()
+    if c is None:
+        return getter.get(url, **kwargs)
+    return c.requestsget(getter, url, **kwargs)
+
+def remember(url, produce):
+    c = current()
+    if c is None:
+        return produce()
+    return c.remember(url, produce)
+
+def addarguments(ap):
+    """--cache/--cachettl/--replay options for scripts with argparse"""
+    ap.add_argument("--cache", help="http cache dir, default $HTTPCACHE", default=None)
+    ap.add_argument("--cachettl", help="seconds a cached page is used without asking default:3600", type=float, default=None)
+    ap.add_argument("--replay", help="serve recorded pages only, no network", action="store_true")
+
+def configureargs(args):
+    return configure(args.cache, args.cachettl, REPLAY if args.replay else None)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="HTTP response cache")
+    ap.add_argument("command", choices=["stats", "purge"])
+    ap.add_argument("cachedir", help="cache dir")
+    ap.add_argument("age", help="purge records older than this many seconds", type=float, nargs="?", default=86400)
+    args = ap.parse_args()
+    if not os.path.isdir(args.cachedir):
+        sys.stderr.write("%s doesn't exists\n" % args.cachedir)
+        sys.exit(1)
+    c = httpcache(args.cachedir)
+    if args.command == "stats":
+        count = 0
+        size = 0
+        for name in c.records():
+            count += 1
+            with open(name, "r") as fp:
+                size += json.load(fp)["size"]
+        print("records %d bytes %d" % (count, size))
+    elif args.command == "purge":
+        print("purged %d" % c.purge(args.age))
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+"""
+Persistent crawl job queue in a local SQLite file.
+
+One row per (source, code, startdate, enddate, page). A worker claims a
+ready job under a lease, and a job whose lease ran out (crashed worker) is
+claimed again by the next worker. Parsed rows of finished pages are kept
+in the queue, so a resumed crawl only fetches the pages that were not done.
+
+states: ready -> leased -> done | failed
+
+usage:
+  python3 jobqueue.py stats crawl.db
+  python3 jobqueue.py requeue crawl.db      failed jobs back to ready
+  python3 jobqueue.py purge crawl.db        drop done jobs of written codes
+"""
+import os
+import sys
+import json
+import time
+import socket
+import itertools
+import sqlite3
+import argparse
+import crawlsched
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    market TEXT,
+    startdate TEXT,
+    enddate TEXT,
+    page INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',
+    worker TEXT,
+    leaseuntil REAL DEFAULT 0,
+    notbefore REAL DEFAULT 0,
+    tries INTEGER DEFAULT 0,
+    rows TEXT,
+    written INTEGER DEFAULT 0,
+    error TEXT,
+    UNIQUE (source, code, startdate, enddate, page)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (source, state, notbefore);
+"""
+
+COLUMNS = ["id", "source", "code", "market", "startdate", "enddate", "page",
+           "state", "worker", "leaseuntil", "notbefore", "tries"]
+
+def workername():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+class jobqueue:
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, source, code, market, startdate, enddate, page=1):
+        """Queue a job, a job already in the queue is left as it is"""
+        self.db.execute(
+            "INSERT OR IGNORE INTO jobs (source,code,market,startdate,enddate,page) VALUES (?,?,?,?,?,?)",
+            (source, code, market, startdate, enddate, page))
+
+    def addmany(self, jobs):
+        """jobs: (source,code,market,startdate,enddate,page)"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO jobs (source,code,market,startdate,enddate,page) VALUES (?,?,?,?,?,?)",
+                jobs)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def claim(self, source, worker=None, lease=300):
+        """Lease one job of source, None if nothing can be run now"""
+        worker = worker or workername()
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT " + ",".join(COLUMNS) + " FROM jobs WHERE source=? AND notbefore<=? AND "
+                "(state='ready' OR (state='leased' AND leaseuntil<?)) ORDER BY code,page LIMIT 1",
+                (source, now, now)).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            self.db.execute(
+                "UPDATE jobs SET state='leased',worker=?,leaseuntil=?,tries=tries+1 WHERE id=?",
+                (worker, now + lease, row[0]))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        job = dict(zip(COLUMNS, row))
+        job["worker"] = worker
+        job["tries"] += 1
+        return job
+
+    def renew(self, job, lease=300):
+        self.db.execute("UPDATE jobs SET leaseuntil=? WHERE id=? AND worker=?",
+                        (time.time() + lease, job["id"], job["worker"]))
+
+    def done(self, job, rows, nextpage=False):
+        """Store rows of job and mark it done, queue page+1 of the same code when nextpage"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("UPDATE jobs SET state='done',rows=?,error=NULL WHERE id=?",
+                            (json.dumps(rows), job["id"]))
+            if nextpage:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO jobs (source,code,market,startdate,enddate,page) VALUES (?,?,?,?,?,?)",
+                    (job["source"], job["code"], job["market"], job["startdate"], job["enddate"], job["page"] + 1))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def retry(self, job, delay, error=""):
+        """Give the job back, no worker takes it for delay seconds"""
+        self.db.execute("UPDATE jobs SET state='ready',worker=NULL,notbefore=?,error=? WHERE id=?",
+                        (time.time() + delay, str(error), job["id"]))
+
+    def fail(self, job, error=""):
+        self.db.execute("UPDATE jobs SET state='failed',error=? WHERE id=?",
+                        (str(error), job["id"]))
+
+    def pages(self, job):
+        """Rows of done pages of the job's code and range in page order, one page in memory at a time"""
+        for (r,) in self.db.execute(
+                "SELECT rows FROM jobs WHERE source=? AND code=? AND startdate=? AND enddate=? "
+                "AND state='done' ORDER BY page",
+                (job["source"], job["code"], job["startdate"], job["enddate"])):
+            yield from json.loads(r)
+
+    def written(self, job):
+        """Mark the code of job as written to disk"""
+        self.db.execute("UPDATE jobs SET written=1 WHERE source=? AND code=? AND startdate=? AND enddate=?",
+                        (job["source"], job["code"], job["startdate"], job["enddate"]))
+
+    def pending(self, source):
+        """Jobs of source not done or failed, including ones waiting for notbefore"""
+        return self.db.execute("SELECT count(*) FROM jobs WHERE source=? AND state IN ('ready','leased')",
+                               (source,)).fetchone()[0]
+
+    def stats(self):
+        return self.db.execute(
+            "SELECT source,state,count(*) FROM jobs GROUP BY source,state ORDER BY source,state").fetchall()
+
+    def requeue(self):
+        return self.db.execute("UPDATE jobs SET state='ready',notbefore=0,tries=0 WHERE state='failed'").rowcount
+
+    def purge(self):
+        return self.db.execute("DELETE FROM jobs WHERE written=1").rowcount
+
+def runworker(queue, source, fetchpage, writecode, worker=None, lease=300, maxpage=499, verbose=0,
+              ratedelay=60, budget=None):
+    """
+    Claim jobs of source until none are left.
+    fetchpage(job) returns the parsed rows of the page or raises, an empty
+    list means the code is complete. writecode(job, rows) gets an iterator
+    over all rows of the code in page order. Errors are sorted by
+    crawlsched.classify, a rate limit waits ratedelay seconds doubling up to
+    a day. budget is a crawlsched.hostbudget on time.time() to start from,
+    one already blocked (the quota of a previous run) is waited out first.
+    """
+    worker = worker or workername()
+    budget = budget or crawlsched.hostbudget(basedelay=ratedelay)
+    while True:
+        wait = budget.readyat(time.time()) - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        job = queue.claim(source, worker, lease)
+        if job is None:
+            if queue.pending(source) == 0:
+                break
+            # other workers hold the rest, or jobs wait for a retry time
+            time.sleep(1)
+            continue
+        try:
+            rows = fetchpage(job)
+        except Exception as e:
+            kind = crawlsched.classify(e)
+            if verbose > 0:
+                print("%s %s page %d %s" % (kind, job["code"], job["page"], e))
+            if kind == crawlsched.RATELIMIT:
+                budget.ratelimited(time.time())
+                delay = budget.blockeduntil - time.time()
+                queue.retry(job, delay, e)
+                time.sleep(delay)
+            elif kind == crawlsched.TRANSIENT and job["tries"] < 5:
+                queue.retry(job, 5 * 2 ** job["tries"], e)
+            else:
+                queue.fail(job, e)
+            continue
+        budget.success()
+        if rows and job["page"] < maxpage:
+            queue.done(job, rows, nextpage=True)
+            continue
+        # last page: write the code before the job is done, a crash in between
+        # only costs refetching this one page
+        allrows = itertools.chain(queue.pages(job), rows)
+        first = next(allrows, None)
+        if first is not None:
+            writecode(job, itertools.chain([first], allrows))
+        queue.done(job, rows)
+        queue.written(job)
+        if verbose > 0:
+            print(job["code"])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Crawl job queue")
+    ap.add_argument("command", choices=["stats", "requeue", "purge"])
+    ap.add_argument("queue", help="queue file")
+    args = ap.parse_args()
+    if not os.path.exists(args.queue):
+        sys.stderr.write("%s doesn't exists\n" % args.queue)
+        sys.exit(1)
+    q = jobqueue(args.queue)
+    if args.command == "stats":
+        for source, state, count in q.stats():
+            print(source, state, count)
+    elif args.command == "requeue":
+        print("requeued %d" % q.requeue())
+    elif args.command == "purge":
+        print("purged %d" % q.purge())
@@ -14,10 +14,32 @@ import codecs
 import csv
 import os
 import time
+import json
+import shutil
 import argparse
+import batch
+import manifest
 
 requestcount = 0
 
+marketdict={
+    "東証1部":"T",
+    "マザーズ":"T",
+    "札証":"S",
+    "札幌ア":"S",
+    "東証":"T",
+    "東証1部":"T",
+    "東証2部":"T",
+    "東証JQG":"T",
+    "東証JQS":"T",
+    "東証外国":"T",
+    "福岡Q":"F",
+    "福証":"F",
+    "名古屋セ":"N",
+    "名証1部":"N",
+    "名証2部":"N",
+    }
+
 def getpricedata(code,market,sy,sm,sd,ey,em,ed,p):
     global requestcount
     #datare="<td>2020年4月8日</td><td>2,556</td><td>2,631</td><td>2,532</td><td>2,597</td><td>40,500</td><td>2,597</td>"
@@ -93,25 +115,152 @@ def getcodedataperiod(code,market,sy,sm,sd,ey,em,ed):
     return(stockdata)
 
 
-def joinstock(src1dir,src2dir,destdir,codefile="stocklist.csv"):
-    marketdict={
-        "東証1部":"T",
-        "マザーズ":"T",
-        "札証":"S",
-        "札幌ア":"S",
-        "東証":"T",
-        "東証1部":"T",
-        "東証2部":"T",
-        "東証JQG":"T",
-        "東証JQS":"T",
-        "東証外国":"T",
-        "福岡Q":"F",
-        "福証":"F",
-        "名古屋セ":"N",
-        "名証1部":"N",
-        "名証2部":"N",
-        }
+class mismatch(Exception):
+    """the overlapping day has other prices in the two files (split etc.)"""
+
+def joinedrows(stock1filename,stock2filename):
+    """
+    Rows of stock2filename followed by those of stock1filename, read while
+    they are written. The last row of stock2 is held back: on the first date
+    of stock1 it is dropped when the prices agree and raises mismatch when
+    they don't. Nothing comes out when either file has no rows.
+    """
+    with open(stock1filename) as sfp1:
+        reader1=csv.reader(sfp1)
+        head1=next(reader1,None)
+        if head1 is None:
+            return
+        last=None
+        with open(stock2filename) as sfp2:
+            for d in csv.reader(sfp2):
+                if last is not None:
+                    yield last
+                last=d
+        if last is None:
+            return
+        if last[0:3] == head1[0:3]:
+            if last[3:] != head1[3:]:
+                raise mismatch("{} {}".format(last,head1))
+        else:
+            yield last
+        yield head1
+        yield from reader1
+
+def writejoined(rows,stockfilename):
+    """
+    Write rows to a temporary file renamed to stockfilename, a file in
+    destdir is always complete. Returns the row count, 0 writes nothing.
+    """
+    tmpname=stockfilename + ".tmp%d" % os.getpid()
+    count=0
+    try:
+        with open(tmpname,"w") as wfp:
+            writer=csv.writer(wfp)
+            for d in rows:
+                writer.writerow(d)
+                count += 1
+    except BaseException:
+        os.remove(tmpname)
+        raise
+    if count:
+        os.replace(tmpname,stockfilename)
+    else:
+        os.remove(tmpname)
+    return count
 
+def headrow(filename):
+    """first row of a csv, None when it has none"""
+    with open(filename,newline="") as fp:
+        return next(csv.reader(fp),None)
+
+def tailrow(fp):
+    """
+    (offset,row) of the last line of the binary file fp, read backwards from
+    the end in blocks. (0,None) when the file has no rows.
+    """
+    fp.seek(0,os.SEEK_END)
+    pos=fp.tell()
+    data=b""
+    while pos > 0:
+        n=min(4096,pos)
+        pos -= n
+        fp.seek(pos)
+        data=fp.read(n) + data
+        body=data.rstrip(b"\r\n")
+        i=body.rfind(b"\n")
+        if i >= 0:
+            return pos + i + 1,next(csv.reader([body[i + 1:].decode("utf-8")]))
+    body=data.rstrip(b"\r\n")
+    if not body:
+        return 0,None
+    return 0,next(csv.reader([body.decode("utf-8")]))
+
+def copybytes(src,dst,n):
+    """copy n bytes from the position of src, returns the last block"""
+    data=b""
+    while n > 0:
+        data=src.read(min(n,1 << 16))
+        if not data:
+            break
+        dst.write(data)
+        n -= len(data)
+    return data
+
+def fsyncdir(dirname):
+    fd=os.open(dirname or ".",os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def rowdate(d):
+    """(year,month,day) of a csv row"""
+    return tuple(int(v) for v in d[0:3])
+
+def joincode(stock1filename,stock2filename,stockfilename):
+    """
+    Join without parsing the files: only the first row of stock1 (previous
+    got, newest first) and the last row of stock2 (post got) are read, the
+    rest is copied as bytes. Rows are newest first, so the new rows go in
+    front of the old file: stock2 up to its overlapping last row, then all of
+    stock1, into a temporary file that is fsynced and renamed to
+    stockfilename, which may be stock1filename itself.
+    When the last row of stock2 is older than the first row of stock1 the
+    file was joined before (or the directories are swapped), nothing is
+    written and the status is already, so -i can run twice.
+    Returns (status,detail), status one of joined, already, missing, mismatch.
+    """
+    if not os.path.exists(stock1filename) or not os.path.exists(stock2filename):
+        return "missing",None
+    head1=headrow(stock1filename)
+    if head1 is None:
+        return "missing",None
+    with open(stock2filename,"rb") as sfp2:
+        offset,last2=tailrow(sfp2)
+        if last2 is None:
+            return "missing",None
+        end=sfp2.tell()
+        if rowdate(last2) < rowdate(head1):
+            return "already",{"pre":head1,"post":last2}
+        if last2[0:3] == head1[0:3]:
+            if last2[3:] != head1[3:]:
+                return "mismatch",{"pre":head1,"post":last2}
+            end=offset
+        tmpname=stockfilename + ".tmp%d" % os.getpid()
+        with open(tmpname,"wb") as wfp:
+            sfp2.seek(0)
+            last=copybytes(sfp2,wfp,end)
+            if last and not last.endswith(b"\n"):
+                wfp.write(b"\r\n")
+            with open(stock1filename,"rb") as sfp1:
+                shutil.copyfileobj(sfp1,wfp)
+            wfp.flush()
+            os.fsync(wfp.fileno())
+    os.replace(tmpname,stockfilename)
+    fsyncdir(os.path.dirname(stockfilename))
+    return "joined",None
+
+def joinstock(src1dir,src2dir,destdir,codefile="stocklist.csv"):
     if not os.path.exists(src1dir):
         sys.stderr.write("%s doesn't exists\n" % src1dir)
         return
@@ -123,6 +272,7 @@ def joinstock(src1dir,src2dir,destdir,codefile="stocklist.csv"):
     if not os.path.exists(destdir):
         os.mkdir(destdir)
 
+    written=[]
     with codecs.open(codefile,encoding='utf-8') as cfp:
         retrycodefp=open("retrycode","w")
         retrycodewriter=csv.writer(retrycodefp)
@@ -134,51 +284,107 @@ def joinstock(src1dir,src2dir,destdir,codefile="stocklist.csv"):
                 stock1filename = os.path.join(src1dir,"%d.csv" % code)
                 stock2filename = os.path.join(src2dir,"%d.csv" % code)
                 stockfilename = os.path.join(destdir,"%d.csv" % code)
-                data1=[]
                 if not os.path.exists(stock1filename):
                     continue
-                with open(stock1filename) as sfp1:
-                    reader=csv.reader(sfp1)
-                    for d in reader:
-                        data1.append(d)
-                    sfp1.close()
-                if not data1:
-                    continue
-                data2=[]
                 if not os.path.exists(stock2filename):
                     continue
-                with open(stock2filename) as sfp2:
-                    reader=csv.reader(sfp2)
-                    for d in reader:
-                        data2.append(d)
-                    sfp2.close()
-                if not data2:
+                try:
+                    count=writejoined(joinedrows(stock1filename,stock2filename),stockfilename)
+                except mismatch:
+                    #Retry code
+                    retrycodewriter.writerow(line)
                     continue
-                if data1[0][0:3] == data2[-1][0:3]:
-                    if data1[0][3:] != data2[-1][3:]:
-                        #Retry code
-                        retrycodewriter.writerow(line)
-                        continue
-                    else:
-                        data2.pop()
-                
-                with open(stockfilename,"w") as wfp:
-                    writer=csv.writer(wfp)
-                    writer.writerows(data2)
-                    writer.writerows(data1)
-                    wfp.close()
+                if count:
+                    written.append(code)
                     print(code)
         cfp.close()
         retrycodefp.close()
+    manifest.updated(destdir,written)
+
+def joinshard(items,src1dir,src2dir,destdir):
+    """joincode over (index,line) items of the code file, destdir None joins into src1dir"""
+    results=[]
+    for index,line in items:
+        code=int(line[0])
+        stock1filename=os.path.join(src1dir,"%d.csv" % code)
+        stock2filename=os.path.join(src2dir,"%d.csv" % code)
+        stockfilename=os.path.join(destdir or src1dir,"%d.csv" % code)
+        status,detail=joincode(stock1filename,stock2filename,stockfilename)
+        results.append((index,line,status,detail))
+    return results
+
+def joinfast(src1dir,src2dir,destdir,codefile="stocklist.csv",jobs=1,refetchfile="refetch.json",verbose=0):
+    """
+    joinstock with joincode over jobs worker processes. destdir None
+    replaces the files of src1dir. Codes to get again are written to
+    retrycode as before and to refetchfile as json:
+      [{"code":1301,"market":"T","reason":"mismatch","pre":[...],"post":[...]},
+       {"code":1332,"market":"T","reason":"missing"}, ...]
+    mismatch: the overlapping day differs (split etc.), get the whole history
+    missing: no rows of the code in srcpost (or srcpre), get the period again
+    Codes already joined are left as they are and only counted.
+    """
+    for d in (src1dir,src2dir):
+        if not os.path.exists(d):
+            sys.stderr.write("%s doesn't exists\n" % d)
+            return
+    if destdir is not None and not os.path.exists(destdir):
+        os.mkdir(destdir)
+
+    with codecs.open(codefile,encoding='utf-8') as cfp:
+        items=[(i,line) for i,line in enumerate(csv.reader(cfp)) if len(line) > 2 and line[2] in marketdict]
+        cfp.close()
+    results=[r for part in batch.runshards(joinshard,items,jobs,src1dir,src2dir,destdir) for r in part]
+    results.sort(key=lambda r: r[0])
+
+    refetch=[]
+    written=[]
+    with open("retrycode","w") as retrycodefp:
+        retrycodewriter=csv.writer(retrycodefp)
+        for index,line,status,detail in results:
+            code=int(line[0])
+            if status == "joined":
+                written.append(code)
+                print(code)
+                continue
+            if status == "already":
+                if verbose > 0:
+                    print("{} already joined".format(code))
+                continue
+            if status == "mismatch":
+                retrycodewriter.writerow(line)
+            entry={"code":code,"market":marketdict[line[2]],"reason":status}
+            entry.update(detail or {})
+            refetch.append(entry)
+    with open(refetchfile,"w") as wfp:
+        # one code per line
+        lines=",\n".join(json.dumps(r,ensure_ascii=False) for r in refetch)
+        wfp.write("[\n%s\n]\n" % lines if refetch else "[]\n")
+    manifest.updated(destdir or src1dir,written)
+    print("joined {} already {} mismatch {} missing {}".format(
+        sum(1 for r in results if r[2] == "joined"),
+        sum(1 for r in results if r[2] == "already"),
+        sum(1 for r in refetch if r["reason"] == "mismatch"),
+        sum(1 for r in refetch if r["reason"] == "missing")))
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser(description="Conjuction yahoo stock.\n create retrycode file to reget")
     ap.add_argument("-v","--verbose",help="vorbose",action="count", default=0)
+    ap.add_argument("-c","--codefile",help="stock code list file default:%(default)s",default="stocklist.csv")
     ap.add_argument("srcpre",help="Source directory previous got")
     ap.add_argument("srcpost",help="Source directory post got")
-    ap.add_argument("dest",help="Destination directory")
+    ap.add_argument("dest",help="Destination directory, omitted with --inplace",nargs="?",default=None)
+    ap.add_argument("-j","--jobs",help="worker processes, joins by seeking the first and last rows default:%(default)s",type=int,default=0)
+    ap.add_argument("-i","--inplace",help="replace the files of srcpre instead of writing dest",action="store_true")
+    ap.add_argument("--refetch",help="json list of codes to get again, with -j or -i default:%(default)s",default="refetch.json")
     args=ap.parse_args()
     if args.verbose > 0:
         print(args)
-    joinstock(args.srcpre,args.srcpost,args.dest)
+    if args.dest is None and not args.inplace:
+        ap.error("dest or --inplace is required")
+    if args.jobs > 0 or args.inplace:
+        joinfast(args.srcpre,args.srcpost,None if args.inplace else args.dest,args.codefile,
+                 jobs=max(args.jobs,1),refetchfile=args.refetch,verbose=args.verbose)
+    else:
+        joinstock(args.srcpre,args.srcpost,args.dest,args.codefile)
     #joinstock(args.srcpre,sys.argv[2],sys.argv[3])
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""
+Content manifest of a csv data dir (data, stooqdata).
+
+<datadir>/manifest.csv        code,digest,rows,firstdate,lastdate,size,mtime
+
+digest is the sha256 of the file, rows and dates are those of the yahoo
+(y,m,d,... newest first) or stooq (Date,... ascending) layout. The fetch
+and join tools update the codes they write. A file changed by anything
+else is found by its size and mtime and hashed again, so the manifest
+never has to be trusted blindly.
+
+Downstream commands keep a resultcache: the per-code result of the last
+run with the digest of the input it was made from. Only codes whose digest
+changed are computed again.
+
+usage:
+  python3 manifest.py update data          hash every csv of data
+  python3 manifest.py show data 1301
+"""
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+import filelock
+
+MANIFESTNAME = "manifest.csv"
+MANIFESTHEADER = ["code", "digest", "rows", "firstdate", "lastdate", "size", "mtime"]
+
+def linedate(line):
+    """YYYYMMDD of a yahoo or stooq csv line (bytes), None for the header"""
+    f = line.split(b",", 3)
+    try:
+        if b"-" in f[0]:
+            y, m, d = f[0].split(b"-")
+        else:
+            y, m, d = f[0], f[1], f[2]
+        return int(y) * 10000 + int(m) * 100 + int(d)
+    except (ValueError, IndexError):
+        return None
+
+def scanfile(filename):
+    """entry of filename: digest, rows, firstdate, lastdate, size, mtime"""
+    st = os.stat(filename)
+    h = hashlib.sha256()
+    rows = 0
+    first = None
+    last = None
+    with open(filename, "rb") as fp:
+        for line in fp:
+            h.update(line)
+            if not line.strip():
+                continue
+            if first is None:
+                first = line
+                if linedate(line) is None:
+                    continue
+            rows += 1
+            last = line
+    dates = [d for d in (linedate(first or b""), linedate(last or b"")) if d is not None]
+    return {"digest": h.hexdigest(), "rows": rows,
+            "firstdate": min(dates) if dates else 0, "lastdate": max(dates) if dates else 0,
+            "size": st.st_size, "mtime": st.st_mtime_ns}
+
+class manifest:
+    def __init__(self, datadir):
+        self.datadir = datadir
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def manifestname(self):
+        return os.path.join(self.datadir, MANIFESTNAME)
+
+    def filename(self, code):
+        return os.path.join(self.datadir, "%d.csv" % code)
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.manifestname()):
+            return
+        with open(self.manifestname(), "r") as fp:
+            for line in csv.reader(fp):
+                if not line or line[0] == "code":
+                    continue
+                self.entries[int(line[0])] = {
+                    "digest": line[1], "rows": int(line[2]),
+                    "firstdate": int(line[3]), "lastdate": int(line[4]),
+                    "size": int(line[5]), "mtime": int(line[6])}
+
+    def save(self):
+        """Write the manifest through a temporary file, nothing when unchanged"""
+        if not self.dirty:
+            return
+        manifestname = self.manifestname()
+        tmpname = manifestname + ".tmp%d" % os.getpid()
+        with open(tmpname, "w") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(MANIFESTHEADER)
+            for code in sorted(self.entries):
+                e = self.entries[code]
+                writer.writerow([code] + [e[k] for k in MANIFESTHEADER[1:]])
+        os.replace(tmpname, manifestname)
+        self.dirty = False
+
+    def update(self, code):
+        """Hash code again after it was written, None when the file is gone"""
+        filename = self.filename(code)
+        if not os.path.exists(filename):
+            if self.entries.pop(code, None) is not None:
+                self.dirty = True
+            return None
+        self.entries[code] = scanfile(filename)
+        self.dirty = True
+        return self.entries[code]
+
+    def entry(self, code):
+        """Entry of code, hashed again only when size or mtime moved"""
+        filename = self.filename(code)
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            if self.entries.pop(code, None) is not None:
+                self.dirty = True
+            return None
+        e = self.entries.get(code)
+        if e is not None and e["size"] == st.st_size and e["mtime"] == st.st_mtime_ns:
+            return e
+        return self.update(code)
+
+    def digests(self, codes):
+        """code -> digest of the codes that have a file"""
+        result = {}
+        for code in codes:
+            e = self.entry(code)
+            if e is not None:
+                result[code] = e["digest"]
+        return result
+
+    def codes(self):
+        """codes of the csv files in datadir"""
+        return sorted(int(f[:-4]) for f in os.listdir(self.datadir)
+                      if f.endswith(".csv") and f[:-4].isdigit())
+
+def updated(datadir, codes):
+    """Record codes just written to datadir by a fetch or join tool"""
+    if not codes:
+        return
+    m = manifest(datadir)
+    for code in codes:
+        m.update(code)
+    m.save()
+
+class resultcache:
+    """
+    Per-code results of a downstream command and the input digest each one
+    was made from, in a json file. key holds the parameters of the run, a
+    cache written with another key is empty. save merges under the lock of
+    the file with what another run saved meanwhile: the codes this run put
+    or dropped are taken from it, the others as they are in the file.
+    """
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self.codes = self.load()
+        self.changed = set()
+        self.dropped = set()
+
+    def load(self):
+        """codes of the file when it was saved with key, else {}"""
+        try:
+            with open(self.filename, "r") as fp:
+                saved = json.load(fp)
+            if saved.get("key") == self.key:
+                return {int(c): v for c, v in saved["codes"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def stale(self, code, digest):
+        c = self.codes.get(code)
+        return c is None or c["digest"] != digest
+
+    def get(self, code):
+        return self.codes[code]["value"]
+
+    def put(self, code, digest, value=None):
+        self.codes[code] = {"digest": digest, "value": value}
+        self.changed.add(code)
+        self.dropped.discard(code)
+
+    def drop(self, codes):
+        """forget codes that are no longer in the input"""
+        for code in [c for c in self.codes if c not in codes]:
+            del self.codes[code]
+            self.changed.discard(code)
+            self.dropped.add(code)
+
+    def save(self):
+        with filelock.locked(self.filename):
+            codes = self.load()
+            for code in self.dropped:
+                codes.pop(code, None)
+            for code, c in self.codes.items():
+                if code in self.changed or code not in codes:
+                    codes[code] = c
+            self.codes = codes
+            tmpname = self.filename + ".tmp%d" % os.getpid()
+            with open(tmpname, "w") as fp:
+                json.dump({"key": self.key, "codes": self.codes}, fp, sort_keys=True)
+            os.replace(tmpname, self.filename)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Content manifest of a csv data dir")
+    ap.add_argument("command", choices=["update", "show"])
+    ap.add_argument("datadir", help="csv data dir")
+    ap.add_argument("codes", help="stock codes, default all", nargs="*", type=int)
+    args = ap.parse_args()
+    if not os.path.isdir(args.datadir):
+        sys.stderr.write("%s doesn't exists\n" % args.datadir)
+        sys.exit(1)
+    m = manifest(args.datadir)
+    codes = args.codes or m.codes()
+    if args.command == "update":
+        before = {c: e["digest"] for c, e in m.entries.items()}
+        digests = m.digests(codes)
+        changed = [c for c in codes if c in digests and before.get(c) != digests[c]]
+        m.save()
+        print("codes %d changed %d" % (len(digests), len(changed)))
+    elif args.command == "show":
+        for code in codes:
+            e = m.entry(code)
+            if e is not None:
+                print(code, *[e[k] for k in MANIFESTHEADER[1:]])
+        m.save()
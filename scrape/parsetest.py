@@ -1,41 +1,110 @@
-import getyahoostock
-import json
-import re
+#!/usr/bin/python3
+"""
+Regression fixture and micro-benchmark of getyahoostock.dataparse.
+
+Each recorded history page is parsed by dataparse (histories array only)
+and dataparsefull (whole __PRELOADED_STATE__), both must give the same rows.
+When <page>.csv exists the rows are also compared with it, -u writes it.
+Without pages the fixtures of parsetest/ are checked: a synthetic page in
+the shape of a yahoo history page and its .csv made from the fakesite.py
+prices, not from dataparse.
+
+usage:
+  python3 parsetest.py                           check parsetest/*.html
+  python3 parsetest.py -r 6702 page6702.html     record a page
+  python3 parsetest.py page*.html                check
+  python3 parsetest.py -b 200 page*.html         check and time both parsers
+"""
+import os
+import sys
+import csv
+import glob
+import time
 import argparse
+import getyahoostock
+
+FIXTUREDIR=os.path.join(os.path.dirname(os.path.abspath(__file__)),"parsetest")
+
+def readpage(filename):
+    with open(filename,"r",encoding="utf-8") as fp:
+        return fp.read()
+
+def readexpected(filename):
+    with open(filename,"r") as fp:
+        return [[float(v) for v in r] for r in csv.reader(fp)]
+
+def writeexpected(filename,rows):
+    with open(filename,"w") as wfp:
+        writer=csv.writer(wfp)
+        writer.writerows(rows)
+
+def checkpage(filename,args):
+    """list of error messages of one page"""
+    data=readpage(filename)
+    errors=[]
+    rows=getyahoostock.dataparse(data,args)
+    if getyahoostock.findhistories(data) is None:
+        errors.append("histories not found, fast path not used")
+    try:
+        full=getyahoostock.dataparsefull(data,args)
+    except ValueError as e:
+        errors.append("dataparsefull %s" % e)
+        full=rows
+    if rows != full:
+        errors.append("dataparse %d rows differ from dataparsefull %d rows" % (len(rows),len(full)))
+    expname=filename + ".csv"
+    if args.update:
+        writeexpected(expname,rows)
+    elif not os.path.exists(expname):
+        if os.path.dirname(os.path.abspath(filename)) == FIXTUREDIR:
+            errors.append("%s is missing" % expname)
+    else:
+        if [[float(v) for v in r] for r in rows] != readexpected(expname):
+            errors.append("rows differ from %s" % expname)
+    return errors
+
+def bench(func,data,args,count):
+    """seconds per call of func(data,args)"""
+    t=time.perf_counter()
+    for i in range(count):
+        func(data,args)
+    return (time.perf_counter() - t) / count
 
-def test1():
-    fp=open("/home/jun/stock/stsample.html","r")
-    #fp=open("/home/jun/stock/st.wind.json","r")
-    pat=re.compile('window.__PRELOADED_STATE__ = ')
-    #pat=re.compile('"mainStocksHistory":[^[]*"histories":(\[[^]*\])')
-    #pat=re.compile('mainStocksHistory.*')
-    for line in fp:
-        t=pat.search(line)
-        if t:
-            ep=t.end()
-            print(t.end())
-            break
-    jdata=line[ep:]
-    j=json.loads(jdata)
-    #print(j['mainStocksHistory']['history']["histories"])
-    for datedata in j['mainStocksHistory']['history']["histories"]:
-        print(datedata)
-        #print(t)
-        #print(t.groups())
-    #args=1
-    #getyahoostock.dataparse(data,args)
+def record(code,filename,args):
+    period=getyahoostock.parseperiod(args)
+    data=getyahoostock.send(code,"T",*period,1,args)
+    with open(filename,"w",encoding="utf-8") as wfp:
+        wfp.write(data)
 
 if __name__=="__main__":
-    ap = argparse.ArgumentParser(description="Conjuction yahoo stock.\n create retrycode file to reget")
+    ap = argparse.ArgumentParser(description="dataparse regression check and benchmark")
     ap.add_argument("-v","--verbose",help="vorbose",action="count", default=0)
+    ap.add_argument("-b","--bench",help="benchmark loops per page, 0 is no benchmark default:%(default)s",type=int,default=0)
+    ap.add_argument("-u","--update",help="write <page>.csv from the parsed rows",action="store_true")
+    ap.add_argument("-r","--record",help="fetch page 1 of this code into the page file",type=int,default=None)
+    ap.add_argument("-s","--startdate",help="record from date default:%(default)s",default="20100101")
+    ap.add_argument("-e","--enddate",help="record to date default:%(default)s",default="20100201")
+    ap.add_argument("pages",help="recorded history pages default:parsetest/*.html",nargs="*",default=None)
     args=ap.parse_args()
-    code=6702
-    market="T"
-    sy=2010
-    sm=1
-    sd=1
-    ey=2010
-    em=2
-    ed=1
-    args.verbose=1
-    data=getyahoostock.getcodedataperiod(code,market,sy,sm,sd,ey,em,ed,args)
+    if args.record is not None:
+        if not args.pages:
+            ap.error("-r needs the page file")
+        record(args.record,args.pages[0],args)
+        sys.exit(0)
+    if not args.pages:
+        args.pages=sorted(glob.glob(os.path.join(FIXTUREDIR,"*.html")))
+    failed=0
+    for filename in args.pages:
+        errors=checkpage(filename,args)
+        for e in errors:
+            print("NG {} {}".format(filename,e))
+        failed+=len(errors) > 0
+        if not errors:
+            print("OK {}".format(filename))
+        if args.bench > 0:
+            data=readpage(filename)
+            fast=bench(getyahoostock.dataparse,data,args,args.bench)
+            full=bench(getyahoostock.dataparsefull,data,args,args.bench)
+            print("  {} bytes dataparse {:.1f}us dataparsefull {:.1f}us x{:.1f}".format(
+                len(data),fast * 1e6,full * 1e6,full / fast))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+"""
+Columnar price store.
+
+One raw little-endian column file per field per code, read back through
+numpy.memmap, plus catalog.csv that records rows and date range per code.
+
+<storedir>/catalog.csv        code,source,rows,firstdate,lastdate
+<storedir>/<code>/date.bin     int32 YYYYMMDD, ascending
+<storedir>/<code>/open.bin     float64
+...
+
+Rows are always kept in ascending date order. The catalog row count is
+the committed length of a code, so a column tail written by an append that
+died before the catalog update is ignored by readers and cut off by the
+next append.
+write and append hold <storedir>/catalog.csv.lock and read the catalog
+again before they change it, so processes writing other codes of the same
+store (getstooqtock -q workers) don't drop each other's catalog rows.
+
+usage:
+  python3 pricestore.py migrate -f yahoo data datastore
+  python3 pricestore.py migrate -f stooq stooqdata stooqstore
+  python3 pricestore.py show datastore 1301
+"""
+import os
+import sys
+import csv
+import argparse
+import datetime
+import numpy as np
+import filelock
+
+FIELDS = [
+    ("date", "<i4"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8"),
+    ("adjclose", "<f8"),
+    ]
+
+CATALOGNAME = "catalog.csv"
+CATALOGHEADER = ["code", "source", "rows", "firstdate", "lastdate"]
+
+def datetoint(dt):
+    return dt.year * 10000 + dt.month * 100 + dt.day
+
+def inttodate(d):
+    d = int(d)
+    return datetime.date(d // 10000, d // 100 % 100, d % 100)
+
+def yahoorow(d):
+    """Yahoo 9 column csv line to store row"""
+    return (int(d[0]) * 10000 + int(d[1]) * 100 + int(d[2]),
+            float(d[3]), float(d[4]), float(d[5]), float(d[6]),
+            int(d[7]), float(d[8]))
+
+def stooqrow(d):
+    """stooq Date,Open,High,Low,Close,Volume line to store row"""
+    if d[0] == "Date":
+        return None
+    dd = d[0].split("-")
+    close = float(d[4])
+    return (int(dd[0]) * 10000 + int(dd[1]) * 100 + int(dd[2]),
+            float(d[1]), float(d[2]), float(d[3]), close,
+            int(float(d[5])) if len(d) > 5 and d[5] else 0, close)
+
+ROWCONVERTER = {
+    "yahoo": yahoorow,
+    "stooq": stooqrow,
+    }
+
+def readcsvrows(filename, source):
+    """Read csv of source layout and return rows in ascending date order"""
+    convert = ROWCONVERTER[source]
+    rows = []
+    with open(filename, "r") as fp:
+        reader = csv.reader(fp)
+        for d in reader:
+            if not d:
+                continue
+            r = convert(d)
+            if r:
+                rows.append(r)
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+class pricestore:
+    def __init__(self, path):
+        self.path = path
+        self.catalog = {}
+        self.loadcatalog()
+
+    def catalogname(self):
+        return os.path.join(self.path, CATALOGNAME)
+
+    def loadcatalog(self):
+        self.catalog = {}
+        catalogname = self.catalogname()
+        if not os.path.exists(catalogname):
+            return
+        with open(catalogname, "r") as fp:
+            reader = csv.reader(fp)
+            for line in reader:
+                if not line or line[0] == "code":
+                    continue
+                self.catalog[int(line[0])] = {
+                    "source": line[1],
+                    "rows": int(line[2]),
+                    "firstdate": int(line[3]),
+                    "lastdate": int(line[4]),
+                    }
+
+    def savecatalog(self):
+        """Write catalog through a temporary file and rename it in place"""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        catalogname = self.catalogname()
+        tmpname = catalogname + ".tmp%d" % os.getpid()
+        with open(tmpname, "w") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(CATALOGHEADER)
+            for code in sorted(self.catalog):
+                c = self.catalog[code]
+                writer.writerow([code, c["source"], c["rows"], c["firstdate"], c["lastdate"]])
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpname, catalogname)
+
+    def codes(self):
+        return sorted(self.catalog)
+
+    def exists(self, code):
+        return code in self.catalog
+
+    def rows(self, code):
+        if code not in self.catalog:
+            return 0
+        return self.catalog[code]["rows"]
+
+    def lastdate(self, code):
+        """Last stored date as YYYYMMDD int, or None"""
+        if code not in self.catalog or self.catalog[code]["rows"] == 0:
+            return None
+        return self.catalog[code]["lastdate"]
+
+    def codedir(self, code):
+        return os.path.join(self.path, "%d" % code)
+
+    def read(self, code, fields=None):
+        """Return dict field -> read only memmap, ascending date order"""
+        n = self.rows(code)
+        cols = {}
+        for name, dtype in FIELDS:
+            if fields and name not in fields:
+                continue
+            if n == 0:
+                cols[name] = np.zeros(0, dtype=dtype)
+                continue
+            cols[name] = np.memmap(os.path.join(self.codedir(code), name + ".bin"),
+                                   dtype=dtype, mode="r", shape=(n,))
+        return cols
+
+    def readrange(self, code, startdate, enddate, fields=None):
+        """Same as read restricted to startdate <= date <= enddate"""
+        cols = self.read(code, fields=set(fields or [f for f, t in FIELDS]) | {"date"})
+        s = np.searchsorted(cols["date"], startdate, side="left")
+        e = np.searchsorted(cols["date"], enddate, side="right")
+        return {k: v[s:e] for k, v in cols.items()}
+
+    def write(self, code, rows, source):
+        """Replace all data of code with rows (ascending date order)"""
+        with filelock.locked(self.catalogname()):
+            self.loadcatalog()
+            self._write(code, rows, source)
+
+    def _write(self, code, rows, source):
+        codedir = self.codedir(code)
+        tmpdir = codedir + ".tmp%d" % os.getpid()
+        if not os.path.exists(tmpdir):
+            os.makedirs(tmpdir)
+        self._writecolumns(tmpdir, rows, "wb")
+        if os.path.exists(codedir):
+            olddir = codedir + ".old%d" % os.getpid()
+            os.rename(codedir, olddir)
+            os.rename(tmpdir, codedir)
+            for name, dtype in FIELDS:
+                os.remove(os.path.join(olddir, name + ".bin"))
+            os.rmdir(olddir)
+        else:
+            os.rename(tmpdir, codedir)
+        self._commit(code, rows, source, 0)
+
+    def append(self, code, rows, source):
+        """Append rows newer than the last stored date"""
+        with filelock.locked(self.catalogname()):
+            self.loadcatalog()
+            self._append(code, rows, source)
+
+    def _append(self, code, rows, source):
+        if not self.exists(code):
+            self._write(code, rows, source)
+            return
+        if not rows:
+            return
+        n = self.rows(code)
+        if rows[0][0] <= self.catalog[code]["lastdate"]:
+            raise ValueError("code %d: append %d is not after %d" %
+                             (code, rows[0][0], self.catalog[code]["lastdate"]))
+        codedir = self.codedir(code)
+        for name, dtype in FIELDS:
+            # drop an uncommitted tail left by an interrupted append
+            with open(os.path.join(codedir, name + ".bin"), "r+b") as fp:
+                fp.truncate(n * np.dtype(dtype).itemsize)
+        self._writecolumns(codedir, rows, "ab")
+        self._commit(code, rows, source, n)
+
+    def _writecolumns(self, codedir, rows, mode):
+        for i, (name, dtype) in enumerate(FIELDS):
+            col = np.array([r[i] for r in rows], dtype=dtype)
+            with open(os.path.join(codedir, name + ".bin"), mode) as fp:
+                fp.write(col.tobytes())
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def _commit(self, code, rows, source, n):
+        if n == 0:
+            firstdate = rows[0][0] if rows else 0
+        else:
+            firstdate = self.catalog[code]["firstdate"]
+        self.catalog[code] = {
+            "source": source,
+            "rows": n + len(rows),
+            "firstdate": firstdate,
+            "lastdate": rows[-1][0] if rows else 0,
+            }
+        self.savecatalog()
+
+def migrate(args):
+    """Bulk convert every <code>.csv in args.srcdir into args.storedir"""
+    store = pricestore(args.storedir)
+    migrated = {}
+    for filename in sorted(os.listdir(args.srcdir)):
+        name, ext = os.path.splitext(filename)
+        if ext != ".csv" or not name.isdigit():
+            continue
+        code = int(name)
+        if store.exists(code) and not args.force:
+            if args.verbose > 1:
+                print("exists %d" % code)
+            continue
+        try:
+            rows = readcsvrows(os.path.join(args.srcdir, filename), args.format)
+        except (ValueError, IndexError) as e:
+            sys.stderr.write("%s: %s\n" % (filename, e))
+            continue
+        # write columns for each code, commit catalog once at the end
+        codedir = store.codedir(code)
+        if not os.path.exists(codedir):
+            os.makedirs(codedir)
+        store._writecolumns(codedir, rows, "wb")
+        migrated[code] = {
+            "source": args.format,
+            "rows": len(rows),
+            "firstdate": rows[0][0] if rows else 0,
+            "lastdate": rows[-1][0] if rows else 0,
+            }
+        if args.verbose > 0:
+            print(code, len(rows))
+    with filelock.locked(store.catalogname()):
+        store.loadcatalog()
+        store.catalog.update(migrated)
+        store.savecatalog()
+    print("migrated %d codes" % len(migrated))
+
+def show(args):
+    store = pricestore(args.storedir)
+    cols = store.read(int(args.code))
+    names = [f for f, t in FIELDS]
+    for i in range(len(cols["date"])):
+        print(",".join(str(cols[f][i]) for f in names))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Columnar price store")
+    ap.add_argument("-v", "--verbose", help="vorbose", action="count", default=0)
+    sub = ap.add_subparsers(dest="command")
+    mp = sub.add_parser("migrate", help="convert csv directory to store")
+    mp.add_argument("-f", "--format", help="csv layout yahoo or stooq default:%(default)s",
+                    choices=sorted(ROWCONVERTER), default="yahoo")
+    mp.add_argument("--force", help="overwrite codes already in store", action="store_true")
+    mp.add_argument("srcdir", help="csv directory")
+    mp.add_argument("storedir", help="store directory")
+    sp = sub.add_parser("show", help="dump one code as csv")
+    sp.add_argument("storedir", help="store directory")
+    sp.add_argument("code", help="stock code")
+    args = ap.parse_args()
+    if args.verbose > 0:
+        print(args)
+    if args.command == "migrate":
+        migrate(args)
+    elif args.command == "show":
+        show(args)
+    else:
+        ap.print_help()
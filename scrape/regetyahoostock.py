@@ -12,23 +12,41 @@ import re
 import codecs
 import csv
 import os
-import time
+import argparse
+import crawlsched
+import jobqueue
+import getyahoostock
+import httpcache
+import manifest
+import sys
 
-requestcount = 0
+YAHOOHOST = "info.finance.yahoo.co.jp"
+PERIOD = (2010,1,4,2020,9,18)
 
-def getpricedata(code,market,sy,sm,sd,ey,em,ed,p):
-    global requestcount
+scheduler = crawlsched.scheduler()
+
+marketdict={
+    "東証1部":"T",
+    "マザーズ":"T",
+    "札証":"S",
+    "札幌ア":"S",
+    "東証":"T",
+    "東証1部":"T",
+    "東証2部":"T",
+    "東証JQG":"T",
+    "東証JQS":"T",
+    "東証外国":"T",
+    "福岡Q":"F",
+    "福証":"F",
+    "名古屋セ":"N",
+    "名証1部":"N",
+    "名証2部":"N",
+    }
+
+def parsepricedata(data):
     #datare="<td>2020年4月8日</td><td>2,556</td><td>2,631</td><td>2,532</td><td>2,597</td><td>40,500</td><td>2,597</td>"
     datare=re.compile("<td>(\d+)年(\d+)月(\d+)日</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,.]+)</td><td>([0-9,]+)</td><td>([0-9,.]+)</td>")
     sdata=[]
-    tryrepeat = 1
-    while tryrepeat == 1:
-        data=send(code,market,sy,sm,sd,ey,em,ed,p)
-        if data != -1:
-            tryrepat = 0
-            break
-        time.sleep(60*60*24)
-        requestcount = 0
     vdata=data.split("\n")
     divkey="stocksHistoryPageing"
     for i in range(len(vdata)):
@@ -54,16 +72,9 @@ def getpricedata(code,market,sy,sm,sd,ey,em,ed,p):
     return sdata
    
 def send(code,market,sy,sm,sd,ey,em,ed,p):
-    """send query to yahoo api"""
-    global requestcount
+    """send query to yahoo api, urllib errors are raised"""
     url = getcodeurl(code,market,sy,sm,sd,ey,em,ed,p)
-    try:
-        response = urllib.request.urlopen(url)
-    except urllib.error.HTTPError:
-        print("Request count %d" % requestcount)
-        return -1
-    data = response.read().decode('utf-8')
-    requestcount += 1
+    data = httpcache.urlopen(url).body.decode('utf-8')
     return data
 
 def getcodeurl(code,market,sy,sm,sd,ey,em,ed,p):
@@ -79,55 +90,67 @@ def getcodeurl(code,market,sy,sm,sd,ey,em,ed,p):
     url="https://info.finance.yahoo.co.jp/history/?code=%4.4d.%s&sy=%d&sm=%d&sd=%d&ey=%d&em=%d&ed=%d&tm=d&p=%d" % (code,market,sy,sm,sd,ey,em,ed,p)
     return url
 
-def getcodedataperiod(code,market,sy,sm,sd,ey,em,ed):
-    p=1
-    stockdata=[]
-    while p < 500:
-        data = getpricedata(code,market,sy,sm,sd,ey,em,ed,p)
-        if not data:
-            break
-        stockdata += data
-        p += 1
-    return(stockdata)
+class retrycrawl(getyahoostock.historycrawl):
+    """historycrawl of the old history pages"""
+    def url(self,j):
+        return getcodeurl(j.key,j.data[0],*self.period,j.page)
 
+    def parse(self,body):
+        return parsepricedata(body)
 
 def getstock(codefile="retrycode"):
-    marketdict={
-        "東証1部":"T",
-        "マザーズ":"T",
-        "札証":"S",
-        "札幌ア":"S",
-        "東証":"T",
-        "東証1部":"T",
-        "東証2部":"T",
-        "東証JQG":"T",
-        "東証JQS":"T",
-        "東証外国":"T",
-        "福岡Q":"F",
-        "福証":"F",
-        "名古屋セ":"N",
-        "名証1部":"N",
-        "名証2部":"N",
-        }
-
+    """
+    Pages of every code not yet in data/ go through the module scheduler, a
+    rate limit holds the host and the run goes on once it opens, a page given
+    up drops only its code.
+    """
+    targets=[]
     with codecs.open(codefile,encoding='utf-8') as cfp:
         reader = csv.reader(cfp)
         for line in reader:
             if line[2] in marketdict:
                 code=int(line[0])
-                market=marketdict[line[2]]
                 stockfilename = os.path.join("data","%d.csv" % code)
                 if os.path.exists(stockfilename):
                     continue
-                data=getcodedataperiod(code,market,2010,1,4,2020,9,18)
-                if data:
-                    with open(stockfilename,"w") as wfp:
-                        writer=csv.writer(wfp)
-                        writer.writerows(data)
-                        wfp.close()
-                        print(code)
-                        time.sleep(1)
+                targets.append((code,marketdict[line[2]],stockfilename))
+        cfp.close()
+    crawl=retrycrawl(targets,PERIOD,argparse.Namespace(verbose=0),pause=1)
+    for j in crawl.jobs():
+        scheduler.add(j)
+    crawlsched.runsync(scheduler,lambda j: httpcache.urlopen(crawl.url(j)).body.decode('utf-8'),
+        lambda j,body: crawl.handle(scheduler,j,body))
+    crawl.report(scheduler)
+    manifest.updated("data",crawl.written)
+
+def queuestock(queuefile,codefile="retrycode",ratedelay=None):
+    """Feed codefile into the job queue and work on it, ratedelay defaults to the scheduler's"""
+    queue=jobqueue.jobqueue(queuefile)
+    jobs=[]
+    with codecs.open(codefile,encoding='utf-8') as cfp:
+        reader = csv.reader(cfp)
+        for line in reader:
+            if line[2] in marketdict:
+                code=int(line[0])
+                if os.path.exists(os.path.join("data","%d.csv" % code)):
+                    continue
+                jobs.append(("reget",code,marketdict[line[2]],"20100104","20200918",1))
         cfp.close()
+    queue.addmany(jobs)
+
+    def fetchpage(job):
+        data=send(job["code"],job["market"],*PERIOD,job["page"])
+        return parsepricedata(data)
+
+    def writecode(job,rows):
+        getyahoostock.writestock(os.path.join("data","%d.csv" % job["code"]),rows)
+
+    jobqueue.runworker(queue,"reget",fetchpage,writecode,verbose=1,
+                       ratedelay=scheduler.ratedelay if ratedelay is None else ratedelay)
+    queue.close()
 
 if __name__ == '__main__':
-    getstock()
+    if len(sys.argv) > 1:
+        queuestock(sys.argv[1])
+    else:
+        getstock()
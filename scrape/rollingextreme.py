@@ -0,0 +1,56 @@
+"""
+Rolling max/min over calendar day windows with monotonic deques.
+
+Every row is pushed and popped at most once per deque, so one pass over
+a code is O(n) for each window regardless of the window length.
+"""
+import collections
+
+class windowextreme:
+    """max and min of the rows within span of the newest row, span None is all-time"""
+    def __init__(self, span):
+        self.span = span
+        self.maxq = collections.deque()
+        self.minq = collections.deque()
+
+    def push(self, dt, high, low):
+        maxq = self.maxq
+        minq = self.minq
+        while maxq and maxq[-1][1] <= high:
+            maxq.pop()
+        maxq.append((dt, high))
+        while minq and minq[-1][1] >= low:
+            minq.pop()
+        minq.append((dt, low))
+        if self.span is not None:
+            lt = dt - self.span
+            while maxq[0][0] < lt:
+                maxq.popleft()
+            while minq[0][0] < lt:
+                minq.popleft()
+
+    def max(self):
+        return self.maxq[0][1]
+
+    def min(self):
+        return self.minq[0][1]
+
+def rollingextremes(dates, highs, lows, spans):
+    """
+    dates, highs, lows in ascending date order.
+    spans is a list of datetime.timedelta or None for all-time.
+    return {(span, "max"): list, (span, "min"): list}, value at t covers
+    the rows with dt[t] - span <= date <= dt[t].
+    """
+    windows = [windowextreme(s) for s in spans]
+    result = {}
+    for s in spans:
+        result[(s, "max")] = []
+        result[(s, "min")] = []
+    outs = [(w, result[(w.span, "max")], result[(w.span, "min")]) for w in windows]
+    for dt, high, low in zip(dates, highs, lows):
+        for w, maxout, minout in outs:
+            w.push(dt, high, low)
+            maxout.append(w.max())
+            minout.append(w.min())
+    return result
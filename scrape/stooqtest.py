@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+Checks of getstooqtock against the local stand-in server of fakesite.py.
+
+  update   a pricestore filled up to one day, then -u after more days:
+           only the new days are appended, a second -u changes nothing
+  limit    the quota answer with HTTPCACHE: it is not cached, every code
+           is written once the quota opens again
+
+usage:
+  python3 stooqtest.py
+  python3 stooqtest.py -k update       keep the work dir
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import fakesite
+import crawlsched
+import httpcache
+import pricestore
+import getstooqtock
+
+CODES = [1301, 7203]
+
+def stooqargs(workdir, update):
+    codefile = os.path.join(workdir, "codes.csv")
+    with open(codefile, "w") as wfp:
+        wfp.write("".join("%d\n" % code for code in CODES))
+    return argparse.Namespace(verbose=0, codefile=codefile,
+                              datadir=os.path.join(workdir, "stooqdata"),
+                              store=os.path.join(workdir, "store"), update=update,
+                              concurrency=2, rate=0, budget=0, ratedelay=1, queue=None)
+
+def serve(site, cachedir=None):
+    base = site.start()
+    os.environ.pop("HTTPCACHE", None)
+    os.environ["HTTPSITES"] = "https://stooq.com=%s" % base
+    httpcache.sites = None
+    httpcache.configure(cachedir)
+
+def storedays(path):
+    store = pricestore.pricestore(path)
+    return {code: [int(d) for d in store.read(code, ["date"])["date"]] for code in CODES}
+
+def testupdate(workdir):
+    """list of error messages"""
+    errors = []
+    args = stooqargs(workdir, False)
+    site = fakesite.fakesite(stooqfrom="20200101", today="20201113")
+    serve(site)
+    try:
+        getstooqtock.getstock(args)
+    finally:
+        site.stop()
+    before = storedays(args.store)
+    site = fakesite.fakesite(stooqfrom="20200101", today="20201127")
+    serve(site)
+    try:
+        args.update = True
+        getstooqtock.getstock(args)
+        after = storedays(args.store)
+        getstooqtock.getstock(args)
+        again = storedays(args.store)
+    finally:
+        site.stop()
+    for code in CODES:
+        if not before[code] or before[code][-1] != 20201113:
+            errors.append("%d first run ends at %s" % (code, before[code][-1:] or "nothing"))
+            continue
+        new = after[code][len(before[code]):]
+        if after[code][:len(before[code])] != before[code]:
+            errors.append("%d stored days changed by -u" % code)
+        if new[:1] != [20201116] or new[-1:] != [20201127] or new != sorted(set(new)):
+            errors.append("%d -u appended %s" % (code, new))
+        if again[code] != after[code]:
+            errors.append("%d second -u went from %d to %d days" % (code, len(after[code]), len(again[code])))
+    return errors
+
+def testlimit(workdir):
+    """list of error messages"""
+    errors = []
+    args = stooqargs(workdir, False)
+    args.concurrency = 1
+    args.ratedelay = 0.5
+    cachedir = os.path.join(workdir, "httpcache")
+    site = fakesite.fakesite(limit=1, limitwindow=1, stooqfrom="20200101", today="20201113")
+    serve(site, cachedir)
+    try:
+        getstooqtock.getstock(args)
+    finally:
+        site.stop()
+        httpcache.configure(None)
+    store = pricestore.pricestore(args.store)
+    for code in CODES:
+        if store.lastdate(code) != 20201113:
+            errors.append("%d not written" % code)
+    limited = sum(1 for r in site.log if r[4])
+    if limited == 0:
+        errors.append("the quota was never answered")
+    cache = httpcache.httpcache(cachedir)
+    for name in cache.records():
+        with open(name, "r") as fp:
+            meta = json.load(fp)
+        if crawlsched.LIMITTEXT.encode("utf-8") in cache.body(meta):
+            errors.append("quota answer cached for %s" % meta["url"])
+    return errors
+
+TESTS = {
+    "update": testupdate,
+    "limit": testlimit,
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="getstooqtock checks against fakesite")
+    ap.add_argument("-k", "--keep", help="keep the work dir", action="store_true")
+    ap.add_argument("tests", help=" ".join(TESTS), nargs="*", default=list(TESTS))
+    args = ap.parse_args()
+    failed = 0
+    for name in args.tests:
+        workdir = tempfile.mkdtemp(prefix="stooqtest")
+        errors = TESTS[name](workdir)
+        for e in errors:
+            print("NG {} {}".format(name, e))
+        if not errors:
+            print("OK {}".format(name))
+        failed += len(errors) > 0
+        if args.keep:
+            print("  work {}".format(workdir))
+        else:
+            shutil.rmtree(workdir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+"""
+Incremental yahoo history update per code.
+
+For each code the last stored date is read from the head of data/<code>.csv
+(files are newest first) or from the pricestore catalog, and only
+lastdate..enddate is fetched. The row of lastdate comes back with the new
+rows and is compared with the stored one:
+  same       the new rows are added, csv through a temporary file and
+             rename, pricestore by appending the columns
+  different  prices were adjusted (split etc.), the whole range from
+             startdate is fetched again and replaces the code
+This replaces the data-dir rename, joinyahoostock and retrycode round trip.
+A stored code that gets no rows back is failed, it keeps its data and its
+stocklist line goes to --retryfile for a run with -c retryfile.
+
+usage:
+  python3 updatestock.py -e 20201130
+  python3 updatestock.py -e 20201130 --store datastore
+"""
+import os
+import csv
+import codecs
+import shutil
+import datetime
+import argparse
+import getyahoostock
+import pricestore
+import manifest
+
+def splitdate(date):
+    """YYYYMMDD string or int to (y,m,d)"""
+    date=int(date)
+    return date // 10000,date // 100 % 100,date % 100
+
+def readhead(filename):
+    """First row of csv, the newest one for yahoo files"""
+    with open(filename,"r") as fp:
+        line=fp.readline()
+    if not line.strip():
+        return None
+    return next(csv.reader([line]))
+
+def csvlastrow(filename):
+    """(date,row) of the newest stored row, None for an empty file"""
+    d=readhead(filename)
+    if d is None:
+        return None
+    row=pricestore.yahoorow(d)
+    return row[0],row
+
+def storelastrow(store,code):
+    lastdate=store.lastdate(code)
+    if lastdate is None:
+        return None
+    n=store.rows(code)
+    cols=store.read(code)
+    row=tuple(cols[f][n-1].item() for f,t in pricestore.FIELDS)
+    return lastdate,row
+
+def fetchrows(code,market,startdate,enddate,args):
+    """rows of startdate..enddate as store rows, ascending"""
+    data=getyahoostock.getcodedataperiod(code,market,*splitdate(startdate),*splitdate(enddate),args)
+    rows=[pricestore.yahoorow(d) for d in data]
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+def rowtocsv(r):
+    y,m,d=splitdate(r[0])
+    return [y,m,d]+list(r[1:])
+
+def writecsv(filename,rows,oldfilename=None):
+    """rows newest first, then the old file as it is, replaced atomically"""
+    tmpname=filename + ".tmp%d" % os.getpid()
+    with open(tmpname,"w") as wfp:
+        writer=csv.writer(wfp)
+        writer.writerows(rowtocsv(r) for r in reversed(rows))
+        if oldfilename:
+            with open(oldfilename,"r",newline="") as rfp:
+                shutil.copyfileobj(rfp,wfp)
+        wfp.flush()
+        os.fsync(wfp.fileno())
+    os.replace(tmpname,filename)
+
+def updatecode(code,market,args,store=None):
+    """
+    return one of new, uptodate, appended, refetched, nodata (nothing of a
+    new code), failed (nothing came back for a stored code)
+    """
+    stockfilename=os.path.join(args.datadir,"%d.csv" % code)
+    if store is not None:
+        last=storelastrow(store,code)
+    elif os.path.exists(stockfilename):
+        last=csvlastrow(stockfilename)
+    else:
+        last=None
+
+    if last is None:
+        rows=fetchrows(code,market,args.startdate,args.enddate,args)
+        if not rows:
+            return "nodata"
+        if store is not None:
+            store.write(code,rows,"yahoo")
+        else:
+            writecsv(stockfilename,rows)
+        return "new"
+
+    lastdate,lastrow=last
+    if lastdate >= int(args.enddate):
+        return "uptodate"
+    rows=fetchrows(code,market,lastdate,args.enddate,args)
+    if rows and rows[0][0] == lastdate and rows[0] == lastrow:
+        rows=rows[1:]
+        if not rows:
+            return "uptodate"
+        if store is not None:
+            store.append(code,rows,"yahoo")
+        else:
+            writecsv(stockfilename,rows,stockfilename)
+        return "appended"
+
+    if not rows:
+        # lastdate is a trading day, an empty answer is a failed fetch
+        return "failed"
+    # the overlap row differs or is missing: history was adjusted
+    if args.verbose > 0:
+        print("overlap mismatch {} {} {}".format(code,lastrow,rows[0]))
+    rows=fetchrows(code,market,args.startdate,args.enddate,args)
+    if not rows:
+        return "failed"
+    if store is not None:
+        store.write(code,rows,"yahoo")
+    else:
+        writecsv(stockfilename,rows)
+    return "refetched"
+
+def updatestock(args):
+    store=pricestore.pricestore(args.store) if args.store else None
+    counts={}
+    written=[]
+    retry=[]
+    with codecs.open(args.codefile,encoding='utf-8') as cfp:
+        reader = csv.reader(cfp)
+        for line in reader:
+            if line[2] not in getyahoostock.marketdict:
+                continue
+            code=int(line[0])
+            market=getyahoostock.marketdict[line[2]]
+            result=updatecode(code,market,args,store)
+            counts[result]=counts.get(result,0) + 1
+            if store is None and result in ("new","appended","refetched"):
+                written.append(code)
+            if result == "failed":
+                retry.append(line)
+            print(code,result)
+        cfp.close()
+    with open(args.retryfile,"w") as wfp:
+        csv.writer(wfp).writerows(retry)
+    manifest.updated(args.datadir,written)
+    print(" ".join("%s:%d" % (k,v) for k,v in sorted(counts.items())))
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Update yahoo stock history with the missing days only")
+    ap.add_argument("-v","--verbose",help="vorbose",action="count", default=0)
+    ap.add_argument("-c","--codefile",help="get stock code list file default:%(default)s",default="stocklist.csv")
+    ap.add_argument("-s","--startdate",help="from date of a full fetch default:%(default)s",default="20100101")
+    ap.add_argument("-e","--enddate",help="get stock to date default:%(default)s",
+                    default=datetime.date.today().strftime("%Y%m%d"))
+    ap.add_argument("-d","--datadir",help="csv data dir default:%(default)s",default="data")
+    ap.add_argument("--store",help="update this pricestore instead of datadir csv",default=None)
+    ap.add_argument("--retryfile",help="stocklist lines of the failed codes default:%(default)s",default="updateretry")
+    ap.add_argument("-j","--concurrency",help="pages of a code in flight, 0 is sequential default:%(default)s",type=int,default=0)
+    ap.add_argument("-r","--rate",help="requests per second with -j default:%(default)s",type=float,default=1.0)
+    args=ap.parse_args()
+    if args.verbose > 0:
+        print(args)
+    updatestock(args)